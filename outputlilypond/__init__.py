@@ -23,4 +23,10 @@
 Init file for outputlilypond.
 """
 
-from outputlilypond.__main__ import run_lilypond, process_score
+__version__ = '1.0.0'
+
+from outputlilypond.core import run_lilypond, process_score, process_score_iter, \
+    process_score_to, process_corpus, LilyConverter
+from outputlilypond.render import run_lilypond_batch, render_source
+from outputlilypond.cache import PDFCache, PartCache
+from outputlilypond.session import IncrementalSession
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: aio.py
+# Purpose: asyncio versions of process_score() and run_lilypond()
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+"""
+:mod:`asyncio` versions of :func:`~outputlilypond.process_score` and
+:func:`~outputlilypond.run_lilypond`, so they don't block the event loop.
+
+This module requires Python 3.5 or newer, so it isn't imported by ``import outputlilypond``.
+
+>>> from outputlilypond import aio
+>>> async def engrave(the_score, filename):
+...     with open(filename, 'w') as ly_file:
+...         ly_file.write(await aio.process_score(the_score))
+...     return await aio.run_lilypond(filename, timeout=60)
+
+Every coroutine here may be cancelled. If :func:`run_lilypond` is cancelled, LilyPond is killed.
+If :func:`process_score` is cancelled, the part being converted is finished (it's in another
+thread, and can't be interrupted), but no further work is done.
+"""
+
+import asyncio
+import time
+from asyncio.subprocess import PIPE
+from outputlilypond import core as main, render, settings, stats
+
+# asyncio.get_running_loop() is new in Python 3.7. In a coroutine, get_event_loop() returns the
+# running loop too, but it's deprecated there.
+_get_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+def _next_piece(pieces):
+    "Return the next piece of a LilyPond file, or ``None`` when there are no more."
+    return next(pieces, None)
+
+
+async def process_score(the_score, the_settings=None, converter=None, executor=None):
+    """
+    Convert a :class:`music21.stream.Stream` into a LilyPond source file, like
+    :func:`outputlilypond.process_score`, without blocking the event loop.
+
+    :param the_score: The :class:`Stream` to output.
+    :type the_score: :class:`music21.stream.Stream`
+    :param the_settings: An optional settings object.
+    :type the_settings: :class:`settings.LilyPondSettings`
+    :param converter: An optional :class:`~outputlilypond.LilyConverter`, whose worker pool will
+        be used. The default is to start a new pool for this score.
+    :type converter: :class:`~outputlilypond.LilyConverter`
+    :param executor: The :class:`concurrent.futures.Executor` in which to run the conversion. The
+        default is the event loop's default executor.
+    :type executor: :class:`concurrent.futures.Executor`
+
+    :returns: A string that holds an entire LilyPond source file.
+    :rtype: str
+    """
+    loop = _get_running_loop()
+    if the_settings is None:
+        the_settings = settings.LilyPondSettings()
+    if converter is None:
+        pieces = await loop.run_in_executor(executor, main.process_score_iter, the_score,
+                                            the_settings)
+    else:
+        pieces = await loop.run_in_executor(executor, converter.process_score_iter, the_score,
+                                            the_settings)
+
+    # We convert one piece at a time, so we can stop between pieces if we're cancelled.
+    post = []
+    while True:
+        step = loop.run_in_executor(executor, _next_piece, pieces)
+        try:
+            piece = await asyncio.shield(step)
+        except asyncio.CancelledError:
+            # The piece in progress can't be interrupted, so we stop once it's finished.
+            if hasattr(pieces, 'close'):
+                step.add_done_callback(lambda _: loop.run_in_executor(executor, pieces.close))
+            raise
+        if piece is None:
+            break
+        post.append(piece)
+
+    return ''.join(post)
+
+
+async def run_lilypond(filename, the_settings=None, timeout=None, semaphore=None, cache=None):
+    """
+    Run LilyPond on a file, like :func:`outputlilypond.run_lilypond`, without blocking the event
+    loop. If this coroutine is cancelled, LilyPond is killed.
+
+    :param filename: The full pathname to the file on which to run LilyPond.
+    :type filename: str
+    :param the_settings: An optional settings object.
+    :type the_settings: :class:`settings.LilyPondSettings`
+    :param timeout: The number of seconds after which we kill LilyPond. The default, ``None``,
+        waits forever.
+    :type timeout: float
+    :param semaphore: An optional :class:`asyncio.Semaphore` to acquire while LilyPond runs. Share
+        one semaphore between calls to limit how many LilyPond processes run at once.
+    :type semaphore: :class:`asyncio.Semaphore`
+    :param cache: An optional cache of PDFs. If the PDF for this file is in the cache, LilyPond
+        doesn't run.
+    :type cache: :class:`~outputlilypond.cache.PDFCache`
+
+    :returns: The outcome.
+    :rtype: :class:`render.RenderResult`
+
+    :raises: :exc:`OSError` if LilyPond cannot be started.
+    """
+    if semaphore is not None:
+        async with semaphore:
+            return await run_lilypond(filename, the_settings, timeout, cache=cache)
+
+    if the_settings is None:
+        the_settings = settings.LilyPondSettings()
+    with stats.timer(the_settings.stats, 'lilypond'):
+        return await _run_lilypond(filename, the_settings, timeout, cache)
+
+
+async def _run_lilypond(filename, the_settings, timeout, cache):
+    "Do the work of :func:`run_lilypond`, once we have the semaphore."
+    loop = _get_running_loop()
+    # finding LilyPond may start a subprocess, but only the first time
+    await loop.run_in_executor(None, the_settings.get_property, 'lilypond_path')
+    if cache is not None:
+        key, result = await loop.run_in_executor(None, render.cache_lookup, filename,
+                                                 the_settings, cache)
+        if result is not None:
+            return result
+    output = render.output_basename(filename)
+    cmd = render.lilypond_command(filename, the_settings, output)
+
+    start = time.time()
+    lily = await asyncio.create_subprocess_exec(*cmd, stdout=PIPE, stderr=PIPE)
+    if the_settings.stats is not None:
+        the_settings.stats.count_lilypond_launch()
+    timed_out = False
+    try:
+        stdout, stderr = await asyncio.wait_for(lily.communicate(), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        stdout, stderr = b'', b''
+        _kill(lily)
+        await lily.wait()
+    except asyncio.CancelledError:
+        _kill(lily)
+        await lily.wait()
+        raise
+
+    result = render.RenderResult(filename, output + '.pdf', lily.returncode,
+                                 stdout.decode('utf-8', 'replace'),
+                                 stderr.decode('utf-8', 'replace'),
+                                 timed_out, time.time() - start, False)
+    if cache is not None:
+        await loop.run_in_executor(None, render.cache_store, cache, key, result)
+    return result
+
+
+def _kill(process):
+    "Kill a subprocess that may have already finished."
+    try:
+        process.kill()
+    except ProcessLookupError:
+        pass
@@ -0,0 +1,529 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: benchmark.py
+# Purpose: Benchmarks for outputlilypond.
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+"""
+Benchmarks for outputlilypond. Run them like this:
+
+    $ python -m outputlilypond.benchmark corpus
+    $ python -m outputlilypond.benchmark synthetic --parts 4 --measures 50 200 800 --notes 8
+
+* ``corpus``: for every file in the ``test_corpus`` directory (or the files you name), the time to
+  parse it with :mod:`music21`, to convert it in this process without any workers ("serial") and
+  with the pool of a :class:`~outputlilypond.LilyConverter` ("pooled"), to convert every part with
+  :func:`functions.stream_to_lily` in this process, and to run
+  :func:`~outputlilypond.run_lilypond` with a stub LilyPond that only copies its input, so we
+  measure our own overhead and not LilyPond's. It also reports the notes converted per second, and
+  the peak memory allocated in this process while converting the parts.
+* ``many``: the time to convert many copies of one small file (``bwv77.mxl`` unless you name
+  another), including parsing: one at a time with :func:`~outputlilypond.process_score`, and with
+  :func:`~outputlilypond.process_corpus` in its two modes. This shows the cost of sending every
+  part to a worker when the scores are small.
+* ``synthetic``: the same, without parsing, for made-up scores of every combination of the sizes
+  given with ``--parts``, ``--measures``, and ``--notes`` (per measure), so you can see how the
+  throughput scales.
+* ``annotations``: the time to convert one :class:`Measure` where every note has a
+  :class:`TextExpression`, for an increasing number of notes. The time per annotation should stay
+  about the same, showing that the conversion is linear in the number of annotations.
+* ``measures``: the time to convert one :class:`Part` of full-measure rests with only one
+  :class:`TimeSignature`, for an increasing number of measures. The time per measure should stay
+  about the same, showing that we don't search for the :class:`TimeSignature` in every measure.
+
+The times are the best of several runs (``--repeat``). The worker pool is started before the
+timing starts, so the "pooled" times don't include starting the workers. Peak memory
+is found with :mod:`tracemalloc`, which needs Python 3.4 or newer, and doesn't include the memory
+used by the worker processes.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import timeit
+from collections import OrderedDict
+from music21 import converter, expressions, meter, note, stream
+from outputlilypond import core, functions, ir, settings
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+"""
+The files converted by the ``corpus`` benchmark, in the ``test_corpus`` directory of a source
+checkout.
+"""
+CORPUS_FILES = ('bwv77.mxl', 'Jos2308.krn', 'madrigal51.mxl', 'sqOp76-4-i.midi')
+
+"""
+The version reported by the stub LilyPond from :func:`make_stub_lilypond`.
+"""
+STUB_VERSION = '2.18.2'
+
+"""
+The source of the stub LilyPond. It writes its input to the PDF, so it takes about as long as
+starting Python.
+"""
+_STUB_SOURCE = '''#!%(python)s
+import shutil, sys
+args = sys.argv[1:]
+if '--version' in args:
+    print('GNU LilyPond %(version)s')
+    sys.exit(0)
+shutil.copyfile(args[-1], args[args.index('-o') + 1] + '.pdf')
+'''
+
+
+def make_annotated_measure(annotations):
+    """
+    Make a :class:`Measure` of sixteenth notes where every note has a :class:`TextExpression` at
+    the same offset.
+
+    :param annotations: The number of notes (and annotations).
+    :type annotations: int
+
+    :returns: The new :class:`Measure`.
+    :rtype: :class:`music21.stream.Measure`
+    """
+    meas = stream.Measure()
+    for i in range(annotations):
+        offset = i * 0.25
+        meas.insert(offset, note.Note('C4', quarterLength=0.25))
+        meas.insert(offset, expressions.TextExpression(u'I'))
+    return meas
+
+
+def make_long_part(measures):
+    """
+    Make a :class:`Part` of full-measure rests in 4/4, where only the first :class:`Measure` has a
+    :class:`TimeSignature`.
+
+    :param measures: The number of measures.
+    :type measures: int
+
+    :returns: The new :class:`Part`.
+    :rtype: :class:`music21.stream.Part`
+    """
+    part = stream.Part()
+    for i in range(measures):
+        meas = stream.Measure(number=i + 1)
+        if 0 == i:
+            meas.append(meter.TimeSignature('4/4'))
+        meas.append(note.Rest(quarterLength=4.0))
+        part.append(meas)
+    return part
+
+
+def make_synthetic_score(parts, measures, notes_per_measure):
+    """
+    Make a :class:`Score` of quarter notes. Every :class:`Measure` holds ``notes_per_measure``
+    notes, so the :class:`TimeSignature` is that many quarter notes.
+
+    :param parts: The number of parts.
+    :type parts: int
+    :param measures: The number of measures in every part.
+    :type measures: int
+    :param notes_per_measure: The number of notes in every measure.
+    :type notes_per_measure: int
+
+    :returns: The new :class:`Score`.
+    :rtype: :class:`music21.stream.Score`
+    """
+    pitches = ('C4', 'D4', 'E4', 'F4', 'G4', 'A4', 'B4', 'C5')
+    the_score = stream.Score()
+    for i in range(parts):
+        part = stream.Part()
+        for j in range(measures):
+            meas = stream.Measure(number=j + 1)
+            if 0 == j:
+                meas.append(meter.TimeSignature('{}/4'.format(notes_per_measure)))
+            for k in range(notes_per_measure):
+                meas.append(note.Note(pitches[(i + j + k) % len(pitches)], quarterLength=1.0))
+            part.append(meas)
+        the_score.insert(0, part)
+    return the_score
+
+
+def make_stub_lilypond(directory):
+    """
+    Write a stub LilyPond executable into ``directory``. It copies the input file to the output
+    PDF, so :func:`~outputlilypond.run_lilypond` can be timed without waiting for LilyPond.
+
+    :param directory: The directory for the stub.
+    :type directory: string
+
+    :returns: The full pathname of the stub.
+    :rtype: string
+    """
+    path = os.path.join(directory, 'lilypond')
+    with open(path, 'w') as stub:
+        stub.write(_STUB_SOURCE % {'python': sys.executable, 'version': STUB_VERSION})
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+def count_notes(the_score):
+    """
+    Count the notes and chords in a :class:`Stream`, for the "notes per second" results.
+
+    :param the_score: The :class:`Stream`.
+    :type the_score: :class:`music21.stream.Stream`
+
+    :returns: The number of :class:`Note` and :class:`Chord` objects.
+    :rtype: int
+    """
+    return len(the_score.flat.notes)
+
+
+def best_time(func, repeat=5):
+    """
+    Call ``func`` ``repeat`` times, and return the shortest time it took, in seconds.
+    """
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def _attempt(func, repeat):
+    "Return the :func:`best_time` of ``func``, or the exception it raised."
+    try:
+        return best_time(func, repeat)
+    # pylint: disable=broad-except
+    except Exception as exc:
+        return exc
+
+
+def peak_memory(func):
+    """
+    Call ``func``, and return the largest amount of memory allocated in this process meanwhile.
+
+    :returns: The number of bytes, or ``None`` without :mod:`tracemalloc`.
+    :rtype: int
+    """
+    if tracemalloc is None:
+        return None
+    was_tracing = tracemalloc.is_tracing()
+    if was_tracing:
+        tracemalloc.stop()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        if was_tracing:
+            tracemalloc.start()
+
+
+class InProcessConverter(object):
+    """
+    Convert scores in this process, without any workers, for comparison with a
+    :class:`~outputlilypond.LilyConverter`.
+    """
+
+    def process_score(self, the_score, the_settings):
+        "Convert a score like :meth:`LilyConverter.process_score`, without pickling anything."
+        return core.LilyMultiprocessor(the_score, the_settings, core.InlinePool()).run()
+
+    def close(self):
+        "There's nothing to close."
+        pass
+
+
+def bench_score(the_score, make_settings, converters, repeat=3):
+    """
+    Time the conversion of a :class:`Score`.
+
+    :param the_score: The :class:`Score` to convert.
+    :type the_score: :class:`music21.stream.Score`
+    :param make_settings: A function that returns a new settings object for every conversion.
+    :type make_settings: callable
+    :param converters: The converters to time, keyed on the name used in the results.
+    :type converters: dict of :class:`~outputlilypond.LilyConverter` or
+        :class:`InProcessConverter`
+    :param repeat: The number of times to run every conversion.
+    :type repeat: int
+
+    :returns: The results, with the number of ``'notes'``, the time of every converter by its
+        name, the times of :func:`functions.stream_to_lily` in a list called ``'parts'``, the
+        ``'peak memory'`` from :func:`peak_memory`, and the LilyPond file in ``'lily'`` (or
+        ``None``). A time is replaced by the exception if that conversion failed.
+    :rtype: :class:`collections.OrderedDict`
+    """
+    results = OrderedDict()
+    results['notes'] = count_notes(the_score)
+    results['lily'] = None
+    for name, lily_conv in converters.items():
+        # the first run starts the workers
+        try:
+            results['lily'] = lily_conv.process_score(the_score, make_settings())
+        # pylint: disable=broad-except
+        except Exception as exc:
+            results[name] = exc
+            continue
+        results[name] = _attempt(lambda: lily_conv.process_score(the_score, make_settings()),
+                                 repeat)
+
+    parts = [thing for thing in the_score if isinstance(thing, stream.Part)]
+    results['parts'] = [_attempt(lambda: functions.stream_to_lily(part, make_settings()), repeat)
+                        for part in parts]
+    if all(isinstance(seconds, float) for seconds in results['parts']):
+        results['peak memory'] = peak_memory(
+            lambda: [functions.stream_to_lily(part, make_settings()) for part in parts])
+    else:
+        results['peak memory'] = None
+    return results
+
+
+def bench_render(lily, make_settings, repeat=3):
+    """
+    Time :func:`~outputlilypond.run_lilypond` on a LilyPond file.
+
+    :param lily: The contents of the LilyPond file.
+    :type lily: unicode string
+    :param make_settings: A function that returns a settings object that uses the stub LilyPond
+        from :func:`make_stub_lilypond`.
+    :type make_settings: callable
+    :param repeat: The number of times to run LilyPond.
+    :type repeat: int
+
+    :returns: The shortest time, in seconds.
+    :rtype: float
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, 'score.ly')
+        with open(filename, 'wb') as ly_file:
+            ly_file.write(lily.encode('utf-8'))
+        the_settings = make_settings()
+        return best_time(lambda: core.run_lilypond(filename, the_settings), repeat)
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_annotations(sizes=(16, 32, 64, 128, 256, 512)):
+    """
+    Time :func:`functions.measure_to_lily` and :func:`ir.extract_measure` on measures from
+    :func:`make_annotated_measure`.
+
+    :param sizes: The numbers of annotations to try.
+    :type sizes: iterable of int
+
+    :returns: For every size, a 3-tuple with the size and the time per annotation, in
+        microseconds, of :func:`functions.measure_to_lily` and :func:`ir.extract_measure`.
+    :rtype: list of tuple
+    """
+    results = []
+    for size in sizes:
+        meas = make_annotated_measure(size)
+        direct = best_time(lambda: functions.measure_to_lily(meas))
+        extract = best_time(lambda: ir.extract_measure(meas))
+        results.append((size, direct / size * 1e6, extract / size * 1e6))
+    return results
+
+
+def bench_measures(sizes=(250, 500, 1000, 2000)):
+    """
+    Time :func:`functions.part_to_lily` and :func:`ir.extract_part` on parts from
+    :func:`make_long_part`.
+
+    :param sizes: The numbers of measures to try.
+    :type sizes: iterable of int
+
+    :returns: For every size, a 3-tuple with the size and the time per measure, in microseconds,
+        of :func:`functions.part_to_lily` and :func:`ir.extract_part`.
+    :rtype: list of tuple
+    """
+    results = []
+    for size in sizes:
+        part = make_long_part(size)
+        direct = best_time(lambda: functions.part_to_lily(part, settings.LilyPondSettings()),
+                           repeat=3)
+        extract = best_time(lambda: ir.extract_part(part), repeat=3)
+        results.append((size, direct / size * 1e6, extract / size * 1e6))
+    return results
+
+
+def bench_many(path, copies, processes=None, repeat=3):
+    """
+    Time the conversion of many copies of a file, from its name, as described for the ``many``
+    benchmark.
+
+    :param path: The file to convert.
+    :type path: string
+    :param copies: The number of times to convert it.
+    :type copies: int
+    :param processes: The number of workers in the pool, or ``None`` for one per CPU.
+    :type processes: int
+    :param repeat: The number of times to run every conversion.
+    :type repeat: int
+
+    :returns: The time of every way to convert the files, keyed on its name.
+    :rtype: :class:`collections.OrderedDict`
+    """
+    paths = [path] * copies
+    results = OrderedDict()
+    with core.LilyConverter(processes=processes) as lily_conv:
+        # start the workers before the timing starts
+        list(lily_conv.process_corpus(paths[:1]))
+        results['process_score'] = best_time(
+            lambda: [lily_conv.process_score(converter.parse(each_path)) for each_path in paths],
+            repeat)
+        for name, mode in (('corpus, part mode', core.PART_MODE),
+                           ('corpus, score mode', core.SCORE_MODE)):
+            results[name] = best_time(lambda: list(lily_conv.process_corpus(paths, mode=mode)),
+                                      repeat)
+    return results
+
+
+def _print_time(name, seconds, notes=None):
+    "Print one result: a time (with the notes per second, if we know the notes) or an exception."
+    if isinstance(seconds, Exception):
+        print('  {:<22} failed: {}'.format(name, seconds))
+    elif notes is None:
+        print('  {:<22}{:>10.3f} s'.format(name, seconds))
+    else:
+        print('  {:<22}{:>10.3f} s{:>12.0f} notes/s'.format(name, seconds, notes / seconds))
+
+
+def _print_score_results(results, render_time):
+    "Print the results of :func:`bench_score` and :func:`bench_render`."
+    for name, seconds in results.items():
+        if name not in ('notes', 'parts', 'peak memory', 'lily'):
+            _print_time(name, seconds, results['notes'])
+    for i, seconds in enumerate(results['parts']):
+        _print_time('stream_to_lily #{}'.format(i), seconds)
+    if results['peak memory'] is not None:
+        print('  {:<22}{:>10.1f} KiB'.format('peak memory', results['peak memory'] / 1024.0))
+    if render_time is not None:
+        _print_time('run_lilypond (stub)', render_time)
+
+
+def _run_scores(named_scores, args):
+    "Run :func:`bench_score` and :func:`bench_render` for every (name, function) pair."
+    directory = tempfile.mkdtemp()
+    try:
+        stub = make_stub_lilypond(directory)
+        make_settings = lambda: settings.LilyPondSettings(lilypond_path=stub,
+                                                          lilypond_version=STUB_VERSION)
+        converters = OrderedDict()
+        converters['serial'] = InProcessConverter()
+        converters['pooled ({})'.format(args.processes or 'all CPUs')] = \
+            core.LilyConverter(processes=args.processes)
+        try:
+            for name, load in named_scores:
+                the_score, load_time = load()
+                print('{} ({} parts)'.format(name, len(the_score.parts)))
+                if load_time is not None:
+                    print('  {:<22}{:>10.3f} s'.format('parse', load_time))
+                results = bench_score(the_score, make_settings, converters, args.repeat)
+                render_time = None
+                if results['lily'] is not None:
+                    render_time = bench_render(results['lily'], make_settings, args.repeat)
+                _print_score_results(results, render_time)
+        finally:
+            for lily_conv in converters.values():
+                lily_conv.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def _corpus_loader(path, repeat):
+    "Return a function that parses ``path`` and returns the Score and the best parsing time."
+    def load():
+        # "forceSource" so that music21 doesn't use a pickled copy from a previous run
+        load_time = best_time(lambda: converter.parse(path, forceSource=True), repeat)
+        return converter.parse(path, forceSource=True), load_time
+    return load
+
+
+def main(argv=None):
+    "Run the benchmark named on the command line."
+    parser = argparse.ArgumentParser(prog='python -m outputlilypond.benchmark',
+                                     description='Benchmarks for outputlilypond.')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+    for name in ('corpus', 'synthetic'):
+        sub = subparsers.add_parser(name)
+        sub.add_argument('--processes', type=int, default=None,
+                         help='the number of workers in the pool (default: one per CPU)')
+        sub.add_argument('--repeat', type=int, default=3,
+                         help='report the best of this many runs (default: 3)')
+        if 'corpus' == name:
+            sub.add_argument('files', nargs='*',
+                             help='the files to convert (default: the test_corpus files)')
+        else:
+            sub.add_argument('--parts', type=int, nargs='+', default=[4])
+            sub.add_argument('--measures', type=int, nargs='+', default=[50, 200])
+            sub.add_argument('--notes', type=int, nargs='+', default=[8],
+                             help='the number of notes per measure')
+    many = subparsers.add_parser('many')
+    many.add_argument('file', nargs='?', default=None,
+                      help='the file to convert (default: bwv77.mxl from test_corpus)')
+    many.add_argument('--copies', type=int, default=40,
+                      help='the number of times to convert it (default: 40)')
+    many.add_argument('--processes', type=int, default=None,
+                      help='the number of workers in the pool (default: one per CPU)')
+    many.add_argument('--repeat', type=int, default=3,
+                      help='report the best of this many runs (default: 3)')
+    subparsers.add_parser('annotations')
+    subparsers.add_parser('measures')
+    args = parser.parse_args(argv)
+
+    corpus = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'test_corpus')
+    if 'corpus' == args.benchmark:
+        files = args.files
+        if not files:
+            files = [os.path.join(corpus, each_file) for each_file in CORPUS_FILES]
+        _run_scores([(os.path.basename(path), _corpus_loader(path, args.repeat))
+                     for path in files],
+                    args)
+    elif 'synthetic' == args.benchmark:
+        named_scores = []
+        for parts in args.parts:
+            for measures in args.measures:
+                for notes in args.notes:
+                    name = '{} parts x {} measures x {} notes'.format(parts, measures, notes)
+                    named_scores.append(
+                        (name, lambda p=parts, m=measures, n=notes:
+                               (make_synthetic_score(p, m, n), None)))
+        _run_scores(named_scores, args)
+    elif 'many' == args.benchmark:
+        path = args.file or os.path.join(corpus, CORPUS_FILES[0])
+        print('{} x {}'.format(os.path.basename(path), args.copies))
+        for name, seconds in bench_many(path, args.copies, args.processes, args.repeat).items():
+            _print_time(name, seconds / args.copies)
+        print('  (seconds per file)')
+    elif 'annotations' == args.benchmark:
+        print('annotations  measure_to_lily (us/annotation)  extract_measure (us/annotation)')
+        for size, direct, extract in bench_annotations():
+            print('{:>11}  {:>31.1f}  {:>31.1f}'.format(size, direct, extract))
+    elif 'measures' == args.benchmark:
+        print('measures  part_to_lily (us/measure)  extract_part (us/measure)')
+        for size, direct, extract in bench_measures():
+            print('{:>8}  {:>25.1f}  {:>25.1f}'.format(size, direct, extract))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: cache.py
+# Purpose: Caches of the PDFs produced by LilyPond, and of converted parts.
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+"""
+Caches of the PDFs produced by LilyPond (:class:`PDFCache`), and of converted parts
+(:class:`PartCache`).
+
+LilyPond takes seconds to engrave even a short file, so if you engrave the same source many
+times, give a :class:`PDFCache` to :func:`~outputlilypond.run_lilypond` or
+:func:`~outputlilypond.run_lilypond_batch`. A PDF is found by the SHA-256 hash of the LilyPond
+source, the LilyPond version, and the command-line options, so an edited file (or a new version
+of LilyPond) is engraved again.
+
+>>> the_cache = PDFCache('/tmp/lily-cache', max_size=100 * 1024 * 1024)
+>>> run_lilypond('score.ly', cache=the_cache)
+
+Several processes may share one cache directory. Every PDF is written to a temporary file and
+renamed into place, so a reader never sees part of a PDF, and a PDF that's removed by another
+process while we read it is treated as a miss. When the cache grows larger than ``max_size``,
+the least-recently-used PDFs are removed.
+
+When you convert the same score many times with only some parts changed (for example, only the
+``lily_analysis_voice`` part), give a :class:`PartCache` to
+:func:`~outputlilypond.process_score` or :class:`~outputlilypond.LilyConverter`. Every part is
+found by a fingerprint of its contents, so unchanged parts aren't converted again.
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+# os.replace() is atomic even on Windows, but only exists in Python 3
+_replace = getattr(os, 'replace', os.rename)
+
+"""
+The settings that change the output of :func:`ir.part_ir_to_lily`, so they're part of the key in
+a :class:`PartCache`.
+"""
+PART_SETTINGS = ('bar numbers',)
+
+
+def _atomic_write(directory, path, fileobj):
+    """
+    Copy the contents of ``fileobj`` to ``path`` so that no other process ever sees part of the
+    file: we write to a temporary file in ``directory`` then rename it.
+    """
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            shutil.copyfileobj(fileobj, temp_file)
+        _replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _make_directory(directory):
+    "Make ``directory`` if it doesn't exist, even if another process is making it too."
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):  # it wasn't another process making it
+                raise
+
+
+class PDFCache(object):
+    """
+    A directory of PDFs, each named for the hash of the LilyPond source that produced it.
+    """
+
+    SUFFIX = '.pdf'
+
+    def __init__(self, directory, max_size=None):
+        """
+        :param directory: The directory that holds the cache. It's created if it doesn't exist.
+        :type directory: string
+        :param max_size: The largest total size of the cached PDFs, in bytes. The default,
+            ``None``, lets the cache grow forever.
+        :type max_size: int
+
+        :raises: :exc:`ValueError` if ``max_size`` is less than ``0``.
+        """
+        if max_size is not None and max_size < 0:
+            raise ValueError('PDFCache(): "max_size" must not be negative')
+        self._directory = directory
+        self._max_size = max_size
+        _make_directory(directory)
+
+    @property
+    def directory(self):
+        "The directory that holds the cache."
+        return self._directory
+
+    @staticmethod
+    def make_key(source, the_settings, options):
+        """
+        Make the cache key for a LilyPond source file.
+
+        :param source: The contents of the LilyPond file.
+        :type source: bytes
+        :param the_settings: The settings object that knows which LilyPond version will be used.
+        :type the_settings: :class:`settings.LilyPondSettings`
+        :param options: The command-line options given to LilyPond.
+        :type options: list of string
+
+        :returns: A hexadecimal SHA-256 digest.
+        :rtype: string
+        """
+        hasher = hashlib.sha256()
+        hasher.update(the_settings.get_property('lilypond_version').encode('utf-8'))
+        hasher.update(b'\0')
+        hasher.update(u' '.join(options).encode('utf-8'))
+        hasher.update(b'\0')
+        hasher.update(source)
+        return hasher.hexdigest()
+
+    def _path(self, key):
+        "The pathname of the PDF with ``key``."
+        return os.path.join(self._directory, key + PDFCache.SUFFIX)
+
+    def get(self, key, pdf_filename):
+        """
+        Copy the PDF with ``key`` to ``pdf_filename``, if it's in the cache.
+
+        :param key: The cache key, from :meth:`make_key`.
+        :type key: string
+        :param pdf_filename: Where to put the PDF.
+        :type pdf_filename: string
+
+        :returns: Whether the PDF was in the cache.
+        :rtype: bool
+        """
+        path = self._path(key)
+        try:
+            shutil.copyfile(path, pdf_filename)
+        except (IOError, OSError):
+            return False
+        try:
+            # mark it as recently used
+            os.utime(path, None)
+        except OSError:
+            pass  # evicted by another process since we copied it
+        return True
+
+    def put(self, key, pdf_filename):
+        """
+        Store a copy of a PDF in the cache, then remove old PDFs if the cache is too large.
+
+        :param key: The cache key, from :meth:`make_key`.
+        :type key: string
+        :param pdf_filename: The PDF to store.
+        :type pdf_filename: string
+        """
+        with open(pdf_filename, 'rb') as pdf_file:
+            _atomic_write(self._directory, self._path(key), pdf_file)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least-recently-used PDFs until the cache is no larger than ``max_size``.
+        """
+        if self._max_size is None:
+            return
+        entries = []
+        total_size = 0
+        for each_name in os.listdir(self._directory):
+            if not each_name.endswith(PDFCache.SUFFIX):
+                continue
+            path = os.path.join(self._directory, each_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # evicted by another process
+            entries.append((stat.st_mtime, path, stat.st_size))
+            total_size += stat.st_size
+
+        entries.sort()
+        for _, path, size in entries:
+            if total_size <= self._max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # evicted by another process
+            total_size -= size
+
+    def clear(self):
+        "Remove every PDF from the cache."
+        for each_name in os.listdir(self._directory):
+            if each_name.endswith(PDFCache.SUFFIX):
+                try:
+                    os.remove(os.path.join(self._directory, each_name))
+                except OSError:
+                    pass
+
+
+class PartCache(object):
+    """
+    A cache of converted parts, found by a fingerprint of the part's IR (from
+    :func:`ir.extract_part`), the settings in :data:`PART_SETTINGS`, and the version of
+    outputlilypond.
+
+    The cached value is the part's LilyPond string without its name, so the part may be given a
+    different name in every score. The most recently used parts are held in memory and, if you
+    give a ``directory``, every part is also stored there, so that other processes (and later
+    runs) can use it.
+    """
+
+    SUFFIX = '.ly'
+
+    def __init__(self, max_entries=256, directory=None):
+        """
+        :param max_entries: The largest number of parts held in memory.
+        :type max_entries: int
+        :param directory: An optional directory that holds every part on disk. It's created if it
+            doesn't exist. Several processes may share one directory.
+        :type directory: string
+
+        :raises: :exc:`ValueError` if ``max_entries`` is less than ``1``.
+        """
+        if max_entries < 1:
+            raise ValueError('PartCache(): "max_entries" must be at least 1')
+        self._max_entries = max_entries
+        self._directory = directory
+        if directory is not None:
+            _make_directory(directory)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._memory)
+
+    @staticmethod
+    def make_key(part_ir, setts):
+        """
+        Make the cache key for a part.
+
+        :param part_ir: The PART tuple, from :func:`ir.extract_part`.
+        :type part_ir: tuple
+        :param setts: The settings object used to convert the part.
+        :type setts: :class:`settings.LilyPondSettings`
+
+        :returns: A hexadecimal SHA-256 digest.
+        :rtype: string
+        """
+        from outputlilypond import __version__
+        hasher = hashlib.sha256()
+        hasher.update(repr((__version__,
+                            [setts.get_property(name) for name in PART_SETTINGS],
+                            part_ir)).encode('utf-8'))
+        return hasher.hexdigest()
+
+    def _path(self, key):
+        "The pathname of the part with ``key`` in the disk tier."
+        return os.path.join(self._directory, key + PartCache.SUFFIX)
+
+    def get(self, key):
+        """
+        Find a part in the cache.
+
+        :param key: The cache key, from :meth:`make_key`.
+        :type key: string
+
+        :returns: The part's LilyPond string without its name, or ``None`` if it isn't cached.
+        :rtype: unicode string
+        """
+        with self._lock:
+            if key in self._memory:
+                value = self._memory.pop(key)
+                self._memory[key] = value  # now it's the most recently used
+                self.hits += 1
+                return value
+        if self._directory is not None:
+            try:
+                with open(self._path(key), 'rb') as part_file:
+                    value = part_file.read().decode('utf-8')
+            except (IOError, OSError):
+                pass
+            else:
+                self._remember(key, value)
+                with self._lock:
+                    self.hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """
+        Store a part in the cache.
+
+        :param key: The cache key, from :meth:`make_key`.
+        :type key: string
+        :param value: The part's LilyPond string without its name.
+        :type value: unicode string
+        """
+        self._remember(key, value)
+        if self._directory is not None:
+            _atomic_write(self._directory, self._path(key), io.BytesIO(value.encode('utf-8')))
+
+    def _remember(self, key, value):
+        "Put a part in the memory tier, forgetting the least-recently-used if it's full."
+        with self._lock:
+            self._memory.pop(key, None)
+            self._memory[key] = value
+            while len(self._memory) > self._max_entries:
+                self._memory.popitem(last=False)
+
+    def clear(self):
+        "Remove every part from the cache, including the disk tier."
+        with self._lock:
+            self._memory.clear()
+        if self._directory is not None:
+            for each_name in os.listdir(self._directory):
+                if each_name.endswith(PartCache.SUFFIX):
+                    try:
+                        os.remove(os.path.join(self._directory, each_name))
+                    except OSError:
+                        pass
@@ -0,0 +1,421 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: cli.py
+# Purpose: The command-line interface, "python -m outputlilypond"
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+"""
+The command-line interface, which converts many scores at once:
+
+    $ python -m outputlilypond --jobs 4 --output-dir ly --pdf scores/ 'more/*.krn' bwv77.mxl
+
+Every input is a file, a directory (searched recursively for files with one of the
+:const:`INPUT_EXTENSIONS`), or a glob pattern. Every score is parsed and converted by one worker
+process, and its LilyPond file is written beside the input or, with ``--output-dir``, in that
+directory (keeping the layout of the files below an input directory). If two scores would have
+the same LilyPond file, nothing is converted. With ``--pdf``, the worker also runs LilyPond on the
+file.
+
+With ``--skip-existing mtime``, a score isn't converted if its LilyPond file is newer than the
+score. With ``--skip-existing hash``, a score isn't converted if its LilyPond file was made from
+the same score by the same version of outputlilypond; in this mode, every LilyPond file ends
+with a comment that holds this hash. With ``--pdf`` too, a score is converted again if its PDF is
+missing or older than its LilyPond file.
+
+At the end we print a summary. The exit status is ``0`` if everything succeeded, ``1`` if any
+score (or PDF) failed, and ``2`` if an input doesn't exist or two scores would have the same
+LilyPond file.
+"""
+
+from __future__ import print_function
+
+import argparse
+import glob
+import hashlib
+import io
+import os
+import sys
+import time
+from collections import namedtuple
+from multiprocessing import Pool, cpu_count
+from music21 import converter, stream
+from outputlilypond import __version__, core, functions, render, settings
+
+"""
+The extensions of the files we convert when an input is a directory: MusicXML, compressed
+MusicXML, Humdrum **kern, MEI, and MIDI.
+"""
+INPUT_EXTENSIONS = ('.xml', '.mxl', '.musicxml', '.krn', '.mei', '.mid', '.midi')
+
+"""
+The start of the comment at the end of the LilyPond files made with ``--skip-existing hash``,
+which holds the hash of the score.
+"""
+HASH_COMMENT = u'% outputlilypond source sha256: '
+
+# The statuses of a JobResult.
+CONVERTED = 'converted'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+
+class Job(namedtuple('Job', ('source', 'ly_filename'))):
+    """
+    A score to convert:
+
+    * ``source``: the pathname of the score.
+    * ``ly_filename``: the pathname of the LilyPond file to write.
+    """
+    __slots__ = ()
+
+
+class Options(namedtuple('Options', ('skip_existing', 'pdf', 'timeout', 'lilypond_path',
+                                     'lilypond_version'))):
+    """
+    The options for every :class:`Job`, which are sent to the worker processes:
+
+    * ``skip_existing``: ``None``, ``'mtime'``, or ``'hash'``.
+    * ``pdf``: whether to run LilyPond.
+    * ``timeout``: the number of seconds after which we kill LilyPond, or ``None``.
+    * ``lilypond_path`` and ``lilypond_version``: found once, so the workers don't each look.
+    """
+    __slots__ = ()
+
+
+class JobResult(namedtuple('JobResult', ('source', 'ly_filename', 'status', 'elapsed', 'error',
+                                         'render'))):
+    """
+    The outcome of a :class:`Job`:
+
+    * ``source`` and ``ly_filename``: as in the :class:`Job`.
+    * ``status``: :const:`CONVERTED`, :const:`SKIPPED`, or :const:`FAILED`.
+    * ``elapsed``: how long the job took, in seconds.
+    * ``error``: why the job failed, or ``None``.
+    * ``render``: the :class:`render.RenderResult` from LilyPond, or ``None``.
+    """
+    __slots__ = ()
+
+
+def find_inputs(inputs, output_dir=None):
+    """
+    Find the scores to convert, and where to put their LilyPond files.
+
+    :param inputs: Pathnames of files or directories, or glob patterns.
+    :type inputs: list of string
+    :param output_dir: The directory for the LilyPond files. The default, ``None``, puts every
+        LilyPond file beside its score.
+    :type output_dir: string
+
+    :returns: A job for every score, in the order given, without duplicates.
+    :rtype: list of :class:`Job`
+
+    :raises: :exc:`ValueError` if an input doesn't exist and doesn't match any files, or if two
+        scores would have the same LilyPond file (like ``a/bwv77.mxl`` and ``b/bwv77.mxl`` with
+        ``output_dir``).
+    """
+    post = []
+    seen = set()
+    # the score of every LilyPond file so far, keyed on its normalized pathname
+    destinations = {}
+
+    def add(source, relative):
+        "Add a Job for ``source``, whose LilyPond file goes at ``relative`` in the output_dir."
+        if os.path.abspath(source) in seen:
+            return
+        seen.add(os.path.abspath(source))
+        destination = source if output_dir is None else os.path.join(output_dir, relative)
+        ly_filename = os.path.splitext(destination)[0] + '.ly'
+        key = os.path.normcase(os.path.abspath(ly_filename))
+        if key in destinations:
+            raise ValueError('{} and {} would both be written to {}'.format(
+                destinations[key], source, ly_filename))
+        destinations[key] = source
+        post.append(Job(source, ly_filename))
+
+    def add_directory(directory):
+        "Add a Job for every score below ``directory``."
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames.sort()
+            for each_name in sorted(filenames):
+                if os.path.splitext(each_name)[1].lower() in INPUT_EXTENSIONS:
+                    source = os.path.join(dirpath, each_name)
+                    add(source, os.path.relpath(source, directory))
+
+    for each_input in inputs:
+        if os.path.isdir(each_input):
+            add_directory(each_input)
+        elif os.path.isfile(each_input):
+            add(each_input, os.path.basename(each_input))
+        else:
+            matches = sorted(glob.glob(each_input))
+            if not matches:
+                raise ValueError('No such file, directory, or pattern: {}'.format(each_input))
+            for each_match in matches:
+                if os.path.isdir(each_match):
+                    add_directory(each_match)
+                else:
+                    add(each_match, os.path.basename(each_match))
+
+    return post
+
+
+def source_hash(source):
+    """
+    Make the hash used by ``--skip-existing hash``: the SHA-256 of the score and the version of
+    outputlilypond, so a new version converts every score again.
+
+    :param source: The pathname of the score.
+    :type source: string
+
+    :returns: A hexadecimal SHA-256 digest.
+    :rtype: string
+    """
+    hasher = hashlib.sha256()
+    hasher.update(__version__.encode('utf-8'))
+    hasher.update(b'\0')
+    with open(source, 'rb') as source_file:
+        for block in iter(lambda: source_file.read(65536), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def is_up_to_date(job, mode, digest=None, pdf=False):
+    """
+    Whether the LilyPond file (and PDF) of a job doesn't need to be made again.
+
+    :param job: The job.
+    :type job: :class:`Job`
+    :param mode: ``'mtime'`` if the LilyPond file must be newer than the score, or ``'hash'`` if
+        it must hold the score's :func:`source_hash`.
+    :type mode: string
+    :param digest: The score's :func:`source_hash`, if it's already known.
+    :type digest: string
+    :param pdf: Whether the PDF must exist too, and be at least as new as the LilyPond file.
+    :type pdf: bool
+
+    :returns: Whether the LilyPond file (and PDF) is up to date.
+    :rtype: bool
+    """
+    if not os.path.exists(job.ly_filename):
+        return False
+    if pdf:
+        pdf_filename = render.output_basename(job.ly_filename) + '.pdf'
+        if (not os.path.exists(pdf_filename) or
+                os.path.getmtime(pdf_filename) < os.path.getmtime(job.ly_filename)):
+            return False
+    if 'mtime' == mode:
+        return os.path.getmtime(job.ly_filename) >= os.path.getmtime(job.source)
+    if digest is None:
+        digest = source_hash(job.source)
+    with io.open(job.ly_filename, 'r', encoding='utf-8', errors='replace') as ly_file:
+        lines = ly_file.read().rstrip().rsplit(u'\n', 1)
+    return lines[-1] == HASH_COMMENT + digest
+
+
+def convert_one(job, options):
+    """
+    Parse and convert one score, then write its LilyPond file and (if asked) run LilyPond. This
+    is the task given to every worker process, so the score is converted in this process, with
+    an :class:`~outputlilypond.core.InlinePool`.
+
+    :param job: The score to convert.
+    :type job: :class:`Job`
+    :param options: The options.
+    :type options: :class:`Options`
+
+    :returns: The outcome. Every exception is caught and put in the ``error``.
+    :rtype: :class:`JobResult`
+    """
+    start = time.time()
+    try:
+        # reading and hashing the whole score is only worth it if we check the hash
+        digest = source_hash(job.source) if 'hash' == options.skip_existing else None
+        if options.skip_existing is not None and is_up_to_date(job, options.skip_existing,
+                                                               digest, options.pdf):
+            return JobResult(job.source, job.ly_filename, SKIPPED, time.time() - start, None,
+                             None)
+
+        the_settings = settings.LilyPondSettings(options.lilypond_path, options.lilypond_version)
+        the_score = converter.parse(job.source)
+        if isinstance(the_score, stream.Score):
+            lily = core.LilyMultiprocessor(the_score, the_settings, core.InlinePool()).run()
+        else:
+            lily = functions.stream_to_lily(the_score, the_settings)
+
+        directory = os.path.dirname(job.ly_filename)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):  # it wasn't another worker making it
+                    raise
+        with io.open(job.ly_filename, 'w', encoding='utf-8') as ly_file:
+            ly_file.write(lily)
+            if digest is not None:
+                ly_file.write(u'\n' + HASH_COMMENT + digest + u'\n')
+
+        rendered = None
+        if options.pdf:
+            rendered = render.render_file(job.ly_filename, the_settings, options.timeout)
+        return JobResult(job.source, job.ly_filename, CONVERTED, time.time() - start, None,
+                         rendered)
+
+    # pylint: disable=broad-except
+    except Exception as exc:
+        return JobResult(job.source, job.ly_filename, FAILED, time.time() - start,
+                         u'{}: {}'.format(type(exc).__name__, exc), None)
+
+
+def _convert_one(job_and_options):
+    "Call :func:`convert_one` with one argument, for :meth:`multiprocessing.Pool.imap_unordered`."
+    return convert_one(*job_and_options)
+
+
+def convert_all(jobs, options, processes=None):
+    """
+    Run :func:`convert_one` for every job, in a pool of worker processes.
+
+    :param jobs: The scores to convert.
+    :type jobs: list of :class:`Job`
+    :param options: The options.
+    :type options: :class:`Options`
+    :param processes: The number of worker processes. The default, ``None``, is one per CPU. With
+        ``1``, the scores are converted in this process.
+    :type processes: int
+
+    :returns: A generator of results, in the order they finish.
+    :rtype: generator of :class:`JobResult`
+    """
+    if 1 == processes or len(jobs) < 2:
+        for each_job in jobs:
+            yield convert_one(each_job, options)
+        return
+
+    pool = Pool(processes)
+    try:
+        for result in pool.imap_unordered(_convert_one, [(job, options) for job in jobs]):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _describe(result):
+    "Describe a :class:`JobResult` in one line."
+    if FAILED == result.status:
+        return u'FAILED     {}: {}'.format(result.source, result.error)
+    post = u'{:<10} {} -> {} ({:.2f} s)'.format(result.status, result.source, result.ly_filename,
+                                               result.elapsed)
+    if result.render is not None:
+        if result.render.succeeded:
+            post += u', PDF made'
+        else:
+            post += u', PDF FAILED'
+    return post
+
+
+def summarize(results, elapsed):
+    """
+    Make the summary report printed at the end.
+
+    :param results: The outcome of every job.
+    :type results: list of :class:`JobResult`
+    :param elapsed: How long everything took, in seconds.
+    :type elapsed: float
+
+    :returns: The report.
+    :rtype: unicode string
+    """
+    counts = dict((status, 0) for status in (CONVERTED, SKIPPED, FAILED))
+    for result in results:
+        counts[result.status] += 1
+    rendered = [result.render for result in results if result.render is not None]
+    post = [u'{} converted, {} skipped, {} failed in {:.1f} s'.format(
+        counts[CONVERTED], counts[SKIPPED], counts[FAILED], elapsed)]
+    if rendered:
+        post.append(u'{} PDFs made, {} failed'.format(
+            sum(1 for each in rendered if each.succeeded),
+            sum(1 for each in rendered if not each.succeeded)))
+    for result in results:
+        if FAILED == result.status:
+            post.append(u'  {}: {}'.format(result.source, result.error))
+        elif result.render is not None and not result.render.succeeded:
+            error = result.render.stderr.strip().split(u'\n')[-1]
+            if result.render.timed_out:
+                error = u'LilyPond timed out'
+            post.append(u'  {}: {}'.format(result.ly_filename, error))
+    return u'\n'.join(post)
+
+
+def main(argv=None):
+    """
+    Run the command-line interface.
+
+    :param argv: The command-line arguments. The default is :data:`sys.argv`.
+    :type argv: list of string
+
+    :returns: The exit status.
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m outputlilypond',
+        description='Convert scores (MusicXML, **kern, MEI, or MIDI) into LilyPond files.')
+    parser.add_argument('inputs', nargs='+', metavar='INPUT',
+                        help='a score, a directory of scores, or a glob pattern')
+    parser.add_argument('-o', '--output-dir',
+                        help='where to write the LilyPond files (default: beside every score)')
+    parser.add_argument('-j', '--jobs', type=int, default=cpu_count(),
+                        help='the number of scores to convert at once (default: one per CPU)')
+    parser.add_argument('--skip-existing', choices=['mtime', 'hash'],
+                        help="don't convert a score if its LilyPond file is newer (mtime) or was "
+                             "made from the same score (hash)")
+    parser.add_argument('--pdf', action='store_true', help='run LilyPond on every LilyPond file')
+    parser.add_argument('--timeout', type=float,
+                        help='kill LilyPond after this many seconds (default: never)')
+    parser.add_argument('--lilypond', help='the LilyPond executable (default: find it)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='print only the summary, not every score')
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+
+    try:
+        jobs = find_inputs(args.inputs, args.output_dir)
+    except ValueError as err:
+        print('outputlilypond: {}'.format(err), file=sys.stderr)
+        return 2
+
+    # find LilyPond once, rather than in every worker
+    the_settings = settings.LilyPondSettings(lilypond_path=args.lilypond)
+    options = Options(args.skip_existing, args.pdf, args.timeout,
+                      the_settings.get_property('lilypond_path'),
+                      the_settings.get_property('lilypond_version'))
+
+    start = time.time()
+    results = []
+    for result in convert_all(jobs, options, args.jobs):
+        results.append(result)
+        if not args.quiet:
+            print(_describe(result))
+    print(summarize(results, time.time() - start))
+
+    failed = any(FAILED == result.status or
+                 (result.render is not None and not result.render.succeeded)
+                 for result in results)
+    return 1 if failed else 0
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: context.py
+# Purpose: The state of one conversion, kept apart from the settings.
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+"""
+The state of one conversion, kept apart from the settings.
+
+A :class:`~outputlilypond.settings.LilyPondSettings` object says how to convert a score, and isn't
+changed by converting one, so you may share a single settings object among many threads and
+processes at once. Everything we learn while converting a score (like the names of its parts) goes
+in a :class:`ConversionContext` instead, with a new one for every score.
+
+A worker process fills in a context of its own, and sends it back with its results, to be added to
+the context of the whole score with :meth:`ConversionContext.merge`.
+"""
+
+
+class ConversionContext(object):
+    """
+    The names of the parts in one score, and which of them are analysis parts.
+    """
+
+    def __init__(self):
+        # The name of every part in the score, in score order. Things that aren't parts may have
+        # None in their place.
+        self.parts_in_this_score = []
+        # Every name chosen by functions.new_part_name() for this score.
+        self.part_names = set()
+        # The names of the parts written with the VisAnnotation context.
+        self.analysis_notation_parts = []
+
+    def merge(self, other):
+        """
+        Add the part names chosen and the analysis parts found in another context, like one sent
+        back from a worker process. The order of :attr:`parts_in_this_score` depends on the
+        score, so the caller must add those names itself.
+
+        :param other: The context to add to this one.
+        :type other: :class:`ConversionContext`
+        """
+        self.part_names.update(other.part_names)
+        for each_name in other.analysis_notation_parts:
+            if each_name not in self.analysis_notation_parts:
+                self.analysis_notation_parts.append(each_name)
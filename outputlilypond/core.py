@@ -0,0 +1,959 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: core.py
+# Purpose: Principal file for the outputlilypond module.
+#
+# Copyright (C) 2012, 2013, 2014, 2016 Christopher Antila
+# Copyright (C) 2016 Alexander Morgan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+"""
+Output music21 objects into their respective LilyPond representation. This library is intended for
+music research software.
+
+Use :mod:`outputlilypond` by calling :func:`process_score` then :func:`run_lilypond`. You may wish
+to use your own :class:`settings.LilyPondSettings` object to change the way :mod:`outputlilypond`
+behaves. If you will convert many scores, use a :class:`LilyConverter` so the worker processes are
+started only once, or :func:`process_corpus` to convert a whole collection of scores (or files) at
+once.
+
+You may also use our module-level functions (located in the :mod:`outputlilypond.functions` module)
+for other tasks, but we do not recommend you use :func:`process_score` along with other
+module-level functions.
+"""
+
+import errno
+import os
+import pickle
+import threading
+import time
+from collections import deque
+from multiprocessing import Pool, cpu_count
+from music21 import converter, stream
+from outputlilypond import functions, ir, render, settings, stats
+from outputlilypond.context import ConversionContext
+# For python 2 and 3 compatibility:
+import sys
+if sys.version_info[0] > 2:
+    xrange = range
+    string_types = (str,)
+else:
+    string_types = (str, unicode)
+
+
+"""
+In :meth:`LilyConverter.process_corpus`, convert one score at a time, and use the pool for its
+parts.
+"""
+PART_MODE = u'parts'
+
+"""
+In :meth:`LilyConverter.process_corpus`, convert every score in a single process, and many scores
+at the same time.
+"""
+SCORE_MODE = u'scores'
+
+"""
+In :meth:`LilyConverter.process_corpus`, a :class:`Score` with more than one part and at least this
+many measures (in all its parts together) is converted in :const:`PART_MODE` unless you choose a
+mode.
+"""
+LARGE_SCORE_MEASURES = 400
+
+
+def run_lilypond(filename, the_settings=None, timeout=None, cache=None):
+    """
+    Run LilyPond on a file.
+
+    To run LilyPond on many files at once, use :func:`render.run_lilypond_batch`.
+
+    :param filename: The full pathname to the file on which to run LilyPond.
+    :type filename: string
+    :param the_settings: An optional settings object.
+    :type the_settings: :class:`settings.LilyPondSettings`
+    :param timeout: The number of seconds after which we kill LilyPond. The default, ``None``,
+        waits forever.
+    :type timeout: float
+    :param cache: An optional cache of PDFs. If the PDF for this file is in the cache, LilyPond
+        doesn't run.
+    :type cache: :class:`cache.PDFCache`
+
+    :returns: LilyPond's exit code and output, or ``None`` if we had to use :func:`os.system`.
+    :rtype: :class:`render.RenderResult`
+
+    :raises: :exc:`IOError` if ``filename`` cannot be read for the ``cache``.
+    """
+    if the_settings is None:
+        the_settings = settings.LilyPondSettings()
+
+    # NB: this try/except block means, practically, that we'll use Popen (which is better) on
+    # Linux, but where it fails (OS X), we'll use os.system()
+    try:
+        return render.render_file(filename, the_settings, timeout, cache)
+    except OSError as err:
+        # Only an error about LilyPond itself means we couldn't start it. Popen puts LilyPond's
+        # path in the error (or nothing, on Python 2), but reading the file for the cache puts
+        # the file's pathname there.
+        lilypond_path = the_settings.get_property('lilypond_path')
+        if err.errno not in (errno.ENOENT, errno.EACCES) or \
+                err.filename not in (None, lilypond_path):
+            raise
+        if the_settings.stats is not None:
+            the_settings.stats.count_lilypond_launch()
+        os.system('%s -dno-point-and-click -dsafe=#t --pdf -o %s %s' %
+                  (lilypond_path,
+                   render.output_basename(filename),
+                   filename))
+
+
+def process_score(the_score, the_settings=None, measures_per_chunk=None, part_cache=None):
+    """
+    Convert an entire :class:`music21.stream.Stream` object, nominally a :class:`Score`, into a
+    unicode string for output as a LilyPond source file.
+
+    :param the_score: The :class:`Stream` to output. This method works on any type of
+        :class:`Stream`, but uses multiprocessing only for :class:`Score` objects.
+    :type the_score: :class:`music21.stream.Stream`
+    :param the_settings: An optional settings object that will be passed to all client functions.
+        Use this object to modify runtime behaviour.
+    :type the_settings: :class:`settings.LilyPondSettings`
+    :param measures_per_chunk: If this is ``None`` (the default), every :class:`Part` is converted
+        by a single worker process. Otherwise, parts with more than this many measures are split
+        into chunks of this many measures, and every chunk is converted by a different worker.
+        This helps with scores that have only a few, very long parts.
+    :type measures_per_chunk: int
+    :param part_cache: An optional cache of converted parts. Parts found in the cache aren't
+        converted again, and newly-converted parts are added to it.
+    :type part_cache: :class:`cache.PartCache`
+
+    :returns: A string that holds an entire LilyPond source file (as complete as possible for the
+        type of :class:`Stream` object provided).
+    :rtype: ``unicode``
+
+    .. note:: Every call starts (and stops) a new pool of worker processes. To convert many scores,
+        use a :class:`LilyConverter` instead.
+    """
+    the_settings = settings.LilyPondSettings() if the_settings is None else the_settings
+    if isinstance(the_score, stream.Score):
+        # multiprocessing!
+        return LilyMultiprocessor(the_score,
+                                  the_settings,
+                                  measures_per_chunk=measures_per_chunk,
+                                  part_cache=part_cache).run()
+    else:
+        # not sure what to do here... guess we'll default to old style?
+        # TODO: this won't work as-is
+        return functions.stream_to_lily(the_score, the_settings)
+
+
+def process_score_iter(the_score, the_settings=None, measures_per_chunk=None, part_cache=None):
+    """
+    Convert a :class:`music21.stream.Stream` like :func:`process_score`, but yield the LilyPond
+    file piece by piece rather than returning it all at once.
+
+    The header comes first, then every part in score order (as soon as it, and every part before
+    it, is finished), then the ``\\score`` and ``\\layout`` blocks. This way you can start to
+    write the output before the whole score is converted, and the whole file is never held in
+    memory. The arguments are the same as for :func:`process_score`.
+
+    :returns: A generator of strings which, joined together, are the whole LilyPond file.
+    :rtype: generator of ``unicode``
+    """
+    the_settings = settings.LilyPondSettings() if the_settings is None else the_settings
+    if isinstance(the_score, stream.Score):
+        return LilyMultiprocessor(the_score,
+                                  the_settings,
+                                  measures_per_chunk=measures_per_chunk,
+                                  part_cache=part_cache).run_iter()
+    else:
+        return iter([functions.stream_to_lily(the_score, the_settings)])
+
+
+def process_score_to(the_score, fileobj, the_settings=None, measures_per_chunk=None,
+                     part_cache=None):
+    """
+    Convert a :class:`music21.stream.Stream` like :func:`process_score`, and write the LilyPond
+    file to ``fileobj`` piece by piece, as in :func:`process_score_iter`.
+
+    :param the_score: The :class:`Stream` to output.
+    :type the_score: :class:`music21.stream.Stream`
+    :param fileobj: A file-like object, opened in text mode, where we write the LilyPond file.
+        We do not close it.
+    :type fileobj: file-like object
+    :param the_settings: An optional settings object.
+    :type the_settings: :class:`settings.LilyPondSettings`
+    :param measures_per_chunk: Split parts into chunks of this many measures. Refer to
+        :func:`process_score`.
+    :type measures_per_chunk: int
+    :param part_cache: An optional cache of converted parts. Refer to :func:`process_score`.
+    :type part_cache: :class:`cache.PartCache`
+    """
+    for each_piece in process_score_iter(the_score, the_settings, measures_per_chunk, part_cache):
+        fileobj.write(each_piece)
+
+
+def process_corpus(scores, the_settings=None, processes=None, measures_per_chunk=None, mode=None):
+    """
+    Convert many scores with one pool of worker processes, and yield their LilyPond files in the
+    same order. This is :meth:`LilyConverter.process_corpus` with a new :class:`LilyConverter`,
+    which is closed when the generator is finished.
+
+    :param scores: The scores to convert. Refer to :meth:`LilyConverter.process_corpus`.
+    :type scores: iterable of :class:`music21.stream.Stream` or string
+    :param the_settings: An optional settings object for every score.
+    :type the_settings: :class:`settings.LilyPondSettings`
+    :param processes: The number of worker processes to use. Refer to :class:`LilyConverter`.
+    :type processes: int
+    :param measures_per_chunk: Split parts into chunks of this many measures. Refer to
+        :func:`process_score`.
+    :type measures_per_chunk: int
+    :param mode: Either :const:`PART_MODE`, :const:`SCORE_MODE`, or ``None`` to choose for every
+        score. Refer to :meth:`LilyConverter.process_corpus`.
+    :type mode: string
+
+    :returns: A generator of LilyPond files, one for every score.
+    :rtype: generator of ``unicode``
+    """
+    with LilyConverter(processes, the_settings, measures_per_chunk) as lily_conv:
+        for each_file in lily_conv.process_corpus(scores, mode=mode):
+            yield each_file
+
+
+def score_header(the_settings):
+    """
+    Make the start of a LilyPond file: our mark, the LilyPond version, and the paper size.
+
+    :param the_settings: The settings to use.
+    :type the_settings: :class:`settings.LilyPondSettings`
+
+    :returns: The start of the LilyPond file.
+    :rtype: ``unicode``
+    """
+    # Our mark! // Version // Paper size
+    return (u'%% LilyPond output from music21 via "outputlilypond"\n'
+            u'\\version "%s"\n'
+            u'\n'
+            u'\\paper {\n'
+            u'\t#(set-paper-size "%s")\n'
+            u'\t#(define left-margin (* 1.5 cm))\n'  # TODO: this should be a setting
+            u'}\n\n' % (the_settings.get_property('lilypond_version'),
+                        the_settings.get_property('paper_size')))
+
+
+def score_block(the_settings, context):
+    """
+    Make the end of a LilyPond file: the ``\\score{}`` block with a staff for every part.
+
+    :param the_settings: The settings to use.
+    :type the_settings: :class:`settings.LilyPondSettings`
+    :param context: The context of the conversion, with the name of every part in the score.
+    :type context: :class:`ConversionContext`
+
+    :returns: The end of the LilyPond file.
+    :rtype: ``unicode``
+    """
+    # Output the \score{} block
+    post = [u'\\score {\n\t\\new StaffGroup\n\t<<\n']
+    for each_part in context.parts_in_this_score:
+        if each_part is None:
+            continue
+        elif each_part in context.analysis_notation_parts:
+            post.extend([u'\t\t\\new VisAnnotation = "', each_part, u'" \\' + each_part + u'\n'])
+        else:
+            post.extend([u'\t\t\\new Staff = "', each_part, u'" \\' + each_part + u'\n'])
+    post.append(u'\t>>\n')
+
+    # Output the \layout{} block
+    post.append(u'\t\\layout{\n')
+    if the_settings.get_property('indent') is not None:
+        post.extend([u'\t\tindent = ', the_settings.get_property('indent'), u'\n'])
+    post.append("""\t\t% VisAnnotation Context
+\t\t\\context
+\t\t{
+\t\t\t\\type "Engraver_group"
+\t\t\t\\name VisAnnotation
+\t\t\t\\alias Staff
+\t\t\t\\consists "Output_property_engraver"
+\t\t\t\\consists "Script_engraver"
+\t\t\t\\consists "Text_engraver"
+\t\t\t\\consists "Axis_group_engraver"
+\t\t\t\\consists "Instrument_name_engraver"
+\t\t}
+\t\t% End VisAnnotation Context
+\t\t
+\t\t% Modify "StaffGroup" context to accept VisAnnotation context.
+\t\t\\context
+\t\t{
+\t\t\t\\StaffGroup
+\t\t\t\\accepts VisAnnotation
+\t\t}
+\t}\n}\n
+""")
+    return u''.join(post)
+
+
+class LilyConverter(object):
+    """
+    A long-lived converter that keeps a pool of worker processes alive between calls to
+    :meth:`process_score`.
+
+    Starting a :class:`multiprocessing.Pool` (and importing :mod:`music21` in every worker) often
+    takes longer than converting a small score, so you should use a single :class:`LilyConverter`
+    when you convert many scores. The pool is started when first needed, and you should stop it
+    with :meth:`close` when you are finished. The easiest way is to use a ``with`` statement:
+
+    >>> with LilyConverter(processes=4) as lily_conv:
+    ...     for each_score in all_the_scores:
+    ...         results.append(lily_conv.process_score(each_score))
+    """
+
+    def __init__(self, processes=None, the_settings=None, measures_per_chunk=None,
+                 part_cache=None):
+        """
+        Create a new LilyConverter instance.
+
+        :param processes: The number of worker processes to use. The default, ``None``, uses as many
+            workers as there are CPUs, like :class:`multiprocessing.Pool`.
+        :type processes: int
+        :param the_settings: An optional settings object used for every score that is not given its
+            own settings object.
+        :type the_settings: :class:`settings.LilyPondSettings`
+        :param measures_per_chunk: Split parts into chunks of this many measures. Refer to
+            :func:`process_score`.
+        :type measures_per_chunk: int
+        :param part_cache: An optional cache of converted parts, shared by every score. Refer to
+            :func:`process_score`.
+        :type part_cache: :class:`cache.PartCache`
+
+        :raises: :exc:`ValueError` if ``processes`` is less than ``1``.
+        """
+        super(LilyConverter, self).__init__()
+        if processes is not None and processes < 1:
+            raise ValueError('LilyConverter: "processes" must be at least 1')
+        self._processes = processes
+        self._setts = the_settings
+        self._measures_per_chunk = measures_per_chunk
+        self._part_cache = part_cache
+        self._pool = None
+        # the coroutines in aio share a converter from many threads, so only one may start the pool
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # don't wait for the work of a conversion that already failed
+            self.terminate()
+        return False
+
+    @property
+    def is_running(self):
+        "Whether the worker pool is currently started."
+        return self._pool is not None
+
+    def _get_pool(self):
+        "Return the worker pool, starting it if required."
+        with self._lock:
+            if self._pool is None:
+                self._pool = Pool(self._processes)
+            return self._pool
+
+    def _get_processes(self):
+        "Return the number of worker processes in the pool."
+        return cpu_count() if self._processes is None else self._processes
+
+    def _get_settings(self, the_settings):
+        "Return ``the_settings``, or this converter's settings object if it's ``None``."
+        if the_settings is None:
+            with self._lock:
+                if self._setts is None:
+                    self._setts = settings.LilyPondSettings()
+                the_settings = self._setts
+        return the_settings
+
+    def process_score(self, the_score, the_settings=None):
+        """
+        Convert a :class:`music21.stream.Stream` into a LilyPond source file. This method works
+        like the module-level :func:`process_score` function, but reuses this converter's pool.
+
+        :param the_score: The :class:`Stream` to output.
+        :type the_score: :class:`music21.stream.Stream`
+        :param the_settings: An optional settings object for this score only. The default is the
+            settings object given to the constructor, or a new one if there was none.
+        :type the_settings: :class:`settings.LilyPondSettings`
+
+        :returns: A string that holds an entire LilyPond source file.
+        :rtype: ``unicode``
+        """
+        the_settings = self._get_settings(the_settings)
+        if isinstance(the_score, stream.Score):
+            return LilyMultiprocessor(the_score,
+                                      the_settings,
+                                      self._get_pool(),
+                                      self._measures_per_chunk,
+                                      self._part_cache).run()
+        else:
+            return functions.stream_to_lily(the_score, the_settings)
+
+    def process_score_iter(self, the_score, the_settings=None):
+        """
+        Convert a :class:`music21.stream.Stream`, and yield the LilyPond file piece by piece. This
+        method works like the module-level :func:`process_score_iter` function, but reuses this
+        converter's pool. The arguments are the same as for :meth:`process_score`.
+
+        :returns: A generator of strings which, joined together, are the whole LilyPond file.
+        :rtype: generator of ``unicode``
+        """
+        the_settings = self._get_settings(the_settings)
+        if isinstance(the_score, stream.Score):
+            return LilyMultiprocessor(the_score,
+                                      the_settings,
+                                      self._get_pool(),
+                                      self._measures_per_chunk,
+                                      self._part_cache).run_iter()
+        else:
+            return iter([functions.stream_to_lily(the_score, the_settings)])
+
+    def process_score_to(self, the_score, fileobj, the_settings=None):
+        """
+        Convert a :class:`music21.stream.Stream`, and write the LilyPond file to ``fileobj`` piece
+        by piece. This method works like the module-level :func:`process_score_to` function, but
+        reuses this converter's pool.
+        """
+        for each_piece in self.process_score_iter(the_score, the_settings):
+            fileobj.write(each_piece)
+
+    def process_corpus(self, scores, the_settings=None, mode=None):
+        """
+        Convert many scores, and yield their LilyPond files in the same order.
+
+        There are two ways to share the work among the worker processes. With :const:`PART_MODE`,
+        scores are converted one at a time, and the pool works on the parts of one score, as in
+        :meth:`process_score`. With :const:`SCORE_MODE`, every score is converted by a single
+        process, and the pool works on many scores at once. This is much faster for a lot of small
+        scores (like Bach chorales), where sending every part to a worker is a large share of the
+        work of converting it.
+
+        A :class:`Score` that was already used can't always be pickled, and the pool pickles in
+        another thread, which isn't safe for :mod:`music21` objects. So in :const:`SCORE_MODE`, a
+        file name is parsed and converted by the worker, while for a :class:`Score` we extract the
+        IR of its parts here, and the worker converts the whole score from the IR. A
+        :class:`Stream` that isn't a :class:`Score` is converted here, without the pool.
+
+        If ``mode`` is ``None`` (the default), we choose for every score. File names are converted
+        in :const:`SCORE_MODE`, since parsing usually takes longest. A :class:`Score` is converted
+        in :const:`PART_MODE` if it has more than one part (or this converter splits parts into
+        chunks) and at least :const:`LARGE_SCORE_MEASURES` measures, and otherwise in
+        :const:`SCORE_MODE`. Both modes use the same pool, so the workers keep converting files
+        while we prepare the parts of a large score.
+
+        The part cache given to the constructor is used only in :const:`PART_MODE`.
+
+        :param scores: The scores to convert. Every item is either a :class:`Stream`, or the name
+            of a file that :func:`music21.converter.parse` can read. The iterable is consumed a
+            few scores at a time, so it may be a generator of scores that don't fit in memory at
+            once.
+        :type scores: iterable of :class:`music21.stream.Stream` or string
+        :param the_settings: An optional settings object for every score. The default is the
+            settings object given to the constructor, or a new one if there was none.
+        :type the_settings: :class:`settings.LilyPondSettings`
+        :param mode: Either :const:`PART_MODE`, :const:`SCORE_MODE`, or ``None`` to choose for every
+            score.
+        :type mode: string
+
+        :returns: A generator of LilyPond files, one for every score.
+        :rtype: generator of ``unicode``
+
+        :raises: :exc:`ValueError` if ``mode`` isn't one of the accepted values.
+        :raises: Any exception raised while parsing or converting a score, when its file would be
+            yielded.
+        """
+        if mode not in (None, PART_MODE, SCORE_MODE):
+            raise ValueError('LilyConverter.process_corpus(): unknown mode "{}"'.format(mode))
+        return self._process_corpus(scores, self._get_settings(the_settings), mode)
+
+    def _process_corpus(self, scores, the_settings, mode):
+        """
+        Do the work of :meth:`process_corpus`, after checking its arguments.
+        """
+        the_stats = the_settings.stats
+        # The settings are pickled once, here, rather than once for every file.
+        pickled_settings = pickle.dumps(the_settings, pickle.HIGHEST_PROTOCOL)
+        # Enough files are started to keep every worker busy while we wait for the first one, but
+        # not so many that we hold the whole corpus in memory.
+        most_pending = 2 * self._get_processes()
+        pending = deque()
+        for each_score in scores:
+            if isinstance(each_score, string_types) and PART_MODE != mode:
+                pending.append(self._get_pool().apply_async(_convert_file,
+                                                            (each_score, pickled_settings)))
+            else:
+                if isinstance(each_score, string_types):
+                    each_score = converter.parse(each_score)
+                if self._choose_mode(each_score, mode) == PART_MODE:
+                    lily = self.process_score(each_score, the_settings)
+                    pending.append(_InlineResult((lily, None)))
+                elif isinstance(each_score, stream.Score):
+                    score_ir = _extract_score(each_score, the_settings)
+                    pending.append(self._get_pool().apply_async(_convert_score_ir,
+                                                                (score_ir, pickled_settings)))
+                else:
+                    lily = functions.stream_to_lily(each_score, the_settings)
+                    pending.append(_InlineResult((lily, None)))
+            while pending and (len(pending) > most_pending or pending[0].ready()):
+                yield self._corpus_result(pending.popleft(), the_stats)
+        while pending:
+            yield self._corpus_result(pending.popleft(), the_stats)
+
+    @staticmethod
+    def _corpus_result(result, the_stats):
+        """
+        Wait for a result in :meth:`process_corpus`, add its stats to ours, and return its
+        LilyPond file.
+        """
+        with stats.timer(the_stats, 'wait'):
+            lily, file_stats = result.get()
+        if file_stats is not None:
+            the_stats.merge(file_stats)
+        return lily
+
+    def _choose_mode(self, the_score, mode):
+        """
+        Choose between :const:`PART_MODE` and :const:`SCORE_MODE` for a :class:`Stream`, as
+        described in :meth:`process_corpus`.
+        """
+        if mode is not None:
+            return mode
+        elif not isinstance(the_score, stream.Score):
+            return SCORE_MODE
+        parts = [x for x in the_score if isinstance(x, stream.Part)]
+        if len(parts) < 2 and self._measures_per_chunk is None:
+            return SCORE_MODE
+        measures = 0
+        for each_part in parts:
+            measures += len(each_part.getElementsByClass(stream.Measure))
+            if measures >= LARGE_SCORE_MEASURES:
+                return PART_MODE
+        return SCORE_MODE
+
+    def close(self):
+        """
+        Stop the worker pool once all of its work is finished. The pool is started again if you
+        call :meth:`process_score` later.
+        """
+        with self._lock:
+            the_pool, self._pool = self._pool, None
+        if the_pool is not None:
+            the_pool.close()
+            the_pool.join()
+
+    def terminate(self):
+        """
+        Stop the worker pool immediately, without waiting for its work to finish.
+        """
+        with self._lock:
+            the_pool, self._pool = self._pool, None
+        if the_pool is not None:
+            the_pool.terminate()
+            the_pool.join()
+
+
+def _convert_part_ir(part_ir, setts, the_index, part_name):
+    """
+    Call :func:`ir.part_ir_to_lily` in a worker process, with a new context for this part, and
+    time it if the settings object has a ``stats`` object.
+
+    :returns: The 3-tuple from :func:`ir.part_ir_to_lily`, with the part's
+        :class:`ConversionContext` and a new :class:`stats.ConversionStats` for this part only
+        (or ``None`` if there are no stats).
+    :rtype: 5-tuple
+    """
+    part_context = ConversionContext()
+    if setts.stats is None:
+        result = ir.part_ir_to_lily(part_ir, setts, the_index, None, part_name, part_context)
+        return result + (part_context, None)
+    part_stats = stats.ConversionStats()
+    start = time.time()
+    result = ir.part_ir_to_lily(part_ir, setts, the_index, None, part_name, part_context)
+    seconds = time.time() - start
+    part_stats.add_time('convert', seconds)
+    part_stats.add_part_time(part_name, seconds)
+    return result + (part_context, part_stats)
+
+
+def _measures_ir_to_lily_with_stats(items):
+    """
+    Call :func:`ir.measures_ir_to_lily` in a worker process, and time it.
+
+    :returns: The LilyPond string, and how long it took.
+    :rtype: 2-tuple of unicode string and float
+    """
+    start = time.time()
+    body = ir.measures_ir_to_lily(items)
+    return body, time.time() - start
+
+
+def _convert_file(filename, pickled_settings):
+    """
+    Parse and convert a file in a worker process, for :meth:`LilyConverter.process_corpus`. A
+    daemonic worker can't start a pool of its own, so the parts are converted in this process.
+
+    :param filename: The file to parse.
+    :type filename: string
+    :param pickled_settings: The settings object, pickled.
+    :type pickled_settings: bytes
+
+    :returns: The LilyPond file, and the stats of this file only (or ``None`` if there are no
+        stats).
+    :rtype: 2-tuple of ``unicode`` and :class:`stats.ConversionStats`
+    """
+    setts = pickle.loads(pickled_settings)
+    if setts.stats is not None:
+        # the caller already has the rest
+        setts.stats = stats.ConversionStats()
+    the_score = converter.parse(filename)
+    if isinstance(the_score, stream.Score):
+        lily = LilyMultiprocessor(the_score, setts, InlinePool()).run()
+    else:
+        lily = functions.stream_to_lily(the_score, setts)
+    return lily, setts.stats
+
+
+def _extract_score(the_score, setts):
+    """
+    Prepare a :class:`Score` for :func:`_convert_score_ir`, in this process. Every :class:`Part`
+    is extracted to its IR, and everything else is converted to its LilyPond string already, so
+    the result is cheap to send to a worker.
+
+    :param the_score: The score to prepare.
+    :type the_score: :class:`music21.stream.Score`
+    :param setts: The settings object.
+    :type setts: :class:`settings.LilyPondSettings`
+
+    :returns: A :class:`~outputlilypond.ir.PartIR` or a LilyPond string for every element of the
+        score, in score order.
+    :rtype: list
+    """
+    the_stats = setts.stats
+    post = []
+    for thing in the_score:
+        if isinstance(thing, stream.Part):
+            with stats.timer(the_stats, 'extract'):
+                post.append(ir.extract_part(thing))
+            if the_stats is not None:
+                the_stats.count_elements(thing)
+        else:
+            with stats.timer(the_stats, 'other'):
+                post.append(functions.stream_to_lily(thing, setts))
+    return post
+
+
+def _convert_score_ir(score_ir, pickled_settings):
+    """
+    Convert a whole score from its IR in a worker process, for
+    :meth:`LilyConverter.process_corpus`. The output is the same as from
+    :class:`LilyMultiprocessor`.
+
+    :param score_ir: The score, from :func:`_extract_score`.
+    :type score_ir: list
+    :param pickled_settings: The settings object, pickled.
+    :type pickled_settings: bytes
+
+    :returns: The LilyPond file, and the stats of this file only (or ``None`` if there are no
+        stats).
+    :rtype: 2-tuple of ``unicode`` and :class:`stats.ConversionStats`
+    """
+    setts = pickle.loads(pickled_settings)
+    if setts.stats is not None:
+        # the caller already has the rest
+        setts.stats = stats.ConversionStats()
+    the_stats = setts.stats
+    context = ConversionContext()
+    context.parts_in_this_score = [None] * len(score_ir)
+    post = [score_header(setts)]
+    for i, thing in enumerate(score_ir):
+        if isinstance(thing, ir.PartIR):
+            part_name = functions.new_part_name(context, remember=False)
+            start = time.time()
+            lily = ir.part_ir_to_lily(thing, setts, None, None, part_name, context)
+            if the_stats is not None:
+                seconds = time.time() - start
+                the_stats.add_time('convert', seconds)
+                the_stats.add_part_time(part_name, seconds)
+            context.parts_in_this_score[i] = part_name
+        else:
+            lily = thing
+        if lily:
+            post.extend([lily, u'\n'])
+    with stats.timer(the_stats, 'score block'):
+        post.append(score_block(setts, context))
+    return u''.join(post), the_stats
+
+
+class _InlineResult(object):
+    "The result of a task in an :class:`InlinePool`, like :class:`multiprocessing.pool.AsyncResult`."
+
+    def __init__(self, value):
+        self._value = value
+
+    def ready(self):
+        "The task is always finished."
+        return True
+
+    def successful(self):
+        "The task always succeeded, or :meth:`InlinePool.apply_async` would have raised."
+        return True
+
+    def wait(self, timeout=None):
+        "There's nothing to wait for."
+        pass
+
+    def get(self, timeout=None):
+        "Return the task's result."
+        return self._value
+
+
+class InlinePool(object):
+    """
+    A stand-in for :class:`multiprocessing.Pool` that does every task right away, in this process.
+
+    Give it to :class:`LilyMultiprocessor` where you can't (or don't want to) start worker
+    processes, like in a worker process that converts a whole score:
+
+    >>> LilyMultiprocessor(the_score, the_settings, pool=InlinePool()).run()
+    """
+
+    def apply_async(self, func, args=(), kwds=None, callback=None):
+        "Call ``func`` now, then ``callback`` with its result. Exceptions are raised right away."
+        result = func(*args, **(kwds or {}))
+        if callback is not None:
+            callback(result)
+        return _InlineResult(result)
+
+    def close(self):
+        "There are no workers to stop."
+        pass
+
+    def terminate(self):
+        "There are no workers to stop."
+        pass
+
+    def join(self):
+        "There are no workers to wait for."
+        pass
+
+
+class LilyMultiprocessor(object):
+    "Manage multiprocessing for outputlilypond."
+
+    def __init__(self, score, setts, pool=None, measures_per_chunk=None, part_cache=None):
+        """
+        Create a new LilyMultiprocessor instance.
+
+        :param score: The :class:`Score` to convert.
+        :type score: :class:`music21.stream.Score`
+        :param setts: The settings object for this score. We don't change it, so it may be shared
+            with other conversions.
+        :type setts: :class:`settings.LilyPondSettings`
+        :param pool: An optional pool of worker processes. If you provide a pool, it is not closed
+            after :meth:`run`; otherwise we use a new pool and close it when finished.
+        :type pool: :class:`multiprocessing.pool.Pool`
+        :param measures_per_chunk: Split parts into chunks of this many measures. Refer to
+            :func:`process_score`.
+        :type measures_per_chunk: int
+        :param part_cache: An optional cache of converted parts. Refer to :func:`process_score`.
+        :type part_cache: :class:`cache.PartCache`
+
+        :raises: :exc:`ValueError` if ``measures_per_chunk`` is less than ``1``.
+        """
+        super(LilyMultiprocessor, self).__init__()
+        self._score = score
+        self._setts = setts
+        if measures_per_chunk is not None and measures_per_chunk < 1:
+            raise ValueError('LilyMultiprocessor: "measures_per_chunk" must be at least 1')
+        self._measures_per_chunk = measures_per_chunk
+        self._part_cache = part_cache
+        self._own_pool = pool is None
+        self._pool = Pool() if pool is None else pool
+        self._finished_parts = []
+        self._final_result = None
+        self._context = ConversionContext()
+
+    @property
+    def context(self):
+        "The :class:`ConversionContext` of the last call to :meth:`run` or :meth:`run_iter`."
+        return self._context
+
+    def callback(self, result):
+        """
+        For internal use.
+
+        Called when :func:`ir.part_ir_to_lily` has finished converting an object to its
+        LilyPond representation.The method adds the resulting string to the internal list of
+        analyses.
+        """
+        # we have to put things in their proper indices!
+        self._finished_parts[result[0]] = result[1]
+        self._context.parts_in_this_score[result[0]] = result[2]
+        if len(result) > 3:
+            # from _convert_part_ir()
+            self._context.merge(result[3])
+            if result[4] is not None:
+                self._setts.stats.merge(result[4])
+
+    def run(self):
+        """
+        Process all the parts! Prepare a score!
+
+        :returns: The whole LilyPond file.
+        :rtype: ``unicode``
+        """
+        self._final_result = u''.join(self.run_iter())
+
+        # Return the "finished score"
+        return self._final_result
+
+    def run_iter(self):
+        """
+        Process all the parts, and yield the LilyPond file piece by piece: first the header, then
+        every part (in score order) as soon as it's finished, then the ``\\score`` and ``\\layout``
+        blocks. Once a part is yielded, we forget it, so the whole file is never held in memory.
+
+        :returns: A generator of strings which, joined together, are the whole LilyPond file.
+        :rtype: generator of ``unicode``
+        """
+        try:
+            for each_piece in self._run_iter():
+                yield each_piece
+        finally:
+            # If the caller stopped early, our own pool may still be working
+            if self._own_pool and self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+            self._pool = None
+
+    def _run_iter(self):
+        """
+        Do the work of :meth:`run_iter`.
+        """
+
+        # Things Before Parts:
+        yield score_header(self._setts)
+
+        # Parts:
+        # Initialize the length of finished "parts" (maybe they're other things, too, like Metadata
+        # or whatever... doesn't really matter).
+        self._finished_parts = [None for i in xrange(len(self._score))]
+        self._context = ConversionContext()
+        self._context.parts_in_this_score = [None for i in xrange(len(self._score))]
+
+        # Go through the possible parts and see what we find. We start the work on every part
+        # before waiting for any of them.
+        pending = {}
+        cache_keys = {}
+        cached_parts = {}
+        part_names = {}
+        the_stats = self._setts.stats
+        if the_stats is None:
+            convert_chunk = ir.measures_ir_to_lily
+        else:
+            convert_chunk = _measures_ir_to_lily_with_stats
+        for i in xrange(len(self._score)):
+            if isinstance(self._score[i], stream.Part):
+                # We name the parts here, in score order, because the workers can't tell one
+                # another which names they've used.
+                part_names[i] = functions.new_part_name(self._context, remember=False)
+                # Send the compact IR instead of the Part itself: pickling a whole music21 Part
+                # often takes longer than converting it.
+                with stats.timer(the_stats, 'extract'):
+                    part_ir = ir.extract_part(self._score[i])
+                if the_stats is not None:
+                    the_stats.count_elements(self._score[i])
+                if self._part_cache is not None:
+                    with stats.timer(the_stats, 'part cache'):
+                        cache_keys[i] = self._part_cache.make_key(part_ir, self._setts)
+                        cached = self._part_cache.get(cache_keys[i])
+                    if cached is not None:
+                        if ir.is_analysis_voice(part_ir):
+                            self._context.analysis_notation_parts.append(part_names[i])
+                        cached_parts[i] = cached
+                        continue
+                measures = part_ir.items
+                step = self._measures_per_chunk
+                if step is not None and not part_ir.is_analysis and len(measures) > step:
+                    # A long part: convert chunks of measures in parallel, and put them back
+                    # together once they're all finished.
+                    chunks = [self._pool.apply_async(convert_chunk, (measures[j:j + step],))
+                              for j in xrange(0, len(measures), step)]
+                    pending[i] = (part_ir, chunks)
+                else:
+                    args = (part_ir, self._setts, i, part_names[i])
+                    pending[i] = (None, [self._pool.apply_async(_convert_part_ir, args,
+                                                                callback=self.callback)])
+            else:
+                with stats.timer(the_stats, 'other'):
+                    self._finished_parts[i] = functions.stream_to_lily(self._score[i],
+                                                                       self._setts)
+        if self._own_pool:
+            self._pool.close()
+
+        # Output the parts in order. If the pool belongs to someone else, it may be working on
+        # other scores too, so we only wait for our own parts.
+        for i in xrange(len(self._finished_parts)):
+            if i in cached_parts:
+                # The cached string has no part name, so we add this score's name.
+                part_name = part_names[i]
+                self.callback((i, part_name + cached_parts.pop(i), part_name))
+            elif i in pending:
+                part_ir, results = pending.pop(i)
+                if part_ir is None:
+                    # get() raises the worker's exception, if any
+                    with stats.timer(the_stats, 'wait'):
+                        results[0].get()
+                else:
+                    # Put together a part that was converted in chunks. The IR of every measure
+                    # already holds the duration of a full measure, so the chunks don't depend on
+                    # one another.
+                    with stats.timer(the_stats, 'wait'):
+                        chunks = [each_chunk.get() for each_chunk in results]
+                    if the_stats is not None:
+                        seconds = sum(each_chunk[1] for each_chunk in chunks)
+                        the_stats.add_time('convert', seconds)
+                        the_stats.add_part_time(part_names[i], seconds)
+                        chunks = [each_chunk[0] for each_chunk in chunks]
+                    self.callback(ir.part_ir_to_lily(part_ir, self._setts, i, u''.join(chunks),
+                                                     part_names[i], self._context))
+                if i in cache_keys and self._finished_parts[i] is not None:
+                    part_name = self._context.parts_in_this_score[i]
+                    self._part_cache.put(cache_keys[i], self._finished_parts[i][len(part_name):])
+            if self._finished_parts[i] != u'' and self._finished_parts[i] is not None:
+                yield self._finished_parts[i] + u'\n'
+            self._finished_parts[i] = None
+
+        if self._own_pool:
+            self._pool.join()
+            self._pool = None
+
+        # Things After Parts
+        score_block_start = time.time()
+        post = score_block(self._setts, self._context)
+        if the_stats is not None:
+            the_stats.add_time('score block', time.time() - score_block_start)
+        yield post
+
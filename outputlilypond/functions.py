@@ -26,10 +26,12 @@ Converter functions used by outputlilypond.
 
 
 import random
+import time
 from itertools import repeat
 from music21 import clef, duration, chord, note, key, meter, layout, expressions, humdrum, bar, \
-    stream, instrument, tempo, converter, metadata, text
-from outputlilypond import problems, settings
+    stream, converter, metadata, text
+from outputlilypond import problems, registry, settings
+from outputlilypond.context import ConversionContext
 # For python 2 and 3 compatibility:
 import sys
 if sys.version_info[0] > 2:
@@ -69,6 +71,36 @@ Quarter-length-to-string equivalencies used by :func:`duration_to_lily`.
 DURATION_DICT = {16.0: u'\\longa', 8.0: u'\\breve', 4.0: u'1', 2.0: u'2', 1.0: u'4', 0.5: u'8',
                  0.25: u'16', 0.125: u'32', 0.0625: u'64', 0.03125: u'128'}
 
+"""
+Note-type-to-string equivalencies, for the :attr:`music21.duration.Duration.type` values that
+match the durations in :data:`DURATION_DICT`.
+"""
+TYPE_DICT = {'longa': u'\\longa', 'breve': u'\\breve', 'whole': u'1', 'half': u'2', 'quarter': u'4',
+             'eighth': u'8', '16th': u'16', '32nd': u'32', '64th': u'64', '128th': u'128'}
+
+"""
+The largest number of dots in :data:`DOTTED_DURATION_DICT` and :data:`DOTTED_TYPE_DICT`.
+"""
+MAX_DOTS = 4
+
+
+"""
+Quarter-length-to-string equivalencies for every duration in :data:`DURATION_DICT` with up to
+:data:`MAX_DOTS` dots, used by :func:`quarter_length_to_lily`. A :class:`~fractions.Fraction` key
+finds the same value as the equal ``float``. (Every dot adds half the value of the previous one).
+"""
+DOTTED_DURATION_DICT = {dur_ql * (2.0 - 0.5 ** dots): lily + u'.' * dots
+                        for dur_ql, lily in DURATION_DICT.items()
+                        for dots in range(MAX_DOTS + 1)}
+
+"""
+Note-type-and-dots-to-string equivalencies used by :func:`note_type_to_lily` for tuplets, where
+the quarterLength doesn't match the written note. The keys are ``(type, dots)`` tuples.
+"""
+DOTTED_TYPE_DICT = {(note_type, dots): lily + u'.' * dots
+                    for note_type, lily in TYPE_DICT.items()
+                    for dots in range(MAX_DOTS + 1)}
+
 
 """
 Octave-number-to-string equivalencies used by :func:`octave_num_to_lily`.
@@ -76,12 +108,88 @@ Octave-number-to-string equivalencies used by :func:`octave_num_to_lily`.
 OCTAVE_DICT = {0: u",,,", 1: u",,", 2: u",", 3: u"", 4: u"'", 5: u"''", 6: u"'''", 7: u"''''",
                8: u"'''''", 9: u"''''''", 10: u"'''''''", 11: u"''''''''", 12: u"'''''''''"}
 
+"""
+Accidental-to-string equivalencies used to build :data:`PITCH_DICT`. The keys are the accidental
+part of :attr:`music21.pitch.Pitch.name`, and the values are LilyPond's (Dutch) suffixes, including
+the quarter-tone accidentals.
+"""
+ACCIDENTAL_DICT = {u'': u'',
+                   u'#': u'is', u'##': u'isis', u'###': u'isisis', u'####': u'isisisis',
+                   u'-': u'es', u'--': u'eses', u'---': u'eseses', u'----': u'eseseses',
+                   u'~': u'ih', u'#~': u'isih', u'`': u'eh', u'-`': u'eseh'}
+
+
+def _make_pitch_dict():
+    "Build :data:`PITCH_DICT` from :data:`ACCIDENTAL_DICT` and :data:`OCTAVE_DICT`."
+    post = {}
+    for step in u'ABCDEFG':
+        for accidental, suffix in ACCIDENTAL_DICT.items():
+            pclass = step.lower() + suffix
+            post[(step + accidental, None)] = pclass
+            for octave, marks in OCTAVE_DICT.items():
+                post[(step + accidental, octave)] = pclass + marks
+    return post
+
+"""
+Pitch-to-string equivalencies used by :func:`pitch_name_to_lily`. The keys are ``(name, octave)``
+tuples, where ``name`` is like :attr:`music21.pitch.Pitch.name` (as in ``u'B-'``) and ``octave``
+is ``None`` for a pitch without octave marks.
+"""
+PITCH_DICT = _make_pitch_dict()
+
+
+"""
+The letters used as digits in part names, by :func:`part_name_for_number`.
+"""
+PART_NAME_LETTERS = u'abcdefghijklmnopqrstuvwxyz'
+
+"""
+The name of the first part in a score. Later parts count up from here, in base 26.
+"""
+FIRST_PART_NAME = u'partaaaa'
+
+
+def _part_name_to_number(name):
+    "The number that :func:`part_name_for_number` writes as ``name``, if there were no offset."
+    number = 0
+    for letter in name:
+        number = number * len(PART_NAME_LETTERS) + PART_NAME_LETTERS.index(letter)
+    return number
+
+
+_FIRST_PART_NUMBER = _part_name_to_number(FIRST_PART_NAME)
+
+
+def part_name_for_number(number):
+    """
+    Make the name of a part from its number, counting up from :const:`FIRST_PART_NAME` in base 26
+    with the letters ``a`` to ``z`` as digits. Part ``0`` is ``partaaaa``, part ``1`` is
+    ``partaaab``, part ``26`` is ``partaaba``, and so on. Every name has eight letters.
+
+    :param number: The number of the part, counting from zero.
+    :type number: integer
+
+    :returns: The part's name.
+    :rtype: unicode string
+
+    :raises: :exc:`ValueError` if there's no eight-letter name for ``number``.
+    """
+    value = _FIRST_PART_NUMBER + number
+    letters = []
+    for _ in repeat(None, len(FIRST_PART_NAME)):
+        value, digit = divmod(value, len(PART_NAME_LETTERS))
+        letters.append(PART_NAME_LETTERS[digit])
+    if number < 0 or value > 0:
+        raise ValueError('There is no part name for part number {}'.format(number))
+    return u''.join(reversed(letters))
+
 
 def string_of_n_letters(n):
     """
     Generate a string of ``n`` pseudo-random letters.
 
-    This function is currently used to help create unique part names in scores.
+    This function used to create the part names in scores; now we use
+    :func:`part_name_for_number`, so the same score always produces the same LilyPond file.
 
     :param n: How long the output string should be.
     :type n: integer
@@ -181,32 +289,63 @@ def duration_to_lily(dur, known_tuplet=False):
             # We have part of a tuple. This isn't necessarily a problem; we'll
             # assume we are given this by process_measure() and that it knows
             # what's going on. But, in tuplets, the quarterLength doesn't match
-            # the type of written note, so we'll make a new Duration with an
-            # adjusted quarterLength
-            dur = duration.Duration(dur.type)
+            # the type of written note, so we use the type instead.
+            try:
+                return note_type_to_lily(dur.type, dur.dots)
+            except duration.DurationException:
+                raise problems.ImpossibleToProcessError('music21 cannot process this duration')
         else:
             msg = 'duration_to_lily(): Cannot process tuplet components'
             raise problems.ImpossibleToProcessError(msg)
 
-    dur_ql = dur.quarterLength
-    # If there are no dots, the value should be in the dictionary, and we can simply return it.
-    if dur_ql in DURATION_DICT:
-        return DURATION_DICT[dur_ql]
-    else:
-        # We have to figure out the largest value that will fit, then append some dots.
-        post = None
-        for durat in sorted(DURATION_DICT.keys(), reverse=True):  # we need largest-to-smallest qLs
-            if (dur_ql - durat) > 0.0:
-                post = DURATION_DICT[durat]
-                break
-        # For every dot in this Duration, append a '.' to "post"
-        try:
-            for _ in repeat(None, dur.dots):
-                post += u'.'
-        except duration.DurationException:
-            raise problems.ImpossibleToProcessError('music21 cannot process this duration')
+    return quarter_length_to_lily(dur.quarterLength)
 
-        return post
+
+def quarter_length_to_lily(dur_ql):
+    """
+    Convert a quarterLength into the LilyPond string, with as many dots as required.
+
+    This is the part of :func:`duration_to_lily` that does not need a :class:`Duration` object. It
+    does not check for tuplets or zero-length durations.
+
+    :param dur_ql: The quarterLength of the duration, including the value of its dots.
+    :type dur_ql: float or :class:`fractions.Fraction`
+
+    :returns: The LilyPond-format notation for this duration.
+    :rtype: unicode string
+
+    :raises: :exc:`ImpossibleToProcessError` if no single LilyPond duration (with up to
+        :data:`MAX_DOTS` dots) is this long.
+    """
+    try:
+        return DOTTED_DURATION_DICT[dur_ql]
+    except KeyError:
+        msg = u'Cannot output a quarterLength of {} as a single duration'.format(dur_ql)
+        raise problems.ImpossibleToProcessError(msg)
+
+
+def note_type_to_lily(note_type, dots=0):
+    """
+    Convert a note type and number of dots into the LilyPond string. Use this for the written
+    duration of a note in a tuplet, whose quarterLength doesn't match its type.
+
+    :param note_type: The note type, as in :attr:`music21.duration.Duration.type` (like
+        ``'eighth'``).
+    :type note_type: string
+    :param dots: The number of dots. The default is ``0``.
+    :type dots: int
+
+    :returns: The LilyPond-format notation for this duration.
+    :rtype: unicode string
+
+    :raises: :exc:`ImpossibleToProcessError` if LilyPond has no such note type, or there are more
+        than :data:`MAX_DOTS` dots.
+    """
+    try:
+        return DOTTED_TYPE_DICT[(note_type, dots)]
+    except KeyError:
+        msg = u'Cannot output a "{}" note with {} dots'.format(note_type, dots)
+        raise problems.ImpossibleToProcessError(msg)
 
 
 def octave_num_to_lily(num):
@@ -243,23 +382,43 @@ def pitch_to_lily(the_pitch, include_octave=True):
 
     :returns: The LilyPond-format notation for this pitch.
     :rtype: unicode string
+
+    :raises: :exc:`UnidentifiedObjectError` if the accidental or octave cannot be output.
     """
-    pclass = the_pitch.name.lower()
-    post = [pclass[0]]
+    if include_octave is True:
+        octave = the_pitch.octave
+        if octave is None:
+            octave = the_pitch.implicitOctave
+        return pitch_name_to_lily(the_pitch.name, octave)
+    else:
+        return pitch_name_to_lily(the_pitch.name)
 
-    for accidental in pclass[1:]:
-        if '-' == accidental:
-            post.append(u'es')
-        elif '#' == accidental:
-            post.append(u'is')
 
-    if include_octave is True:
-        if the_pitch.octave is None:
-            post.append(octave_num_to_lily(the_pitch.implicitOctave))
-        else:
-            post.append(octave_num_to_lily(the_pitch.octave))
+def pitch_name_to_lily(name, octave=None):
+    """
+    Convert a pitch name and octave number into the LilyPond string.
 
-    return ''.join(post)
+    :param name: The pitch name, as in :attr:`music21.pitch.Pitch.name` (like ``u'B-'``).
+    :type name: string
+    :param octave: The octave number. If this is ``None`` (the default), the output has no octave
+        marks.
+    :type octave: int
+
+    :returns: The LilyPond-format notation for this pitch.
+    :rtype: unicode string
+
+    :raises: :exc:`UnidentifiedObjectError` if the accidental or octave cannot be output.
+    """
+    try:
+        return PITCH_DICT[(name, octave)]
+    except KeyError:
+        pass
+    if octave is not None:
+        octave_num_to_lily(octave)  # raises if it's out of range
+    try:
+        return PITCH_DICT[(name[:1].upper() + name[1:], octave)]  # a lowercase name
+    except KeyError:
+        raise problems.UnidentifiedObjectError('Pitch name not recognized: ' + text(name))
 
 
 def note_to_lily(the_note, known_tuplet=False):
@@ -326,7 +485,229 @@ def note_to_lily(the_note, known_tuplet=False):
     return u''.join(post)
 
 
-def measure_to_lily(meas, incomplete=False):
+class MeasureState(object):
+    """
+    What the handlers used by :func:`measure_to_lily` know about the :class:`Measure` being
+    converted. A handler adds its output to :attr:`post`.
+    """
+
+    def __init__(self, meas, invisible, bar_ql=None):
+        # The Measure being converted.
+        self.measure = meas
+        # Whether the Measure is "invisible."
+        self.invisible = invisible
+        # The quarterLength of a full Measure, or None if we haven't needed it yet. Use
+        # bar_quarter_length() instead.
+        self.bar_ql = bar_ql
+        # An iterator over the Measure's elements. Take elements from it to handle several at once,
+        # as we do for tuplets.
+        self.elements = self._iterate(meas)
+        # The list of strings that will be joined into the LilyPond output.
+        self.post = []
+        # This holds \markup{} blocks that happened before a Note/Rest, and should be appended
+        # to the next Note/Rest that happens.
+        self.attach_this_markup = u''
+        # Whether a handler already put a bar-check symbol at the end of the Measure.
+        self.barcheck_included = False
+        # Whether the last element at an earlier offset than the current element is a Note or
+        # Rest, so that a \markup{} block at this offset can be attached to it. This is the same as
+        # asking Measure.getElementBeforeOffset(), without searching the Measure again.
+        self.follows_note = False
+
+    def _iterate(self, meas):
+        "Yield the elements of ``meas`` in order, keeping :attr:`follows_note` up to date."
+        group_offset = None
+        previous_element = None
+        for obj in meas:
+            offset = obj.offset
+            if offset != group_offset:
+                # the first element at a new offset; the elements are sorted by offset
+                self.follows_note = isinstance(previous_element, (note.Note, note.Rest))
+                group_offset = offset
+            previous_element = obj
+            yield obj
+
+    def bar_quarter_length(self):
+        """
+        The quarterLength of a full :class:`Measure`. If we weren't given it, this asks
+        :attr:`Measure.barDuration`, which may search the context for a :class:`TimeSignature`, but
+        only the first time.
+        """
+        if self.bar_ql is None:
+            self.bar_ql = self.measure.barDuration.quarterLength
+        return self.bar_ql
+
+
+def _ignore(obj, state):
+    "Ignore an object; the default handler of :func:`measure_to_lily`."
+    pass
+
+
+"""
+The handlers used by :func:`measure_to_lily`, keyed on the class of the object in the
+:class:`Measure`. Every handler is called with the object and a :class:`MeasureState`. Objects
+without a handler are ignored. The multiprocessing converter doesn't use these handlers, so
+:func:`register_element`, which registers with both, is the only way to output other objects.
+"""
+_MEASURE_HANDLERS = registry.TypeRegistry(default=_ignore)
+
+
+def _note_or_rest_to_lily(obj, state):
+    "Handle a :class:`Note` or :class:`Rest` in :func:`measure_to_lily`."
+    post = state.post
+    # TODO: is there a situation where I'll ever need to deal with
+    # multiple-component durations for a single Note/Rest?
+    # ANSWER: yes, sometimes
+
+    # Is it a full-measure rest?
+    if isinstance(obj, note.Rest) and state.bar_quarter_length() == obj.quarterLength:
+        if state.invisible:
+            post.extend(['s', duration_to_lily(obj.duration), u' '])
+        else:
+            post.extend([u'R', duration_to_lily(obj.duration), u' '])
+    # Is it the start of a tuplet?
+    elif obj.duration.tuplets:
+        number_of_tuplet_components = obj.duration.tuplets[0].numberNotesActual
+        in_the_space_of = obj.duration.tuplets[0].numberNotesNormal
+        post.extend([u'\\times ', text(in_the_space_of), u'/',
+            text(number_of_tuplet_components), u' { ',
+            note_to_lily(obj, True), u" "])
+        # For every tuplet component...
+        for _ in repeat(None, number_of_tuplet_components - 1):
+            post.extend([note_to_lily(next(state.elements), True), u' '])
+        post.append(u'} ')
+    # It's just a regular note or rest
+    else:
+        post.extend([note_to_lily(obj), u' '])
+
+    # Is there a \markup{} block to append?
+    if state.attach_this_markup != '':
+        post.append(state.attach_this_markup)
+        state.attach_this_markup = ''
+
+
+def _chord_to_lily(obj, state):
+    "Handle a :class:`Chord` in :func:`measure_to_lily`."
+    state.post.extend([note_to_lily(obj), u' '])
+
+
+def _clef_to_lily(obj, state):
+    "Handle a :class:`Clef` in :func:`measure_to_lily`."
+    state.post.append(clef_to_lily(obj, append=u'\n\t', invisible=state.invisible))
+
+
+def _time_signature_to_lily(obj, state):
+    "Handle a :class:`TimeSignature` in :func:`measure_to_lily`."
+    if state.invisible:
+        state.post.append(u"\\once \\override Staff.TimeSignature #'transparent = ##t\n\t")
+    state.post.extend([u"\\time ",
+        text(obj.beatCount), "/",
+        text(obj.denominator), u"\n\t"])
+
+
+def _key_signature_to_lily(obj, state):
+    "Handle a :class:`KeySignature` in :func:`measure_to_lily`."
+    pitch_and_mode = obj.pitchAndMode
+    if state.invisible:
+        state.post.append(u"\\once \\override Staff.KeySignature #'transparent = ##t\n\t")
+    if 2 == len(pitch_and_mode) and pitch_and_mode[1] is not None:
+        state.post.extend([u"\\key ",
+                           pitch_to_lily(pitch_and_mode[0], include_octave=False),
+                           u" \\" + pitch_and_mode[1] + "\n\t"])
+    else:
+        # We'll have to assume it's \major, because music21 does that.
+        state.post.extend([u"\\key ",
+                           pitch_to_lily(pitch_and_mode[0], include_octave=False),
+                           u" \\major\n\t"])
+
+
+def _barline_in_measure_to_lily(obj, state):
+    "Handle a :class:`Barline` in :func:`measure_to_lily`."
+    # We don't need to write down a regular barline, but either way, we definitely
+    # should include a bar-check symbol
+    state.barcheck_included = True
+    if 'regular' != obj.style:
+        state.post.extend([u'|\n', u'\t', barline_to_lily(obj), u'\n'])
+    else:
+        state.post.append(u'|\n')
+
+
+def _text_expression_to_lily(obj, state):
+    "Handle a :class:`TextExpression` (like \"con fuoco\") in :func:`measure_to_lily`."
+    the_marker = None  # store the local thing
+    if obj.positionVertical > 0:  # above staff
+        the_marker = [u"^\\markup{ "]
+    elif obj.positionVertical < 0:  # below staff
+        the_marker = [u"_\\markup{ "]
+    else:  # LilyPond can decide above or below
+        the_marker = [u"-\\markup{ "]
+    if obj.enclosure is not None:  # put a shape around the text?
+        pass  # TODO
+    the_marker.extend([u'"', obj.content, u'" }'])
+    if obj.enclosure is not None:  # must close the enclosure, if necessary
+        the_marker.append(u'}')
+    the_marker.append(u' ')
+
+    # Find out whether there's a previous Note or Rest to attach to
+    if not state.follows_note:
+        # this variable holds text to append to the next Note/Rest
+        state.attach_this_markup = u''.join([state.attach_this_markup] + the_marker)
+    else:  # There was a previous Note/Rest, so we're good
+        state.post.append(u''.join(the_marker))
+
+
+_MEASURE_HANDLERS.register(note.Note, _note_or_rest_to_lily)
+_MEASURE_HANDLERS.register(note.Rest, _note_or_rest_to_lily)
+_MEASURE_HANDLERS.register(chord.Chord, _chord_to_lily)
+_MEASURE_HANDLERS.register(clef.Clef, _clef_to_lily)
+_MEASURE_HANDLERS.register(meter.TimeSignature, _time_signature_to_lily)
+_MEASURE_HANDLERS.register(key.KeySignature, _key_signature_to_lily)
+_MEASURE_HANDLERS.register(bar.Barline, _barline_in_measure_to_lily)
+_MEASURE_HANDLERS.register(expressions.TextExpression, _text_expression_to_lily)
+# I don't know what to do with these undocumented features.
+# NB: They now have documentation, so I could check up on this...
+_MEASURE_HANDLERS.register(layout.SystemLayout, _ignore)
+_MEASURE_HANDLERS.register(layout.PageLayout, _ignore)
+_MEASURE_HANDLERS.register(layout.StaffLayout, _ignore)  # as in the Lassus duos
+# **kern importer garbage... well, it's only garbage to us
+# http://mit.edu/music21/doc/html/moduleHumdrumSpineParser.html
+# The SpineComment objects contain at least part names, and maybe also other interesting metadata
+_MEASURE_HANDLERS.register(humdrum.spineParser.MiscTandem, _ignore)
+_MEASURE_HANDLERS.register(humdrum.spineParser.SpineComment, _ignore)
+
+"""
+The functions given to :func:`register_element`, keyed on the class they convert.
+"""
+ELEMENT_CONVERTERS = registry.TypeRegistry()
+
+
+def register_element(cls, to_lily):
+    """
+    Output objects of class ``cls`` (and its subclasses) that are found in a :class:`Measure`, such
+    as :class:`music21.dynamics.Dynamic`. The string returned by ``to_lily`` is put in the output
+    where the object is in the :class:`Measure`, so a dynamic follows the note before it:
+
+    >>> register_element(dynamics.Dynamic, lambda dyn: u'\\\\' + dyn.value + u' ')
+
+    This works both for :func:`measure_to_lily` and for the multiprocessing converter, which calls
+    ``to_lily`` before the work is sent to another process.
+
+    :param cls: The class to output.
+    :type cls: type
+    :param to_lily: A function that is called with an object of class ``cls``, and returns the
+        LilyPond string for it, or ``None`` to output nothing.
+    :type to_lily: callable
+    """
+    def handler(obj, state):
+        "Call ``to_lily`` for an object in :func:`measure_to_lily`."
+        lily = to_lily(obj)
+        if lily:
+            state.post.append(lily)
+    ELEMENT_CONVERTERS.register(cls, to_lily)
+    _MEASURE_HANDLERS.register(cls, handler)
+
+
+def measure_to_lily(meas, incomplete=False, bar_ql=None):
     """
     Convert a :class:`Measure` into the LilyPond string.
 
@@ -335,6 +716,9 @@ def measure_to_lily(meas, incomplete=False):
     :param incomplete: Whether to check whether the :class:`Measure` is (durationally) incomplete.
         The default is ``False``.
     :type incomplete: boolean
+    :param bar_ql: The quarterLength of a full :class:`Measure`, as found by :func:`iterate_part`.
+        The default, ``None``, asks :attr:`Measure.barDuration` if it's needed.
+    :type bar_ql: float
 
     :returns: The LilyPond-format notation for this measure.
     :rtype: unicode string
@@ -344,23 +728,27 @@ def measure_to_lily(meas, incomplete=False):
     Attach this attribute to the :class:`Measure` itself:
 
     * ``lily_invisible`` (boolean): Make the :class:`Measure` and its contents invisible.
-    """
 
-    post = [u"\t"]
-    barcheck_included = False
+    Every object in the :class:`Measure` is converted by its handler. To output other objects, use
+    :func:`register_element`.
+    """
 
     # Hold whether this Measure is supposed to be "invisible"
     invisible = False
     if hasattr(meas, 'lily_invisible'):
         invisible = meas.lily_invisible
 
+    state = MeasureState(meas, invisible, bar_ql)
+    post = state.post
+    post.append(u"\t")
+
     # Add the first requirement of invisibility
     if invisible:
         post.append(u'\\stopStaff\n\t')
 
     # first check if it's a partial (pick-up) measure
     if incomplete:
-        bar_dur = meas.barDuration.quarterLength
+        bar_dur = state.bar_quarter_length()
         my_dur = meas.duration.quarterLength
         if round(my_dur, 2) < bar_dur:
             if meas.duration.components is not None:
@@ -369,139 +757,18 @@ def measure_to_lily(meas, incomplete=False):
             else:
                 post.extend([u"\\partial ", duration_to_lily(meas.duration), u"\n\t"])
 
-    # Make meas an iterable, so we can pull in multiple elements when we need to deal
-    # with tuplets.
-    bar_iter = iter(meas)
-    # This holds \markup{} blocks that happened before a Note/Rest, and should be appended
-    # to the next Note/Rest that happens.
-    attach_this_markup = u''
     # And fill in all the stuff
-    for obj in bar_iter:
-        # Note or Rest
-        if isinstance(obj, note.Note) or isinstance(obj, note.Rest):
-            # TODO: is there a situation where I'll ever need to deal with
-            # multiple-component durations for a single Note/Rest?
-            # ANSWER: yes, sometimes
-
-            # Is it a full-measure rest?
-            if isinstance(obj, note.Rest) and \
-            bar_iter.srcStream.barDuration.quarterLength == obj.quarterLength:
-                if invisible:
-                    post.extend(['s', duration_to_lily(obj.duration), u' '])
-                else:
-                    post.extend([u'R', duration_to_lily(obj.duration), u' '])
-            # Is it the start of a tuplet?
-            elif obj.duration.tuplets:
-                number_of_tuplet_components = obj.duration.tuplets[0].numberNotesActual
-                in_the_space_of = obj.duration.tuplets[0].numberNotesNormal
-                post.extend([u'\\times ', text(in_the_space_of), u'/',
-                    text(number_of_tuplet_components), u' { ',
-                    note_to_lily(obj, True), u" "])
-                # For every tuplet component...
-                for _ in repeat(None, number_of_tuplet_components - 1):
-                    post.extend([note_to_lily(next(bar_iter), True), u' '])
-                post.append(u'} ')
-            # It's just a regular note or rest
-            else:
-                post.extend([note_to_lily(obj), u' '])
-
-            # Is there a \markup{} block to append?
-            if attach_this_markup != '':
-                post.append(attach_this_markup)
-                attach_this_markup = ''
-        # Chord
-        elif isinstance(obj, chord.Chord):
-            post.extend([note_to_lily(obj), u' '])
-        # Clef
-        elif isinstance(obj, clef.Clef):
-            post.extend([clef_to_lily(obj, append=u'\n\t', invisible=invisible)])
-        # Time Signature
-        elif isinstance(obj, meter.TimeSignature):
-            if invisible:
-                post.append(u"\\once \\override Staff.TimeSignature #'transparent = ##t\n\t")
-            post.extend([u"\\time ",
-                text(obj.beatCount), "/",
-                text(obj.denominator), u"\n\t"])
-        # Key Signature
-        elif isinstance(obj, key.KeySignature):
-            pitch_and_mode = obj.pitchAndMode
-            if invisible:
-                post.append(u"\\once \\override Staff.KeySignature #'transparent = ##t\n\t")
-            if 2 == len(pitch_and_mode) and pitch_and_mode[1] is not None:
-                post.extend([u"\\key ",
-                             pitch_to_lily(pitch_and_mode[0], include_octave=False),
-                             u" \\" + pitch_and_mode[1] + "\n\t"])
-            else:
-                # We'll have to assume it's \major, because music21 does that.
-                post.extend([u"\\key ",
-                             pitch_to_lily(pitch_and_mode[0], include_octave=False),
-                             u" \\major\n\t"])
-        # Barline
-        elif isinstance(obj, bar.Barline):
-            # We don't need to write down a regular barline, but either way, we definitely
-            # should include a bar-check symbol
-            barcheck_included = True
-            if 'regular' != obj.style:
-                post.extend([u'|\n', u'\t', barline_to_lily(obj), u'\n'])
-            else:
-                post.append(u'|\n')
-        # PageLayout and SystemLayout
-        elif isinstance(obj, layout.SystemLayout) or isinstance(obj, layout.PageLayout):
-            # I don't know what to do with these undocumented features.
-            # NB: They now have documentation, so I could check up on this...
-            pass
-        # **kern importer garbage... well, it's only garbage to us
-        elif isinstance(obj, humdrum.spineParser.MiscTandem):
-            # http://mit.edu/music21/doc/html/moduleHumdrumSpineParser.html
-            # Is there really nothing we can use this for? Seems like these
-            # exist only to help music21 developers.
-            pass
-        elif isinstance(obj, humdrum.spineParser.SpineComment):
-            # http://mit.edu/music21/doc/html/moduleHumdrumSpineParser.html
-            # These contain at least part names, and maybe also other interesting metadata(?)
-            pass
-        # Written expression marks (like "con fuoco" or something)
-        elif isinstance(obj, expressions.TextExpression):
-            the_marker = None  # store the local thing
-            if obj.positionVertical > 0:  # above staff
-                the_marker = [u"^\\markup{ "]
-            elif obj.positionVertical < 0:  # below staff
-                the_marker = [u"_\\markup{ "]
-            else:  # LilyPond can decide above or below
-                the_marker = [u"-\\markup{ "]
-            if obj.enclosure is not None:  # put a shape around the text?
-                pass  # TODO
-            the_marker.extend([u'"', obj.content, u'" }'])
-            if obj.enclosure is not None:  # must close the enclosure, if necessary
-                the_marker.append(u'}')
-            the_marker.append(u' ')
-
-            # Find out whether there's a previous Note or Rest to attach to
-            previous_element = meas.getElementBeforeOffset(obj.offset)
-            if not isinstance(previous_element, note.Note) and \
-            not isinstance(previous_element, note.Rest):
-                # this variable holds text to append to the next Note/Rest
-                attach_this_markup = u''.join([attach_this_markup, the_marker])
-            else:  # There was a previous Note/Rest, so we're good
-                post.append(u''.join(the_marker))
-            del the_marker
-        elif isinstance(obj, layout.StaffLayout):  # as in the Lassus duos
-            # TODO: something more useful
-            pass
-        # We don't know what it is, and should probably figure out!
-        else:
-            pass
-            #msg = u'Unknown object in m.%s of type %s.' % (meas.number, type(obj))
-            #print(msg)  # DEBUG
-            #raise UnidentifiedObjectError(msg)
+    lookup = _MEASURE_HANDLERS.lookup
+    for obj in state.elements:
+        lookup(type(obj))(obj, state)
 
     # Append a bar-check symbol, if relevant
-    if len(post) > 1 and not barcheck_included:
+    if len(post) > 1 and not state.barcheck_included:
         post.append(u"|\n")
 
     # Append a note if we couldn't include a \markup{} block
-    if attach_this_markup != '':
-        post.extend(u'% Could not include this markup: ', attach_this_markup)
+    if state.attach_this_markup != '':
+        post.extend([u'% Could not include this markup: ', state.attach_this_markup])
 
     # The final requirement of invisibility
     if invisible:
@@ -580,7 +847,95 @@ def metadata_to_lily(metad, setts=None):
     return u''.join(post)
 
 
-def part_to_lily(part, setts):
+def new_part_name(context, remember=True):
+    """
+    Choose a name for a new part in the score, and remember it in the conversion context.
+
+    The parts are named in the order this function is called (refer to
+    :func:`part_name_for_number`), so the same score always gets the same part names.
+
+    :param context: The context of this score's conversion.
+    :type context: :class:`~outputlilypond.context.ConversionContext`
+    :param remember: Whether to add the name to the context's list of parts. The default is
+        ``True``; use ``False`` if the caller puts the name in the list itself.
+    :type remember: boolean
+
+    :returns: An 8-letter name that is not already used by a part in this score.
+    :rtype: unicode string
+    """
+    # We used to use some of the part's .bestName, but many scores (like
+    # for **kern) don't have this. Every name we choose is in "part_names," so its size is the
+    # number of the next part.
+    call_this_part = part_name_for_number(len(context.part_names))
+    context.part_names.add(call_this_part)
+    if remember:
+        context.parts_in_this_score.append(call_this_part)
+    return call_this_part
+
+
+def iterate_part(part):
+    """
+    Yield the elements of a :class:`Part`, each with the quarterLength of a full :class:`Measure`
+    at that point in the :class:`Part`.
+
+    Asking every :class:`Measure` for its :attr:`~Measure.barDuration` means a context search for
+    the :class:`TimeSignature` of every :class:`Measure` without one of its own, which takes longer
+    the longer the :class:`Part` is. Instead, we remember the active :class:`TimeSignature` as we
+    go, and compute the bar's quarterLength again only when the :class:`TimeSignature` changes.
+
+    :param part: The :class:`Part` to iterate.
+    :type part: :class:`music21.stream.Part`
+
+    :returns: An iterator of 2-tuples with an element and the quarterLength of a full
+        :class:`Measure`. The quarterLength is ``None`` before the first :class:`TimeSignature`,
+        where :attr:`Measure.barDuration` must guess from the contents of the :class:`Measure`.
+    :rtype: iterator of tuple
+    """
+    active = None  # the TimeSignature at the end of the previous Measure
+    bar_ts = None  # the TimeSignature that "bar_ql" came from
+    bar_ql = None
+    for thing in part:
+        if isinstance(thing, stream.Measure):
+            # like Measure.barDuration, a TimeSignature in the Measure wins over the context
+            # (getElementsByClass() would build a new Stream for every Measure)
+            own = [x for x in thing.elements if isinstance(x, meter.TimeSignature)]
+            if len(own) > 0:
+                this_ts = own[0]
+                active = own[-1]
+            else:
+                this_ts = active
+        else:
+            if isinstance(thing, meter.TimeSignature):
+                active = thing
+            this_ts = active
+        if this_ts is not bar_ts:
+            bar_ts = this_ts
+            bar_ql = None if this_ts is None else this_ts.barDuration.quarterLength
+        yield thing, bar_ql
+
+
+def _measure_in_part_to_lily(meas, bar_ql):
+    "Handle a :class:`Measure` in :func:`part_to_lily`."
+    return measure_to_lily(meas, 0 == meas.number, bar_ql)
+
+
+def _note_in_part_to_lily(the_note, bar_ql):
+    "Handle a :class:`Note` or :class:`Rest` directly in a :class:`Part`, in :func:`part_to_lily`."
+    return note_to_lily(the_note) + u' '
+
+
+"""
+The handlers used by :func:`part_to_lily`, keyed on the class of the object in the :class:`Part`.
+Every handler is called with the object and the quarterLength of a full :class:`Measure` (from
+:func:`iterate_part`), and returns the LilyPond string for it.
+"""
+_PART_HANDLERS = registry.TypeRegistry(default=lambda thing, bar_ql: u'')
+_PART_HANDLERS.register(stream.Measure, _measure_in_part_to_lily)
+_PART_HANDLERS.register(note.Note, _note_in_part_to_lily)
+_PART_HANDLERS.register(note.Rest, _note_in_part_to_lily)
+
+
+def part_to_lily(part, setts, context=None):
     """
     Convert a :class:`Part` object into the LilyPond string.
 
@@ -588,6 +943,9 @@ def part_to_lily(part, setts):
     :type part: :class:`music21.stream.Part`
     :param setts: A settings object.
     :type setts: :class:`settings.LilyPondSettings`
+    :param context: The context of this score's conversion, where we remember the part's name.
+        The default is a new context for this part only.
+    :type context: :class:`~outputlilypond.context.ConversionContext`
 
     :returns: The LilyPond-format notation for this part.
     :rtype: unicode string
@@ -596,13 +954,16 @@ def part_to_lily(part, setts):
 
     ``lily_instruction`` on the :class:`Part`
     """
+    the_stats = setts.stats
+    if the_stats is not None:
+        start = time.time()
+        the_stats.count_elements(part)
+
+    if context is None:
+        context = ConversionContext()
+
     # Start the Part
-    # We used to use some of the part's .bestName, but many scores (like
-    # for **kern) don't have this.
-    call_this_part = string_of_n_letters(8)
-    while call_this_part in setts._parts_in_this_score:
-        call_this_part = string_of_n_letters(8)
-    setts._parts_in_this_score.append(call_this_part)
+    call_this_part = new_part_name(context)
     post = [call_this_part, u" =\n{\n"]
 
     # If this part has the "lily_instruction" property set, this goes here
@@ -622,7 +983,7 @@ def part_to_lily(part, setts):
                      instr_name[:3],
                      u'." }\n'])
     elif hasattr(part, 'lily_analysis_voice') and part.lily_analysis_voice is True:
-        setts._analysis_notation_parts.append(call_this_part)
+        context.analysis_notation_parts.append(call_this_part)
         post.extend([u'\t%% vis annotated analysis\n', analysis_part_to_lily(part)])
     # Custom settings for bar numbers
     if setts.get_property('bar numbers') is not None:
@@ -635,44 +996,23 @@ def part_to_lily(part, setts):
         pass
     # Otherwise, it's hopefully just a regular, everyday Part.
     else:
-        # What's in the Part?
-        # TODO: break this into a separate method, process_part()
-        # TODO: make this less stupid
-        for thing in part:
-            # Probably measures.
-            if isinstance(thing, stream.Measure):
-                if 0 == thing.number:
-                    post.append(measure_to_lily(thing, True))
-                else:
-                    post.append(measure_to_lily(thing))
-            elif isinstance(thing, instrument.Instrument):
-                # We can safely ignore this (for now?) because we already dealt
-                # with the part name earlier.
-                pass
-            elif isinstance(thing, tempo.MetronomeMark):
-                # TODO: at some point, we'll have to deal with this nicely
-                pass
-            elif isinstance(thing, meter.TimeSignature):
-                pass
-            elif isinstance(thing, note.Note) or isinstance(thing, note.Rest):
-                post.extend([note_to_lily(thing), u' '])
-            # **kern importer garbage... well, it's only garbage to us
-            elif isinstance(thing, humdrum.spineParser.MiscTandem):
-                # http://mit.edu/music21/doc/html/moduleHumdrumSpineParser.html
-                # Is there really nothing we can use this for? Seems like these
-                # exist only to help music21 developers.
-                pass
-            else:
-                pass
-                #msg = u'Unknown object in Stream; type is %s.' % type(thing)
-                #print(msg)  # DEBUG
-                #raise UnidentifiedObjectError(msg + text(thing))
+        # What's in the Part? Probably measures. Everything without a handler (like Instrument,
+        # which we already used for the part name) is ignored.
+        lookup = _PART_HANDLERS.lookup
+        for thing, bar_ql in iterate_part(part):
+            post.append(lookup(type(thing))(thing, bar_ql))
     # finally, to close the part, join, and return!
     post.append(u"}\n")
-    return u''.join(post)
+    post = u''.join(post)
+
+    if the_stats is not None:
+        seconds = time.time() - start
+        the_stats.add_time('convert', seconds)
+        the_stats.add_part_time(call_this_part, seconds)
+    return post
 
 
-def stream_to_lily(the_stream, setts, the_index=None):
+def stream_to_lily(the_stream, setts, the_index=None, context=None):
     """
     Convert a :class:`Stream` object into the LilyPond string.
 
@@ -683,6 +1023,8 @@ def stream_to_lily(the_stream, setts, the_index=None):
     :type setts: :class:`settings.LilyPondSettings`
     :param the_index: If this value is not ``None`` (the default), it is used in the return value.
         This is for use with multiprocessing. Refer to "Return Values" below.
+    :param context: The context of this score's conversion. Refer to :func:`part_to_lily`.
+    :type context: :class:`~outputlilypond.context.ConversionContext`
 
     :returns: The LilyPond string, either by itself or in a 2- or 3-tuple. Refer to "Return Values"
         below.
@@ -713,7 +1055,8 @@ def stream_to_lily(the_stream, setts, the_index=None):
     * If ``index`` is not ``None`` but ``the_stream`` is not a :class:`Part`, a 2-tuple with the
         value of ``index`` and the unicode string.
     """
-    if isinstance(the_stream, str):
+    if isinstance(the_stream, (str, bytes)):
+        # music21's freezeStr() returns bytes on Python 3
         the_stream = converter.thawStr(the_stream)
 
     obj_type = type(the_stream)
@@ -723,7 +1066,7 @@ def stream_to_lily(the_stream, setts, the_index=None):
     #if obj_type == stream.Score:
         #post = ScoreMaker(the_stream, setts).get_lilypond()
     if obj_type == stream.Part or obj_type == stream.PartStaff:
-        post = part_to_lily(the_stream, setts)
+        post = part_to_lily(the_stream, setts, context)
         part_name = post[:8]
     elif obj_type == metadata.Metadata:
         post = metadata_to_lily(the_stream, setts)
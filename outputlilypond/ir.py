@@ -0,0 +1,677 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: ir.py
+# Purpose: Compact intermediate representation of music21 Parts for multiprocessing.
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+"""
+Compact intermediate representation ("IR") of a :class:`~music21.stream.Part`.
+
+Sending a :class:`Part` to a worker process with :func:`music21.converter.freezeStr` pickles the
+whole :mod:`music21` object graph, and :func:`~music21.converter.thawStr` rebuilds it on the other
+side. This often takes longer than the conversion itself. Instead, :func:`extract_part` reads
+everything the converter needs from the :class:`Part` in a single pass, and stores it in nested
+tuples of strings and numbers, which are cheap to pickle. Then :func:`part_ir_to_lily` produces the
+same LilyPond string as :func:`functions.part_to_lily` without using :mod:`music21` at all.
+
+The IR is made of these records, where the first member is always a "kind" constant:
+
+* part: ``PartIR(PART, lily_instruction, instrument_name, is_analysis, items)`` where ``items``
+  holds measure and note events, or only note events for an analysis part.
+* measure: ``MeasureIR(MEASURE, invisible, partial, bar_ql, events)`` where ``partial`` holds the
+  components of the ``\\partial`` duration (or ``None``) and ``bar_ql`` is the quarterLength of a
+  full measure (or ``None`` if nothing needs it).
+* note or rest: ``NoteIR(NOTE, is_rest, head, components, tuplet, tie_start, markup, ql)``
+* chord: ``ChordIR(CHORD, head, components, tie_start, markup)``
+* clef: ``ClefIR(CLEF, clef_string)``
+* time signature: ``TimeIR(TIME, beat_count, denominator)``
+* key signature: ``KeyIR(KEY, tonic_name, mode)``
+* barline: ``BarlineIR(BARLINE, style)``
+* text expression: ``MarkupIR(MARKUP, position, has_enclosure, content, follows_note)``
+* anything given to :func:`functions.register_element`: ``LilyIR(LILY, lilypond_string)``
+
+The records are named tuples, so they take no more memory than tuples (they have no
+``__dict__``), they pickle and hash like tuples, and the converters may unpack them like tuples.
+
+A ``head`` is ``u's'`` for an invisible object, ``u'r'`` for a rest, a ``(name, octave)`` pitch for
+a note, or a tuple of pitches for a chord. Duration ``components`` are tuples of
+``(quarterLength, dots, tuplet_type)``, where ``tuplet_type`` is the written note type (like
+``'eighth'``) for tuplet members, and ``None`` otherwise.
+"""
+
+from collections import namedtuple
+from itertools import repeat
+from music21 import chord, clef, duration, key, meter, note, bar, expressions, stream
+from outputlilypond import functions, problems, registry
+from outputlilypond.context import ConversionContext
+# For python 2 and 3 compatibility:
+import sys
+if sys.version_info[0] > 2:
+    text = str
+else:
+    text = unicode
+
+# Kinds of IR tuples; the first member of every tuple is one of these.
+PART = 0
+MEASURE = 1
+NOTE = 2
+CHORD = 3
+CLEF = 4
+TIME = 5
+KEY = 6
+BARLINE = 7
+MARKUP = 8
+LILY = 9
+
+"""
+The kinds of IR records. Their members are described above.
+"""
+PartIR = namedtuple('PartIR', 'kind lily_instruction instrument_name is_analysis items')
+MeasureIR = namedtuple('MeasureIR', 'kind invisible partial bar_ql events')
+NoteIR = namedtuple('NoteIR', 'kind is_rest head components tuplet tie_start markup ql')
+ChordIR = namedtuple('ChordIR', 'kind head components tie_start markup')
+ClefIR = namedtuple('ClefIR', 'kind clef_string')
+TimeIR = namedtuple('TimeIR', 'kind beat_count denominator')
+KeyIR = namedtuple('KeyIR', 'kind tonic_name mode')
+BarlineIR = namedtuple('BarlineIR', 'kind style')
+MarkupIR = namedtuple('MarkupIR', 'kind position has_enclosure content follows_note')
+LilyIR = namedtuple('LilyIR', 'kind lilypond_string')
+
+"""
+Most notes in a score have the same few pitches and durations, so every head and every tuple of
+duration components is stored once, and shared by all the events that have it. This makes the IR
+of a note several times smaller. Pitches and durations are few enough that we never forget one.
+"""
+_SHARED = {}
+
+
+def _extract_pitch(the_pitch):
+    "Return the ``(name, octave)`` of a :class:`Pitch`."
+    octave = the_pitch.octave
+    if octave is None:
+        octave = the_pitch.implicitOctave
+    pitch = (the_pitch.name, octave)
+    return _SHARED.setdefault(pitch, pitch)
+
+
+def _extract_duration(dur):
+    "Return the tuple of components of a :class:`Duration`."
+    try:
+        if dur.isComplex:
+            components = tuple((comp.quarterLength, comp.dots, None) for comp in dur.components)
+        else:
+            tuplet_type = dur.type if dur.tuplets else None
+            components = ((dur.quarterLength, dur.dots, tuplet_type),)
+        return _SHARED.setdefault(components, components)
+    except duration.DurationException:
+        raise problems.ImpossibleToProcessError('music21 cannot process this duration')
+
+
+def _extract_note(the_note, invisible=False):
+    """
+    Return the NOTE or CHORD tuple for a :class:`Note`, :class:`Rest`, or :class:`Chord`.
+
+    If ``invisible`` is ``True``, the object is output as a spacer, whatever its
+    ``lily_invisible`` attribute says.
+    """
+    if hasattr(the_note, 'lily_invisible') and the_note.lily_invisible is True:
+        invisible = True
+    tie = the_note.tie
+    tie_start = tie is not None and u'start' == tie.type
+    markup = text(the_note.lily_markup) if hasattr(the_note, 'lily_markup') else None
+    # most of music21's properties are computed, so we ask for every one only once
+    dur = the_note.duration
+    components = _extract_duration(dur)
+
+    if isinstance(the_note, chord.Chord):
+        if invisible:
+            head = u's'
+        else:
+            head = tuple(_extract_pitch(each_pitch) for each_pitch in the_note.pitches)
+            head = _SHARED.setdefault(head, head)
+        return ChordIR(CHORD, head, components, tie_start, markup)
+
+    is_rest = isinstance(the_note, note.Rest)
+    if invisible:
+        head = u's'
+    elif the_note.isRest:
+        head = u'r'
+    else:
+        head = _extract_pitch(the_note.pitch)
+    tuplets = dur.tuplets
+    if tuplets:
+        tuplet = (tuplets[0].numberNotesActual, tuplets[0].numberNotesNormal)
+    else:
+        tuplet = None
+    # the quarterLength of a simple duration is in the (shared) components already
+    ql = components[0][0] if 1 == len(components) else dur.quarterLength
+    return NoteIR(NOTE, is_rest, head, components, tuplet, tie_start, markup, ql)
+
+
+def _extract_text_expression(obj, meas):
+    """
+    Return the MARKUP tuple for a :class:`TextExpression` in a :class:`Measure`. Whether it follows
+    a Note or Rest is filled in by :func:`extract_measure`.
+    """
+    return MarkupIR(MARKUP, obj.positionVertical, obj.enclosure is not None, obj.content, None)
+
+
+def _extract_clef(obj, meas):
+    "Return the CLEF tuple for a :class:`Clef`."
+    try:
+        return ClefIR(CLEF, functions.CLEF_DICT[type(obj)])
+    except KeyError:
+        raise problems.UnidentifiedObjectError('Clef type not recognized: ' + text(obj))
+
+
+def _extract_key_signature(obj, meas):
+    "Return the KEY tuple for a :class:`KeySignature`."
+    pitch_and_mode = obj.pitchAndMode
+    if 2 == len(pitch_and_mode) and pitch_and_mode[1] is not None:
+        return KeyIR(KEY, pitch_and_mode[0].name, pitch_and_mode[1])
+    else:
+        # We'll have to assume it's \major, because music21 does that.
+        return KeyIR(KEY, pitch_and_mode[0].name, u'major')
+
+
+def _extract_registered(obj, meas):
+    "Return the LILY tuple for an object given to :func:`functions.register_element`, if any."
+    to_lily = functions.ELEMENT_CONVERTERS.lookup(type(obj))
+    if to_lily is not None:
+        # extract_measure() doesn't use the Measure's iterator, which would have done this
+        obj.activeSite = meas
+        lily = to_lily(obj)
+        if lily:
+            return LilyIR(LILY, lily)
+
+
+"""
+The functions used by :func:`extract_measure`, keyed on the class of the object in the
+:class:`Measure`. Every function is called with the object and the :class:`Measure`, and returns
+an IR tuple or ``None``. Objects without a function of their own are output only if they were
+given to :func:`functions.register_element`, like in :func:`functions.measure_to_lily`.
+"""
+_MEASURE_EXTRACTORS = registry.TypeRegistry(default=_extract_registered)
+_MEASURE_EXTRACTORS.register(note.Note, lambda obj, meas: _extract_note(obj))
+_MEASURE_EXTRACTORS.register(note.Rest, lambda obj, meas: _extract_note(obj))
+_MEASURE_EXTRACTORS.register(chord.Chord, lambda obj, meas: _extract_note(obj))
+_MEASURE_EXTRACTORS.register(clef.Clef, _extract_clef)
+_MEASURE_EXTRACTORS.register(meter.TimeSignature,
+                             lambda obj, meas: TimeIR(TIME, obj.beatCount, obj.denominator))
+_MEASURE_EXTRACTORS.register(key.KeySignature, _extract_key_signature)
+_MEASURE_EXTRACTORS.register(bar.Barline, lambda obj, meas: BarlineIR(BARLINE, obj.style))
+_MEASURE_EXTRACTORS.register(expressions.TextExpression, _extract_text_expression)
+
+
+def extract_measure(meas, incomplete=False, bar_ql=None):
+    """
+    Extract the IR of a :class:`Measure`.
+
+    :param meas: The :class:`Measure` to extract.
+    :type meas: :class:`music21.stream.Measure`
+    :param incomplete: Whether to check whether the :class:`Measure` is (durationally) incomplete.
+        The default is ``False``.
+    :type incomplete: boolean
+    :param bar_ql: The quarterLength of a full :class:`Measure`, as found by
+        :func:`functions.iterate_part`. The default, ``None``, asks :attr:`Measure.barDuration` if
+        it's needed.
+    :type bar_ql: float
+
+    :returns: The MEASURE tuple.
+    :rtype: tuple
+    """
+    invisible = meas.lily_invisible if hasattr(meas, 'lily_invisible') else False
+
+    # we only put "bar_ql" in the IR if it's used, so the IR is the same however we found it
+    known_bar_ql = bar_ql
+    bar_ql = None
+    partial = None
+    if incomplete:
+        bar_ql = meas.barDuration.quarterLength if known_bar_ql is None else known_bar_ql
+        my_dur = meas.duration.quarterLength
+        if round(my_dur, 2) < bar_ql:
+            partial = _extract_duration(duration.Duration(round(my_dur, 2)))
+
+    events = []
+    lookup = _MEASURE_EXTRACTORS.lookup
+    # Whether the last element at an earlier offset is a Note or Rest, for the \markup{} blocks.
+    # This is what Measure.getElementBeforeOffset() would find, without searching again.
+    group_offset = None
+    previous_element = None
+    follows_note = False
+    # The Measure's iterator costs more for every element than extracting a simple note does, so
+    # we read its elements all at once, in the same order.
+    element_offset = meas.elementOffset
+    for obj in meas.elements:
+        offset = element_offset(obj)
+        if offset != group_offset:
+            follows_note = isinstance(previous_element, (note.Note, note.Rest))
+            group_offset = offset
+        previous_element = obj
+
+        event = lookup(type(obj))(obj, meas)
+        if event is None:
+            # everything else is ignored by measure_to_lily() too
+            continue
+        kind = event.kind
+        if bar_ql is None and NOTE == kind and event.is_rest:
+            # we only need this for full-measure rests, and it may need a context search
+            bar_ql = meas.barDuration.quarterLength if known_bar_ql is None else known_bar_ql
+        elif MARKUP == kind:
+            event = event._replace(follows_note=follows_note)
+        events.append(event)
+
+    return MeasureIR(MEASURE, invisible, partial, bar_ql, events)
+
+
+"""
+The functions used by :func:`extract_part` for the contents of a :class:`Part` that isn't an
+analysis part, like :func:`functions.part_to_lily`. Every function is called with the object and
+the quarterLength of a full :class:`Measure` (from :func:`functions.iterate_part`).
+"""
+_PART_EXTRACTORS = registry.TypeRegistry(default=lambda thing, bar_ql: None)
+_PART_EXTRACTORS.register(stream.Measure,
+                          lambda meas, bar_ql: extract_measure(meas, 0 == meas.number, bar_ql))
+_PART_EXTRACTORS.register(note.Note, lambda the_note, bar_ql: _extract_note(the_note))
+_PART_EXTRACTORS.register(note.Rest, lambda the_note, bar_ql: _extract_note(the_note))
+
+
+def extract_part_item(thing, bar_ql=None):
+    """
+    Extract the IR of one element in a :class:`Part` that isn't an analysis part.
+
+    :param thing: The element to extract.
+    :type thing: :class:`music21.base.Music21Object`
+    :param bar_ql: The quarterLength of a full :class:`Measure`, as found by
+        :func:`functions.iterate_part`.
+    :type bar_ql: float
+
+    :returns: The MEASURE or NOTE tuple, or ``None`` if the element isn't output.
+    :rtype: tuple
+    """
+    return _PART_EXTRACTORS.lookup(type(thing))(thing, bar_ql)
+
+
+def extract_part_header(part):
+    """
+    Extract the IR of a :class:`Part` without its contents.
+
+    :param part: The :class:`Part` to extract.
+    :type part: :class:`music21.stream.Part`
+
+    :returns: The PART record, with ``None`` for its ``items``.
+    :rtype: :class:`PartIR`
+    """
+    lily_instruction = part.lily_instruction if hasattr(part, 'lily_instruction') else None
+    instr_name = part.getInstrument().partName
+    is_analysis = hasattr(part, 'lily_analysis_voice') and part.lily_analysis_voice is True
+    return PartIR(PART, lily_instruction, instr_name, is_analysis, None)
+
+
+def extract_analysis_part(part):
+    """
+    Extract the contents of an analysis part, where every note, rest, and chord is output as a
+    spacer. Everything else is ignored.
+
+    :param part: The :class:`Part` to extract.
+    :type part: :class:`music21.stream.Part`
+
+    :returns: The NOTE and CHORD tuples.
+    :rtype: list of tuple
+    """
+    return [_extract_note(obj, invisible=True) for obj in part
+            if isinstance(obj, (note.Note, note.Rest, chord.Chord))]
+
+
+def is_analysis_voice(part_ir):
+    """
+    Whether a PART record is output as an analysis part. Like :func:`functions.part_to_lily`, a
+    part with ``lily_analysis_voice`` and an instrument name is output with its name only, not as
+    an analysis part.
+
+    :param part_ir: The PART record.
+    :type part_ir: :class:`PartIR`
+
+    :returns: Whether the part is output as an analysis part.
+    :rtype: bool
+    """
+    return part_ir.is_analysis and not part_ir.instrument_name
+
+
+def extract_part(part):
+    """
+    Extract the IR of a :class:`Part`. The result holds only strings, numbers, booleans, and
+    ``None``, so it is cheap to send to another process.
+
+    :param part: The :class:`Part` to extract.
+    :type part: :class:`music21.stream.Part`
+
+    :returns: The PART record.
+    :rtype: :class:`PartIR`
+    """
+    header = extract_part_header(part)
+
+    # the contents of an analysis part with an instrument name aren't output
+    items = []
+    if is_analysis_voice(header):
+        items = extract_analysis_part(part)
+    elif not header.is_analysis:
+        lookup = _PART_EXTRACTORS.lookup
+        for thing, bar_ql in functions.iterate_part(part):
+            item = lookup(type(thing))(thing, bar_ql)
+            if item is not None:
+                items.append(item)
+
+    return header._replace(items=items)
+
+
+def _component_to_lily(component, known_tuplet):
+    "Convert one duration component into the LilyPond string, like :func:`duration_to_lily`."
+    dur_ql, dots, tuplet_type = component
+    if 0.0 == dur_ql:
+        msg = u'_duration_to_lily(): Cannot process quarterLength of 0.0'
+        raise problems.ImpossibleToProcessError(msg)
+    if tuplet_type is not None:
+        if known_tuplet:
+            # the written duration of the tuplet component, as in duration_to_lily()
+            return functions.note_type_to_lily(tuplet_type, dots)
+        else:
+            msg = 'duration_to_lily(): Cannot process tuplet components'
+            raise problems.ImpossibleToProcessError(msg)
+    return functions.quarter_length_to_lily(dur_ql)
+
+
+def _duration_to_lily(components, known_tuplet=False):
+    "Convert the components of a single-component duration into the LilyPond string."
+    if len(components) > 1:
+        raise problems.ImpossibleToProcessError('Cannot process durations with multiple components')
+    return _component_to_lily(components[0], known_tuplet)
+
+
+def _head_to_lily(head):
+    "Convert the pitch, rest, or spacer part of a NOTE or CHORD tuple."
+    if isinstance(head, tuple):
+        if isinstance(head[0], tuple):
+            return u''.join([u'<',
+                             u' '.join([functions.pitch_name_to_lily(n, o) for n, o in head]),
+                             u'>'])
+        return functions.pitch_name_to_lily(head[0], head[1])
+    return head
+
+
+def note_ir_to_lily(event, known_tuplet=False):
+    """
+    Convert a NOTE or CHORD tuple into the LilyPond string, like :func:`functions.note_to_lily`.
+
+    :param event: The NOTE or CHORD tuple.
+    :type event: tuple
+    :param known_tuplet: Whether we already know this note is part of a tuplet. (Default is
+        ``False``).
+    :type known_tuplet: boolean
+
+    :returns: The LilyPond-format notation for this note.
+    :rtype: unicode string
+    """
+    head, components = event.head, event.components
+    tie_start, markup = event.tie_start, event.markup
+    if NOTE == event.kind:
+        if 1 == len(components) and components[0][2] is None:
+            # Most notes have one pitch (or are rests) and one duration, so we look them up in the
+            # tables directly. Anything not in the tables takes the long way, which says why.
+            lily_head = functions.PITCH_DICT.get(head) if isinstance(head, tuple) else head
+            lily_dur = functions.DOTTED_DURATION_DICT.get(components[0][0])
+            if lily_head is not None and lily_dur is not None:
+                post = lily_head + lily_dur
+                if tie_start:
+                    post += u'~'
+                if markup is not None:
+                    post += markup
+                return post
+
+    head = _head_to_lily(head)
+    post = [head]
+    if len(components) > 1:
+        # We have a multiple-part duration
+        post.extend([_component_to_lily(components[0], known_tuplet), u'~ '])
+        for component in components[1:]:
+            post.extend([head, _component_to_lily(component, known_tuplet), u'~ '])
+        post = post[:-1]  # remove the final tilde symbol
+    else:
+        post.append(_component_to_lily(components[0], known_tuplet))
+
+    if tie_start:
+        post.append(u'~')
+    if markup is not None:
+        post.append(markup)
+
+    return u''.join(post)
+
+
+def _barline_to_lily(style):
+    "Convert a barline style into the LilyPond string, like :func:`functions.barline_to_lily`."
+    try:
+        return u'\\bar "' + functions.BARLINE_DICT[style] + u'"'
+    except KeyError:
+        raise problems.UnidentifiedObjectError('Barline type not recognized (' + style + ')')
+
+
+def _markup_to_lily(event):
+    "Convert a MARKUP tuple into the LilyPond string."
+    position = event.position
+    if position > 0:  # above staff
+        the_marker = [u"^\\markup{ "]
+    elif position < 0:  # below staff
+        the_marker = [u"_\\markup{ "]
+    else:  # LilyPond can decide above or below
+        the_marker = [u"-\\markup{ "]
+    the_marker.extend([u'"', event.content, u'" }'])
+    if event.has_enclosure:  # must close the enclosure, if necessary
+        the_marker.append(u'}')
+    the_marker.append(u' ')
+    return u''.join(the_marker)
+
+
+def measure_ir_to_lily(meas):
+    """
+    Convert a MEASURE tuple into the LilyPond string, like :func:`functions.measure_to_lily`.
+
+    :param meas: The MEASURE tuple.
+    :type meas: tuple
+
+    :returns: The LilyPond-format notation for this measure.
+    :rtype: unicode string
+    """
+    invisible, partial, bar_ql = meas.invisible, meas.partial, meas.bar_ql
+    post = [u"\t"]
+    barcheck_included = False
+
+    if invisible:
+        post.append(u'\\stopStaff\n\t')
+
+    if partial is not None:
+        post.extend([u"\\partial ", _duration_to_lily(partial), u"\n\t"])
+
+    # This holds \markup{} blocks that happened before a Note/Rest, and should be appended
+    # to the next Note/Rest that happens.
+    attach_this_markup = u''
+    event_iter = iter(meas.events)
+    for event in event_iter:
+        kind = event.kind
+        if NOTE == kind:
+            tuplet = event.tuplet
+            # Is it a full-measure rest?
+            if event.is_rest and bar_ql == event.ql:
+                post.extend([u's' if invisible else u'R', _duration_to_lily(event.components),
+                             u' '])
+            # Is it the start of a tuplet?
+            elif tuplet is not None:
+                number_of_tuplet_components, in_the_space_of = tuplet
+                post.extend([u'\\times ', text(in_the_space_of), u'/',
+                             text(number_of_tuplet_components), u' { ',
+                             note_ir_to_lily(event, True), u' '])
+                # For every tuplet component...
+                for _ in repeat(None, number_of_tuplet_components - 1):
+                    component = next(event_iter, None)
+                    if component is None or component.kind not in (NOTE, CHORD):
+                        raise problems.ImpossibleToProcessError('Incomplete tuplet')
+                    post.extend([note_ir_to_lily(component, True), u' '])
+                post.append(u'} ')
+            # It's just a regular note or rest
+            else:
+                post.extend([note_ir_to_lily(event), u' '])
+
+            # Is there a \markup{} block to append?
+            if attach_this_markup != u'':
+                post.append(attach_this_markup)
+                attach_this_markup = u''
+        elif CHORD == kind:
+            post.extend([note_ir_to_lily(event), u' '])
+        elif CLEF == kind:
+            if invisible:
+                post.append(u"\\once \\override Staff.Clef #'transparent = ##t\n\t")
+            post.extend([event.clef_string, u'\n\t'])
+        elif TIME == kind:
+            if invisible:
+                post.append(u"\\once \\override Staff.TimeSignature #'transparent = ##t\n\t")
+            post.extend([u"\\time ", text(event.beat_count), u"/", text(event.denominator),
+                         u"\n\t"])
+        elif KEY == kind:
+            if invisible:
+                post.append(u"\\once \\override Staff.KeySignature #'transparent = ##t\n\t")
+            post.extend([u"\\key ", functions.pitch_name_to_lily(event.tonic_name),
+                         u" \\", event.mode, u"\n\t"])
+        elif BARLINE == kind:
+            barcheck_included = True
+            if 'regular' != event.style:
+                post.extend([u'|\n', u'\t', _barline_to_lily(event.style), u'\n'])
+            else:
+                post.append(u'|\n')
+        elif MARKUP == kind:
+            if event.follows_note:  # There was a previous Note/Rest, so we're good
+                post.append(_markup_to_lily(event))
+            else:  # append to the next Note/Rest
+                attach_this_markup += _markup_to_lily(event)
+        elif LILY == kind:
+            post.append(event.lilypond_string)
+
+    # Append a bar-check symbol, if relevant
+    if len(post) > 1 and not barcheck_included:
+        post.append(u"|\n")
+
+    # Append a note if we couldn't include a \markup{} block
+    if attach_this_markup != u'':
+        post.extend([u'% Could not include this markup: ', attach_this_markup])
+
+    # The final requirement of invisibility
+    if invisible:
+        post.append(u'\t\\startStaff\n')
+
+    return u''.join(post)
+
+
+def measures_ir_to_lily(items):
+    """
+    Convert a list of MEASURE tuples into the LilyPond string, like the body of
+    :func:`functions.part_to_lily`. The list may also hold NOTE tuples, if there are notes directly
+    in the :class:`Part`.
+
+    Every MEASURE tuple already knows the full length of its measure, so consecutive measures may
+    be converted in different processes, and the results joined in order.
+
+    :param items: The MEASURE and NOTE tuples to convert.
+    :type items: list of tuple
+
+    :returns: The LilyPond-format notation for these measures.
+    :rtype: unicode string
+    """
+    post = []
+    for item in items:
+        if MEASURE == item.kind:
+            post.append(measure_ir_to_lily(item))
+        else:
+            post.extend([note_ir_to_lily(item), u' '])
+    return u''.join(post)
+
+
+def part_ir_to_lily(part, setts, the_index=None, body=None, part_name=None, context=None):
+    """
+    Convert a PART tuple into the LilyPond string, like :func:`functions.part_to_lily`.
+
+    This function is meant to run in a worker process, so the return value is like that of
+    :func:`functions.stream_to_lily`.
+
+    :param part: The PART tuple, from :func:`extract_part`.
+    :type part: tuple
+    :param setts: A settings object.
+    :type setts: :class:`settings.LilyPondSettings`
+    :param the_index: If this value is not ``None`` (the default), it is used in the return value.
+    :param body: The already-converted measures of the part, from :func:`measures_ir_to_lily`. If
+        this is ``None`` (the default), the measures are converted here.
+    :type body: unicode string
+    :param part_name: The name to use for the part. If this is ``None`` (the default), we use
+        :func:`functions.new_part_name`.
+    :type part_name: unicode string
+    :param context: The context of this score's conversion. The default is a new context for this
+        part only.
+    :type context: :class:`~outputlilypond.context.ConversionContext`
+
+    :returns: The LilyPond string by itself or, if ``the_index`` is not ``None``, a 3-tuple with
+        the value of ``the_index``, the LilyPond string, and the part's name.
+    :rtype: unicode string or tuple
+    """
+    lily_instruction, instr_name = part.lily_instruction, part.instrument_name
+    is_analysis, items = part.is_analysis, part.items
+
+    if context is None:
+        context = ConversionContext()
+    call_this_part = functions.new_part_name(context) if part_name is None else part_name
+    post = [call_this_part, u" =\n{\n"]
+
+    if lily_instruction is not None:
+        post.append(lily_instruction)
+
+    if instr_name is not None and len(instr_name) > 0:
+        post.extend([u'\t%% ',
+                     instr_name,
+                     u'\n', u'\t\\set Staff.instrumentName = \\markup{ "',
+                     instr_name,
+                     u'" }\n',
+                     u'\t\\set Staff.shortInstrumentName = \\markup{ "',
+                     instr_name[:3],
+                     u'." }\n'])
+    elif is_analysis:
+        context.analysis_notation_parts.append(call_this_part)
+        post.append(u'\t%% vis annotated analysis\n')
+        for event in items:
+            post.extend([u'\t', note_ir_to_lily(event), u'\n'])
+
+    if setts.get_property('bar numbers') is not None:
+        post.extend([u"\n\t\\override Score.BarNumber #'break-visibility = ",
+                     setts.get_property('bar numbers'),
+                     u'\n'])
+
+    if not is_analysis:
+        post.append(measures_ir_to_lily(items) if body is None else body)
+
+    post.append(u"}\n")
+    post = u''.join(post)
+
+    if the_index is None:
+        return post
+    else:
+        return (the_index, post, call_this_part)
@@ -36,3 +36,19 @@ class ImpossibleToProcessError(Exception):
     When something is identified, but has an invalid type or property, and cannot be processed.
     """
     pass
+
+
+class LilyPondError(Exception):
+    """
+    When LilyPond fails to engrave a file, or takes too long. The :attr:`result` attribute holds
+    the :class:`~outputlilypond.render.RenderResult`, with LilyPond's output.
+    """
+    def __init__(self, result):
+        if result.timed_out:
+            msg = u'LilyPond took too long, and was stopped'
+        elif 0 == result.returncode:
+            msg = u'LilyPond finished without writing a PDF'
+        else:
+            msg = u'LilyPond failed with exit code %s' % result.returncode
+        super(LilyPondError, self).__init__(msg)
+        self.result = result
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: registry.py
+# Purpose: Find the function that converts an object, by the object's class.
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+"""
+Find the function that converts an object, by the object's class.
+
+Rather than asking ``isinstance()`` about every class we know, the converters look up the class of
+every object in a :class:`TypeRegistry`. The first lookup for a class walks its method resolution
+order (so a handler for :class:`music21.note.Rest` also handles its subclasses), and the result is
+remembered, so every later lookup for that class is a single ``dict`` lookup.
+"""
+
+import threading
+
+
+class TypeRegistry(object):
+    """
+    A mapping from classes to handlers, where a class without a handler of its own uses the
+    handler of its nearest base class.
+
+    >>> handlers = TypeRegistry(default=ignore_it)
+    >>> handlers.register(note.Note, note_handler)
+    >>> handlers.lookup(type(the_note))(the_note)
+    """
+
+    def __init__(self, default=None):
+        """
+        :param default: The handler for classes without a registered handler (or base class).
+        :type default: callable
+        """
+        self._handlers = {}
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._default = default
+
+    def register(self, cls, handler=None):
+        """
+        Register the handler for ``cls`` and its subclasses, replacing any previous handler for
+        ``cls``. If you omit ``handler``, this method returns a decorator:
+
+        >>> @handlers.register(dynamics.Dynamic)
+        ... def dynamic_handler(obj, state):
+        ...     pass
+
+        :param cls: The class to handle.
+        :type cls: type
+        :param handler: The handler.
+        :type handler: callable
+
+        :returns: The handler, or a decorator if ``handler`` is ``None``.
+        """
+        if handler is None:
+            return lambda func: self.register(cls, func)
+        with self._lock:
+            self._handlers[cls] = handler
+            # the handler for subclasses may have changed
+            self._cache = {}
+        return handler
+
+    def unregister(self, cls):
+        """
+        Remove the handler for ``cls``. Its subclasses go back to using the handler for their next
+        nearest base class.
+
+        :param cls: The class to stop handling.
+        :type cls: type
+
+        :raises: :exc:`KeyError` if ``cls`` has no handler.
+        """
+        with self._lock:
+            del self._handlers[cls]
+            self._cache = {}
+
+    def __contains__(self, cls):
+        return cls in self._handlers
+
+    def lookup(self, cls):
+        """
+        Find the handler for a class.
+
+        :param cls: The class of the object to handle.
+        :type cls: type
+
+        :returns: The handler for ``cls`` or its nearest base class, or the default handler.
+        :rtype: callable
+        """
+        # if register() replaces the cache while we work, we mustn't put our result in the new one
+        cache = self._cache
+        try:
+            return cache[cls]
+        except KeyError:
+            pass
+        handlers = self._handlers
+        handler = self._default
+        for each_class in cls.__mro__:
+            if each_class in handlers:
+                handler = handlers[each_class]
+                break
+        cache[cls] = handler
+        return handler
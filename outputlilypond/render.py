@@ -0,0 +1,593 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: render.py
+# Purpose: Run LilyPond on the files produced by outputlilypond.
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+"""
+Run LilyPond on the files produced by :mod:`outputlilypond`.
+
+Engraving usually takes much longer than conversion, so :func:`run_lilypond_batch` runs LilyPond
+on many files at once, with a limited number of concurrent subprocesses, and yields a
+:class:`RenderResult` for every file as soon as it's finished. Every function here also accepts a
+:class:`~outputlilypond.cache.PDFCache`, so LilyPond doesn't run for a file it already engraved.
+For many short files, most of LilyPond's time goes to starting up, so :func:`run_lilypond_batch`
+can also give several files to every LilyPond process (with its ``batch_size`` argument).
+
+A service that engraves a score for every request doesn't need the LilyPond file on disk at all:
+:func:`render_source` pipes the output of :func:`~outputlilypond.process_score` to LilyPond, and
+returns the PDF itself.
+
+>>> pdf = render_source(process_score(the_score), timeout=60)
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import threading
+from collections import namedtuple
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from subprocess import Popen, PIPE
+from outputlilypond import problems, settings, stats
+# For python 2 and 3 compatibility:
+import sys
+if sys.version_info[0] > 2:
+    import queue
+else:
+    import Queue as queue
+
+"""
+Command-line options we always give to LilyPond.
+"""
+LILYPOND_OPTIONS = ['-dno-point-and-click', '-dsafe=#t', '--pdf']
+
+"""
+Where :func:`render_source` makes its temporary directories, if it exists. On Linux this is a
+tmpfs, so the files LilyPond writes never reach the disk. Elsewhere we use the system's
+temporary directory.
+"""
+MEMORY_DIRECTORY = '/dev/shm'
+
+
+def output_basename(filename):
+    """
+    Make the name LilyPond should use for its output files, given to its ``-o`` option. This is
+    ``filename`` without the ``.ly`` extension, so we don't output to ``*.ly.pdf``.
+
+    :param filename: The pathname of a LilyPond file.
+    :type filename: string
+
+    :returns: The pathname without the ``.ly`` extension.
+    :rtype: string
+    """
+    if 3 < len(filename) and '.ly' == filename[-3:]:
+        return filename[:-3]
+    else:
+        return filename
+
+
+def lilypond_command(filename, the_settings, output=None):
+    """
+    Make the command that runs LilyPond on a file.
+
+    :param filename: The pathname of the file to engrave.
+    :type filename: string
+    :param the_settings: The settings object that knows where LilyPond is.
+    :type the_settings: :class:`settings.LilyPondSettings`
+    :param output: The basename for the output files. The default is from
+        :func:`output_basename`.
+    :type output: string
+
+    :returns: The command, ready for :class:`subprocess.Popen`.
+    :rtype: list of string
+    """
+    if output is None:
+        output = output_basename(filename)
+    return [the_settings.get_property('lilypond_path')] + LILYPOND_OPTIONS + ['-o', output, filename]
+
+
+class RenderResult(namedtuple('RenderResult', ('filename', 'pdf_filename', 'returncode', 'stdout',
+                                               'stderr', 'timed_out', 'elapsed', 'cached'))):
+    """
+    The outcome of running LilyPond on one file.
+
+    * ``filename``: the LilyPond file
+    * ``pdf_filename``: the PDF that LilyPond should have produced
+    * ``returncode``: LilyPond's exit code (negative if it was killed by a signal)
+    * ``stdout`` and ``stderr``: LilyPond's output, as unicode strings
+    * ``timed_out``: whether we killed LilyPond because it took too long
+    * ``elapsed``: how long LilyPond ran, in seconds
+    * ``cached``: whether the PDF came from a :class:`~outputlilypond.cache.PDFCache`, in which
+      case LilyPond didn't run at all
+    """
+    __slots__ = ()
+
+    @property
+    def succeeded(self):
+        "Whether LilyPond finished on time and reported no errors."
+        return 0 == self.returncode and not self.timed_out
+
+
+def _decode(output):
+    "Convert the output of a subprocess into a unicode string."
+    if isinstance(output, bytes):
+        return output.decode('utf-8', 'replace')
+    return output
+
+
+def cache_lookup(filename, the_settings, cache):
+    """
+    Look for the PDF of a LilyPond file in a cache, and put it where LilyPond would.
+
+    :param filename: The pathname of the file to engrave.
+    :type filename: string
+    :param the_settings: The settings object that knows which LilyPond version will be used.
+    :type the_settings: :class:`settings.LilyPondSettings`
+    :param cache: The cache.
+    :type cache: :class:`~outputlilypond.cache.PDFCache`
+
+    :returns: The cache key, and a :class:`RenderResult` if the PDF was in the cache or else
+        ``None``.
+    :rtype: 2-tuple of string and :class:`RenderResult`
+
+    :raises: :exc:`IOError` if ``filename`` cannot be read.
+    """
+    start = time.time()
+    with open(filename, 'rb') as ly_file:
+        key = cache.make_key(ly_file.read(), the_settings, LILYPOND_OPTIONS)
+    pdf_filename = output_basename(filename) + '.pdf'
+    if cache.get(key, pdf_filename):
+        return key, RenderResult(filename, pdf_filename, 0, u'', u'', False, time.time() - start,
+                                 True)
+    return key, None
+
+
+def cache_store(cache, key, result):
+    """
+    Put the PDF from a successful run of LilyPond into a cache.
+
+    :param cache: The cache.
+    :type cache: :class:`~outputlilypond.cache.PDFCache`
+    :param key: The key from :func:`cache_lookup`.
+    :type key: string
+    :param result: The outcome of running LilyPond.
+    :type result: :class:`RenderResult`
+    """
+    if result.succeeded and os.path.exists(result.pdf_filename):
+        cache.put(key, result.pdf_filename)
+
+
+def render_file(filename, the_settings=None, timeout=None, cache=None):
+    """
+    Run LilyPond on a file, and wait for it to finish.
+
+    :param filename: The pathname of the file to engrave.
+    :type filename: string
+    :param the_settings: An optional settings object.
+    :type the_settings: :class:`settings.LilyPondSettings`
+    :param timeout: The number of seconds after which we kill LilyPond. The default, ``None``,
+        waits forever.
+    :type timeout: float
+    :param cache: An optional cache of PDFs. If the PDF for this file is in the cache, LilyPond
+        doesn't run.
+    :type cache: :class:`~outputlilypond.cache.PDFCache`
+
+    :returns: The outcome.
+    :rtype: :class:`RenderResult`
+
+    :raises: :exc:`OSError` if LilyPond cannot be started.
+    """
+    if the_settings is None:
+        the_settings = settings.LilyPondSettings()
+    with stats.timer(the_settings.stats, 'lilypond'):
+        return _render_file(filename, the_settings, timeout, cache)
+
+
+def _render_file(filename, the_settings, timeout, cache):
+    "Do the work of :func:`render_file`."
+    if cache is not None:
+        key, result = cache_lookup(filename, the_settings, cache)
+        if result is not None:
+            return result
+    output = output_basename(filename)
+    cmd = lilypond_command(filename, the_settings, output)
+    result = RenderResult(filename, output + '.pdf', *_run(cmd, the_settings, timeout))
+    if cache is not None:
+        cache_store(cache, key, result)
+    return result
+
+
+def _run(cmd, the_settings, timeout, source=None, cwd=None):
+    """
+    Run LilyPond and wait for it to finish, killing it if it takes longer than ``timeout``.
+
+    :param source: If given, this is written to LilyPond's standard input.
+    :type source: bytes
+    :param cwd: The directory in which to run LilyPond. The default is the current directory.
+    :type cwd: string
+
+    :returns: The members of a :class:`RenderResult` from ``returncode`` to ``cached``.
+    :rtype: 6-tuple
+
+    :raises: :exc:`OSError` if LilyPond cannot be started.
+    """
+    start = time.time()
+    lily = Popen(cmd, stdin=None if source is None else PIPE, stdout=PIPE, stderr=PIPE, cwd=cwd)
+    if the_settings.stats is not None:
+        the_settings.stats.count_lilypond_launch()
+    timed_out = threading.Event()
+    timer = None
+    if timeout is not None:
+        def kill_lilypond():
+            "Kill LilyPond when the timeout expires."
+            timed_out.set()
+            try:
+                lily.kill()
+            except OSError:
+                pass  # it already finished
+        timer = threading.Timer(timeout, kill_lilypond)
+        timer.start()
+    try:
+        stdout, stderr = lily.communicate(source)
+    finally:
+        if timer is not None:
+            timer.cancel()
+
+    return (lily.returncode, _decode(stdout), _decode(stderr), timed_out.is_set(),
+            time.time() - start, False)
+
+
+def _make_private_directory(directory):
+    "Make a temporary directory that only we may use, for :func:`render_source`."
+    if directory is None and os.path.isdir(MEMORY_DIRECTORY) and \
+            os.access(MEMORY_DIRECTORY, os.W_OK):
+        directory = MEMORY_DIRECTORY
+    return tempfile.mkdtemp(prefix='outputlilypond-', dir=directory)
+
+
+def render_source(source, the_settings=None, timeout=None, cache=None, directory=None):
+    """
+    Run LilyPond on a LilyPond source, like the output of :func:`~outputlilypond.process_score`,
+    and return the PDF.
+
+    The source is piped to LilyPond's standard input, so it's never written to a file. LilyPond
+    writes the PDF into a new temporary directory that only we may use, which is removed before
+    this function returns, whatever happens.
+
+    :param source: The LilyPond source.
+    :type source: ``unicode`` or bytes (encoded with UTF-8)
+    :param the_settings: An optional settings object.
+    :type the_settings: :class:`settings.LilyPondSettings`
+    :param timeout: The number of seconds after which we kill LilyPond. The default, ``None``,
+        waits forever.
+    :type timeout: float
+    :param cache: An optional cache of PDFs. If the PDF for this source is in the cache, LilyPond
+        doesn't run. The PDF has the same key as for a file with this source.
+    :type cache: :class:`~outputlilypond.cache.PDFCache`
+    :param directory: Where to make the temporary directory. The default is
+        :const:`MEMORY_DIRECTORY` if it exists, or else the system's temporary directory.
+    :type directory: string
+
+    :returns: The PDF.
+    :rtype: bytes
+
+    :raises: :exc:`~outputlilypond.problems.LilyPondError` if LilyPond fails, takes longer than
+        ``timeout``, or doesn't write a PDF.
+    :raises: :exc:`OSError` if LilyPond cannot be started.
+    """
+    if the_settings is None:
+        the_settings = settings.LilyPondSettings()
+    if not isinstance(source, bytes):
+        source = source.encode('utf-8')
+    with stats.timer(the_settings.stats, 'lilypond'):
+        return _render_source(source, the_settings, timeout, cache, directory)
+
+
+def _render_source(source, the_settings, timeout, cache, directory):
+    "Do the work of :func:`render_source`."
+    if cache is not None:
+        key = cache.make_key(source, the_settings, LILYPOND_OPTIONS)
+    private = _make_private_directory(directory)
+    try:
+        output = os.path.join(private, 'score')
+        pdf_filename = output + '.pdf'
+        if cache is None or not cache.get(key, pdf_filename):
+            cmd = lilypond_command('-', the_settings, output)
+            result = RenderResult(u'-', pdf_filename,
+                                  *_run(cmd, the_settings, timeout, source, private))
+            if not result.succeeded or not os.path.exists(pdf_filename):
+                raise problems.LilyPondError(result)
+            if cache is not None:
+                cache_store(cache, key, result)
+        with open(pdf_filename, 'rb') as pdf:
+            return pdf.read()
+    finally:
+        shutil.rmtree(private, ignore_errors=True)
+
+
+def run_lilypond_batch(filenames, the_settings=None, max_jobs=None, timeout=None, cache=None,
+                       batch_size=1, window=None):
+    """
+    Run LilyPond on many files, with at most ``max_jobs`` LilyPond processes at a time.
+
+    The results are yielded as each file is finished, so they are usually not in the same order
+    as ``filenames``. A file for which LilyPond cannot even be started (for example, because it
+    isn't installed) yields a :class:`RenderResult` with ``returncode`` of ``None`` and the error
+    message in ``stderr``.
+
+    >>> for result in run_lilypond_batch(['a.ly', 'b.ly'], max_jobs=2, timeout=60):
+    ...     if not result.succeeded:
+    ...         print(result.filename, result.stderr)
+
+    Starting LilyPond takes about a second, which may be most of the time for a short file. With a
+    ``batch_size`` larger than ``1``, every LilyPond process engraves up to that many files. We
+    find each file's output in LilyPond's output, and a file that fails in a batch is engraved
+    again by itself, so its :class:`RenderResult` is the same as without batches. Only the
+    ``*.ly`` files in the same directory share a batch. If ``filenames`` is a generator that
+    yields files as they're ready, ``window`` limits how long a batch waits for more files.
+
+    :param filenames: The pathnames of the files to engrave.
+    :type filenames: iterable of string
+    :param the_settings: An optional settings object.
+    :type the_settings: :class:`settings.LilyPondSettings`
+    :param max_jobs: The largest number of LilyPond processes to run at once. The default is the
+        number of CPUs.
+    :type max_jobs: int
+    :param timeout: The number of seconds after which we kill LilyPond, for each file. The default,
+        ``None``, waits forever.
+    :type timeout: float
+    :param cache: An optional cache of PDFs, so LilyPond doesn't run for files already in it.
+    :type cache: :class:`~outputlilypond.cache.PDFCache`
+    :param batch_size: The largest number of files for one LilyPond process. The default is ``1``.
+    :type batch_size: int
+    :param window: The number of seconds a batch waits for ``filenames`` to yield more files,
+        after its first file. The default, ``None``, waits until the batch is full.
+    :type window: float
+
+    :returns: A generator of results, in the order they finish.
+    :rtype: generator of :class:`RenderResult`
+
+    :raises: :exc:`ValueError` if ``max_jobs`` or ``batch_size`` is less than ``1``, or
+        ``window`` isn't positive.
+    """
+    if max_jobs is None:
+        max_jobs = cpu_count()
+    elif max_jobs < 1:
+        raise ValueError('run_lilypond_batch(): "max_jobs" must be at least 1')
+    if batch_size < 1:
+        raise ValueError('run_lilypond_batch(): "batch_size" must be at least 1')
+    if window is not None and window <= 0:
+        raise ValueError('run_lilypond_batch(): "window" must be more than 0')
+    if the_settings is None:
+        the_settings = settings.LilyPondSettings()
+    # find LilyPond now, rather than once in every thread
+    the_settings.get_property('lilypond_path')
+
+    if 1 == batch_size:
+        def render_one(filename):
+            "Run one job, turning an error into a failed RenderResult."
+            try:
+                return render_file(filename, the_settings, timeout, cache)
+            except OSError as err:
+                return _not_started(filename, err)
+
+        return _run_in_threads(render_one, filenames, max_jobs)
+
+    def render_batch(batch):
+        "Run one batch of jobs."
+        with stats.timer(the_settings.stats, 'lilypond'):
+            return _render_batch(batch, the_settings, timeout, cache)
+
+    return (result
+            for results in _run_in_threads(render_batch, _batches(filenames, batch_size, window),
+                                           max_jobs)
+            for result in results)
+
+
+def _not_started(filename, err):
+    "Make the failed RenderResult for a file on which LilyPond cannot be started."
+    return RenderResult(filename, output_basename(filename) + '.pdf', None, u'',
+                        u'Could not start LilyPond: %s' % err, False, 0.0, False)
+
+
+"""
+Marks the end of the files given to :func:`run_lilypond_batch`, in :func:`_batches`.
+"""
+_END = object()
+
+
+def _batches(filenames, batch_size, window):
+    """
+    Group ``filenames`` into lists of at most ``batch_size``, closing a list after ``window``
+    seconds if ``filenames`` doesn't yield enough files by then.
+    """
+    if window is None:
+        batch = []
+        for filename in filenames:
+            batch.append(filename)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+        return
+
+    # Waiting for the next file mustn't take longer than the window, so another thread waits.
+    waiting = queue.Queue()
+
+    def read_filenames():
+        "Put every file (then _END, or an exception) into the queue."
+        try:
+            for filename in filenames:
+                waiting.put(filename)
+        except Exception as err:  # pylint: disable=broad-except
+            waiting.put(err)
+        waiting.put(_END)
+
+    reader = threading.Thread(target=read_filenames)
+    reader.daemon = True
+    reader.start()
+    item = waiting.get()
+    while item is not _END:
+        if isinstance(item, Exception):
+            raise item
+        batch = [item]
+        deadline = time.time() + window
+        item = None
+        while item is None and len(batch) < batch_size:
+            try:
+                item = waiting.get(timeout=max(deadline - time.time(), 0.0))
+            except queue.Empty:
+                break
+            if item is not _END and not isinstance(item, Exception):
+                batch.append(item)
+                item = None
+        yield batch
+        if item is None:
+            # the batch closed before the next file
+            item = waiting.get()
+
+
+def _render_batch(batch, the_settings, timeout, cache):
+    """
+    Run LilyPond on a batch of files, with one process for the ``*.ly`` files in each directory.
+
+    :returns: A :class:`RenderResult` for every file in the batch.
+    :rtype: list of :class:`RenderResult`
+    """
+    results = []
+    keys = {}
+    groups = {}
+    for filename in batch:
+        if cache is not None:
+            keys[filename], result = cache_lookup(filename, the_settings, cache)
+            if result is not None:
+                results.append(result)
+                continue
+        if filename.endswith('.ly'):
+            # LilyPond names the PDFs in its "-o" directory like output_basename() does
+            groups.setdefault(os.path.dirname(filename) or os.curdir, []).append(filename)
+        else:
+            groups[filename] = [filename]
+
+    for directory, group in groups.items():
+        if len(group) > 1:
+            try:
+                finished, failed = _render_group(directory, group, the_settings, timeout)
+            except OSError as err:
+                finished, failed = [_not_started(filename, err) for filename in group], []
+        else:
+            finished, failed = [], group
+        for filename in failed:
+            try:
+                finished.append(_render_file(filename, the_settings, timeout, None))
+            except OSError as err:
+                finished.append(_not_started(filename, err))
+        if cache is not None:
+            for result in finished:
+                cache_store(cache, keys[result.filename], result)
+        results.extend(finished)
+
+    return results
+
+
+def _render_group(directory, group, the_settings, timeout):
+    """
+    Run one LilyPond process on files in the same directory.
+
+    :returns: A :class:`RenderResult` for every file that LilyPond engraved without errors, and
+        the files that must be engraved again by themselves.
+    :rtype: 2-tuple of list of :class:`RenderResult` and list of string
+
+    :raises: :exc:`OSError` if LilyPond cannot be started.
+    """
+    before = dict((filename, _pdf_stamp(filename)) for filename in group)
+    cmd = ([the_settings.get_property('lilypond_path')] + LILYPOND_OPTIONS + ['-o', directory] +
+           group)
+    returncode, stdout, stderr, timed_out, elapsed, _ = _run(
+        cmd, the_settings, None if timeout is None else timeout * len(group))
+    stdout = _split_output(stdout, group)
+    stderr = _split_output(stderr, group)
+
+    finished = []
+    failed = []
+    for filename in group:
+        stamp = _pdf_stamp(filename)
+        if timed_out or stamp is None or stamp == before[filename] or \
+                (0 != returncode and u'error' in stderr[filename]):
+            failed.append(filename)
+        else:
+            # every file gets its share of the time
+            finished.append(RenderResult(filename, output_basename(filename) + '.pdf', 0,
+                                         stdout[filename], stderr[filename], False,
+                                         elapsed / len(group), False))
+    return finished, failed
+
+
+def _pdf_stamp(filename):
+    """
+    Return what tells us whether LilyPond wrote a new PDF for ``filename``: the PDF's modification
+    time, size, and inode, or ``None`` if there's no PDF.
+    """
+    try:
+        stat = os.stat(output_basename(filename) + '.pdf')
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+
+def _split_output(output, filenames):
+    """
+    Split the output of LilyPond for many files into the output for each one. LilyPond starts
+    every file with a "Processing `filename'" line, and what comes before the first file belongs
+    to all of them.
+
+    :returns: The output for every file.
+    :rtype: dict of unicode string
+    """
+    lines = dict((filename, []) for filename in filenames)
+    preamble = []
+    current = preamble
+    for line in output.splitlines(True):
+        if line.startswith(u'Processing `'):
+            current = lines.get(line.strip()[len(u'Processing `'):-1], current)
+        current.append(line)
+    preamble = u''.join(preamble)
+    return dict((filename, preamble + u''.join(lines[filename])) for filename in filenames)
+
+
+def _run_in_threads(func, jobs, max_jobs):
+    """
+    Call ``func`` on every one of ``jobs`` with a pool of ``max_jobs`` threads, and yield the
+    results as they finish.
+    """
+    pool = ThreadPool(max_jobs)
+    finished = False
+    try:
+        for result in pool.imap_unordered(func, jobs):
+            yield result
+        finished = True
+    finally:
+        if finished:
+            pool.close()
+        else:
+            # the caller stopped early, so don't start any more jobs
+            pool.terminate()
+        pool.join()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: session.py
+# Purpose: Convert a score again after small edits, reusing the measures that didn't change.
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+"""
+Convert a score again after small edits, reusing the measures that didn't change.
+
+An editor that shows the engraved score converts it again after every edit, and most edits touch
+one or two measures. An :class:`IncrementalSession` remembers the LilyPond string of every measure
+from its previous conversion, so only the edited measures are converted again.
+
+>>> session = IncrementalSession()
+>>> first = session.convert(the_score)
+>>> the_score.parts[0].getElementsByClass('Measure')[3].notes[0].pitch.name = 'D'
+>>> second = session.convert(the_score)
+
+Every measure is found by a fingerprint of its IR, so the session notices any change, but it must
+still extract every measure to know which changed. If you know which measures you edited, give them
+to :meth:`IncrementalSession.convert` too, and the others aren't extracted or fingerprinted again.
+Every measure is still visited to follow the time signatures, so some of the time to convert the
+score again depends on the size of the score, but much less than for a whole conversion.
+
+>>> second = session.convert(the_score, changed=[the_measure])
+
+The output is always the same as from :func:`~outputlilypond.process_score`.
+"""
+
+from music21 import stream
+from outputlilypond import core, functions, ir, settings
+from outputlilypond.context import ConversionContext
+
+
+def _fingerprint(item):
+    """
+    Return a hashable fingerprint of a MEASURE or NOTE record. Two items with the same
+    fingerprint have the same LilyPond string.
+    """
+    if ir.MEASURE == item.kind:
+        return item._replace(events=tuple(item.events))
+    return item
+
+
+class IncrementalSession(object):
+    """
+    Convert the same score many times, converting again only the measures that changed since the
+    previous conversion.
+
+    Every conversion forgets the measures of the conversion before it, so the session holds the
+    measures of only one version of the score.
+    """
+
+    def __init__(self, the_settings=None):
+        """
+        :param the_settings: An optional settings object for every conversion.
+        :type the_settings: :class:`settings.LilyPondSettings`
+        """
+        self._setts = settings.LilyPondSettings() if the_settings is None else the_settings
+        # LilyPond string of every measure (and note) in the previous conversion, by fingerprint
+        self._lily = {}
+        # for the "changed" argument: id(part) -> (part, header of its PART tuple) and
+        # id(measure) -> (measure, bar_ql, fingerprint), from the previous conversion
+        self._parts = {}
+        self._measures = {}
+        # how many measures (and notes) were reused, and how many were converted again
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        "Forget the previous conversion, so that every measure is converted again."
+        self._lily = {}
+        self._parts = {}
+        self._measures = {}
+
+    def convert(self, the_score, changed=None):
+        """
+        Convert a score, reusing the LilyPond string of every measure that is the same as in the
+        previous conversion.
+
+        :param the_score: The score to convert.
+        :type the_score: :class:`music21.stream.Score` or :class:`music21.stream.Stream`
+        :param changed: The :class:`Measure` and :class:`Part` objects edited since the previous
+            conversion. If you give this, the other measures and parts of the previous conversion
+            are not extracted again (though every measure is still visited, to follow the time
+            signatures), so you must include everything you changed (or added). A :class:`Part`
+            in this list is extracted again entirely. If this is ``None`` (the default), every
+            measure is extracted again and compared by its fingerprint.
+        :type changed: iterable of :class:`music21.stream.Measure` or :class:`music21.stream.Part`
+
+        :returns: The LilyPond file, the same as from :func:`~outputlilypond.process_score`.
+        :rtype: ``unicode``
+        """
+        if not isinstance(the_score, stream.Score):
+            self.clear()
+            return functions.stream_to_lily(the_score, self._setts)
+
+        if changed is not None:
+            changed = set(id(each) for each in changed)
+        # the next conversion needs only what this one uses
+        old_lily, old_parts, old_measures = self._lily, self._parts, self._measures
+        self._lily, self._parts, self._measures = {}, {}, {}
+
+        context = ConversionContext()
+        context.parts_in_this_score = [None] * len(the_score)
+        post = [core.score_header(self._setts)]
+        for i, thing in enumerate(the_score):
+            if isinstance(thing, stream.Part):
+                part_name = functions.new_part_name(context, remember=False)
+                part_ir, body = self._convert_part(thing, changed, old_lily, old_parts,
+                                                   old_measures)
+                lily = ir.part_ir_to_lily(part_ir, self._setts, None, body, part_name, context)
+                context.parts_in_this_score[i] = part_name
+            else:
+                lily = functions.stream_to_lily(thing, self._setts)
+            if lily:
+                post.extend([lily, u'\n'])
+        post.append(core.score_block(self._setts, context))
+        return u''.join(post)
+
+    def _convert_part(self, part, changed, old_lily, old_parts, old_measures):
+        """
+        Extract a :class:`Part` and convert its measures, reusing what we can from the previous
+        conversion.
+
+        :returns: The PART record (without the measures of a part that isn't an analysis part),
+            and the LilyPond string of its measures (or ``None`` for an analysis part).
+        :rtype: 2-tuple of :class:`~outputlilypond.ir.PartIR` and unicode string
+        """
+        trusted = changed is not None and id(part) not in changed
+        previous = old_parts.get(id(part))
+        if trusted and previous is not None and previous[0] is part:
+            header = previous[1]
+        else:
+            header = ir.extract_part_header(part)
+        self._parts[id(part)] = (part, header)
+        if ir.is_analysis_voice(header):
+            # an analysis part has no measures, so we convert it again every time
+            return header._replace(items=ir.extract_analysis_part(part)), None
+        elif header.is_analysis:
+            # its contents aren't output
+            return header._replace(items=[]), None
+
+        body = []
+        for thing, bar_ql in functions.iterate_part(part):
+            key = None
+            if isinstance(thing, stream.Measure):
+                previous = old_measures.get(id(thing))
+                if (trusted and id(thing) not in changed and previous is not None and
+                        previous[0] is thing and previous[1] == bar_ql):
+                    key = previous[2]
+            if key is None or key not in old_lily:
+                item = ir.extract_part_item(thing, bar_ql)
+                if item is None:
+                    continue
+                key = _fingerprint(item)
+            if isinstance(thing, stream.Measure):
+                self._measures[id(thing)] = (thing, bar_ql, key)
+
+            lily = self._lily.get(key)
+            if lily is None:
+                lily = old_lily.get(key)
+                if lily is None:
+                    self.misses += 1
+                    lily = ir.measures_ir_to_lily([item])
+                else:
+                    self.hits += 1
+                self._lily[key] = lily
+            else:
+                self.hits += 1
+            body.append(lily)
+
+        return header._replace(items=[]), u''.join(body)
@@ -25,7 +25,9 @@ The :mod:`settings` module holds :class:`LilyPondSettings`, which prepares and s
 outputlilypond, along with various internally-used functions.
 """
 
+import os
 import subprocess
+import threading
 from platform import system as which_os
 # For python 2 and 3 compatibility:
 import sys
@@ -35,6 +37,43 @@ else:
     text = unicode
 
 
+# Environment variables that tell us where LilyPond is, and which version it is, so we don't have
+# to find out for ourselves.
+PATH_VARIABLE = 'OUTPUTLILYPOND_LILYPOND_PATH'
+VERSION_VARIABLE = 'OUTPUTLILYPOND_LILYPOND_VERSION'
+
+# The results of detect_lilypond(), keyed on the "lily_path" argument. Finding LilyPond means
+# starting two subprocesses, so we only do it once per process.
+_detected_lilyponds = {}
+_detection_lock = threading.Lock()
+
+
+class _LazySettings(dict):
+    """
+    Holds the settings of a :class:`LilyPondSettings` object. The settings about LilyPond itself
+    are filled in the first time they're required, so that we don't look for LilyPond until (and
+    unless) we need it.
+    """
+
+    LAZY_SETTINGS = ('lilypond_path', 'lilypond_version', 'lilypond_version_numbers')
+
+    def __contains__(self, setting_name):
+        return setting_name in _LazySettings.LAZY_SETTINGS or \
+            super(_LazySettings, self).__contains__(setting_name)
+
+    def __missing__(self, setting_name):
+        if 'lilypond_version_numbers' == setting_name:
+            self[setting_name] = \
+                LilyPondSettings.make_lily_version_numbers(self['lilypond_version'])
+        elif setting_name in _LazySettings.LAZY_SETTINGS:
+            res = LilyPondSettings.detect_lilypond(self.get('lilypond_path'))
+            self.setdefault('lilypond_path', res[0])
+            self.setdefault('lilypond_version', res[1])
+        else:
+            raise KeyError(setting_name)
+        return self[setting_name]
+
+
 class LilyPondSettings:
     """
     Holds the settings relevant to output formatting of a LilyPond file.
@@ -50,20 +89,35 @@ class LilyPondSettings:
     - lilypond_version : a str that contains the LilyPond version (default is
         auto-detection of whatever's installed)
     - lilypond_path : a str that is the full path to the LilyPond executable
+
+    Converting a score doesn't change the settings object (the state of a conversion is kept in a
+    :class:`~outputlilypond.context.ConversionContext`), so once you've chosen the settings, you may
+    share one object among many conversions at once, in many threads and processes.
+
+    We find the LilyPond path and version only when one of them is first required, and only once
+    per process. To avoid detection entirely, give them to the constructor, or set the
+    OUTPUTLILYPOND_LILYPOND_PATH and OUTPUTLILYPOND_LILYPOND_VERSION environment variables.
     """  # pytlint disable=W1401
 
-    def __init__(self):
+    def __init__(self, lilypond_path=None, lilypond_version=None):
         """
         Create a new LilyPondSettings instance.
+
+        :param lilypond_path: The full path to the LilyPond executable. The default is the value of
+            the OUTPUTLILYPOND_LILYPOND_PATH environment variable, if it's set, or else we find it
+            when it's required.
+        :type lilypond_path: str
+        :param lilypond_version: The LilyPond version, like ``'2.18.2'``. The default is the value
+            of the OUTPUTLILYPOND_LILYPOND_VERSION environment variable, if it's set, or else we ask
+            LilyPond when it's required.
+        :type lilypond_version: str
         """
         # TODO: re-implmement all of the properties as str in _secret_settings
-        # Hold a list of the part names in this Score
-        self._parts_in_this_score = []
-        # Hold a list of the parts that should be written with the
-        # VisAnnotation context.
-        self._analysis_notation_parts = []
-        # Hold the other settings for this Score
-        self._secret_settings = {}
+        # An optional stats.ConversionStats object that records where the time goes. When this is
+        # None, nothing is recorded.
+        self.stats = None
+        # Hold the other settings
+        self._secret_settings = _LazySettings()
         # Establish default values for settings in this Score
         # TODO: test this; it's in the "Part" section of process_stream()
         self._secret_settings['bar numbers'] = None
@@ -73,12 +127,16 @@ class LilyPondSettings:
         self._secret_settings['indent'] = None  # TODO: test this
         self._secret_settings['print_instrument_names'] = True  # TODO: implement
         self._secret_settings['paper_size'] = 'letter'
-        # Deal with the LilyPond path and version
-        res = LilyPondSettings.detect_lilypond()
-        self._secret_settings['lilypond_path'] = res[0]
-        self._secret_settings['lilypond_version'] = res[1]
-        self._secret_settings['lilypond_version_numbers'] = \
-            LilyPondSettings.make_lily_version_numbers(res[1])
+        # Deal with the LilyPond path and version; anything we don't know yet is filled in by
+        # _LazySettings when it's first required.
+        if lilypond_path is None:
+            lilypond_path = os.environ.get(PATH_VARIABLE)
+        if lilypond_path:
+            self._secret_settings['lilypond_path'] = lilypond_path
+        if lilypond_version is None:
+            lilypond_version = os.environ.get(VERSION_VARIABLE)
+        if lilypond_version:
+            self._secret_settings['lilypond_version'] = lilypond_version
 
     def set_property(self, setting_name, setting_value):
         """
@@ -105,14 +163,31 @@ class LilyPondSettings:
         return self._secret_settings[setting_name]
 
     @staticmethod
-    def detect_lilypond():
+    def detect_lilypond(lily_path=None):
         """
         Determine the path to LilyPond and its version.
 
+        The result is remembered, so this method starts subprocesses only the first time it's
+        called in a process (for every value of ``lily_path``).
+
+        :param lily_path: The full path to the LilyPond executable, if it's already known. The
+            default is to find it with ``which``.
+        :type lily_path: str
+
         Returns a 2-tuple with two str objects:
         - the full path of the LilyPond executable
         - the version reported by that executable
         """
+        with _detection_lock:
+            if lily_path not in _detected_lilyponds:
+                _detected_lilyponds[lily_path] = LilyPondSettings._run_detect_lilypond(lily_path)
+            return _detected_lilyponds[lily_path]
+
+    @staticmethod
+    def _run_detect_lilypond(lily_path=None):
+        """
+        Do the work of :meth:`detect_lilypond`, without remembering the result.
+        """
 
         # NB: On Windows, use registry key to find path...
         # HKLM/SOFTWARE/Wow6432Node/LilyPond/Install_Dir
@@ -122,17 +197,19 @@ class LilyPondSettings:
         if 'Windows' == which_os():
             # NOTE: this is just a temporary hack that allows vis to load on Windows
             # computers, but likely without enabling LilyPond supprt
-            return ('lilypond.exe', '2.0.0')
+            return (lily_path or 'lilypond.exe', '2.0.0')
         else:
             # On Linux/Unix systems, we'll assume a "bash"-like shell, and brace for impact if it's
             # OS X, which will complain
             try:
-                split_char = '\\n' if sys.version_info[0] > 2 else '\n'
-                lily_path = text(subprocess.check_output(['which', 'lilypond']).strip())
-                version = text(subprocess.check_output([lily_path, '--version'])).split(split_char)[0]
-                lily_verzh = version[version.find('LilyPond') + 9:]
-            except OSError:
-                return ('lilypond', '2.16.0')  # TODO: what a terrible hack
+                if lily_path is None:
+                    lily_path = subprocess.check_output(['which', 'lilypond'])
+                    lily_path = lily_path.decode('utf-8').strip()
+                version = subprocess.check_output([lily_path, '--version'])
+                version = version.decode('utf-8').split('\n')[0]
+                lily_verzh = version[version.find('LilyPond') + 9:].strip()
+            except (OSError, subprocess.CalledProcessError):
+                return (lily_path or 'lilypond', '2.16.0')  # TODO: what a terrible hack
 
             return (lily_path, lily_verzh)
 
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: stats.py
+# Purpose: Times and counters for conversions and LilyPond runs.
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+"""
+Times and counters for conversions and LilyPond runs.
+
+To find out where the time goes, put a :class:`ConversionStats` object in the ``stats`` attribute
+of a settings object:
+
+>>> the_settings = LilyPondSettings()
+>>> the_settings.stats = ConversionStats()
+>>> lily = process_score(the_score, the_settings)
+>>> print(the_settings.stats.report())
+
+These are the stages:
+
+* ``extract``: reading the parts into the IR (refer to :mod:`outputlilypond.ir`), in this process.
+* ``part cache``: looking for parts in a :class:`~outputlilypond.cache.PartCache`.
+* ``convert``: converting the parts to LilyPond, added up over every worker process.
+* ``wait``: waiting in this process for the workers to finish the parts.
+* ``other``: converting everything in the :class:`Score` that isn't a :class:`Part`.
+* ``score block``: writing the ``\\score`` and ``\\layout`` blocks.
+* ``lilypond``: running LilyPond (or finding its PDF in a cache).
+
+When the ``stats`` attribute is ``None`` (the default), nothing is timed or counted.
+"""
+
+import threading
+import time
+from collections import Counter
+# For python 2 and 3 compatibility:
+import sys
+if sys.version_info[0] > 2:
+    text = str
+else:
+    text = unicode
+
+
+class ConversionStats(object):
+    """
+    The wall-clock time of every stage and every part, the number of elements of every class, and
+    the number of times LilyPond was started. It's safe to use one object in several threads.
+
+    The worker processes record what they do in their own :class:`ConversionStats` objects, which
+    are sent back and added to this one with :meth:`merge`.
+    """
+
+    def __init__(self):
+        # The number of seconds spent in every stage, keyed on the stage name.
+        self.stage_times = Counter()
+        # The number of times every stage happened, keyed on the stage name.
+        self.stage_calls = Counter()
+        # The number of seconds spent converting every part, keyed on the part's name.
+        self.part_times = Counter()
+        # The number of elements converted, keyed on the name of their class.
+        self.elements = Counter()
+        # The number of LilyPond processes started.
+        self.lilypond_launches = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # a Lock can't be pickled, and the worker processes get a copy of the settings
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add_time(self, stage, seconds):
+        """
+        Add to the time of a stage.
+
+        :param stage: The name of the stage.
+        :type stage: string
+        :param seconds: How long it took.
+        :type seconds: float
+        """
+        with self._lock:
+            self.stage_times[stage] += seconds
+            self.stage_calls[stage] += 1
+
+    def add_part_time(self, part_name, seconds):
+        """
+        Add to the time of a part.
+
+        :param part_name: The name of the part in the LilyPond file.
+        :type part_name: string
+        :param seconds: How long it took.
+        :type seconds: float
+        """
+        with self._lock:
+            self.part_times[part_name] += seconds
+
+    def count_elements(self, the_stream):
+        """
+        Count the elements in a :class:`Stream` (and the streams inside it) by their class.
+
+        :param the_stream: The :class:`Stream` to count.
+        :type the_stream: :class:`music21.stream.Stream`
+        """
+        counts = Counter(type(obj).__name__ for obj in the_stream.recurse())
+        # recurse() includes the Stream itself
+        counts[type(the_stream).__name__] -= 1
+        with self._lock:
+            self.elements.update(counts)
+
+    def count_lilypond_launch(self):
+        "Count one more LilyPond process."
+        with self._lock:
+            self.lilypond_launches += 1
+
+    def merge(self, other):
+        """
+        Add the times and counts from another :class:`ConversionStats`, like one sent back from a
+        worker process.
+
+        :param other: The stats to add to these.
+        :type other: :class:`ConversionStats`
+        """
+        with self._lock:
+            self.stage_times.update(other.stage_times)
+            self.stage_calls.update(other.stage_calls)
+            self.part_times.update(other.part_times)
+            self.elements.update(other.elements)
+            self.lilypond_launches += other.lilypond_launches
+
+    def report(self):
+        """
+        Describe these stats in a table.
+
+        :returns: The table.
+        :rtype: unicode string
+        """
+        with self._lock:
+            post = [u'stage              seconds    calls\n']
+            for stage in sorted(self.stage_times):
+                post.append(u'{:<16}{:>10.3f}{:>9}\n'.format(stage, self.stage_times[stage],
+                                                             self.stage_calls[stage]))
+            if self.part_times:
+                post.append(u'\npart               seconds\n')
+                for part_name in sorted(self.part_times):
+                    post.append(u'{:<16}{:>10.3f}\n'.format(part_name,
+                                                            self.part_times[part_name]))
+            if self.elements:
+                post.append(u'\nelement              count\n')
+                for name, count in sorted(self.elements.items()):
+                    if count > 0:
+                        post.append(u'{:<16}{:>10}\n'.format(text(name), count))
+            post.append(u'\nLilyPond launches: {}\n'.format(self.lilypond_launches))
+        return u''.join(post)
+
+
+class _Timer(object):
+    "Add the time spent in a ``with`` block to a stage of a :class:`ConversionStats`."
+
+    def __init__(self, the_stats, stage):
+        self._stats = the_stats
+        self._stage = stage
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stats.add_time(self._stage, time.time() - self._start)
+        return False
+
+
+class _NotTimed(object):
+    "A ``with`` block that does nothing, for when there are no stats."
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NOT_TIMED = _NotTimed()
+
+
+def timer(the_stats, stage):
+    """
+    Time a ``with`` block as part of a stage:
+
+    >>> with timer(the_settings.stats, 'extract'):
+    ...     part_ir = ir.extract_part(part)
+
+    :param the_stats: The stats to add to, or ``None`` to do nothing.
+    :type the_stats: :class:`ConversionStats`
+    :param stage: The name of the stage.
+    :type stage: string
+
+    :returns: A context manager.
+    """
+    if the_stats is None:
+        return _NOT_TIMED
+    return _Timer(the_stats, stage)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: lilypond_stub.py
+# Purpose: A fake LilyPond executable for tests that run LilyPond.
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+"""
+A fake LilyPond executable for tests that run LilyPond.
+
+The stub writes "%PDF-stub" followed by the input file to the output PDF. If the input holds the
+word "fail" it prints an error and exits with code 1, and if it holds "sleep" it waits for ten
+seconds first. The input file "-" is read from standard input. Like LilyPond, it accepts several
+input files, continuing after one that fails, and if the "-o" option is a directory it writes the
+PDFs there. Every run appends a line to the "calls.log" file beside the stub.
+"""
+
+import os
+import stat
+import sys
+from outputlilypond.settings import LilyPondSettings
+
+
+STUB_SOURCE = '''#!%(python)s
+import os, sys, time
+args = sys.argv[1:]
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calls.log'), 'a') as log:
+    log.write(' '.join(args) + '\\n')
+if '--version' in args:
+    print('GNU LilyPond 2.18.2')
+    sys.exit(0)
+output = args[args.index('-o') + 1]
+filenames = args[args.index('-o') + 2:]
+failed = False
+for filename in filenames:
+    if '-' == filename:
+        source = sys.stdin.read()
+    else:
+        with open(filename) as the_file:
+            source = the_file.read()
+    sys.stderr.write('Processing `%%s\\'\\n' %% filename)
+    if 'sleep' in source:
+        time.sleep(10)
+    if 'fail' in source:
+        sys.stderr.write('%%s:1:1: error: syntax error\\n' %% filename)
+        failed = True
+        continue
+    if os.path.isdir(output):
+        pdf_name = os.path.join(output, os.path.splitext(os.path.basename(filename))[0])
+    else:
+        pdf_name = output
+    with open(pdf_name + '.pdf', 'w') as pdf:
+        pdf.write('%%PDF-stub\\n' + source)
+if failed:
+    sys.stderr.write('fatal error: failed files: %%s\\n' %% ' '.join(filenames))
+    sys.exit(1)
+'''
+
+
+def make_stub(directory):
+    """
+    Write the stub LilyPond into ``directory``, and return settings that use it.
+    """
+    path = os.path.join(directory, 'lilypond')
+    with open(path, 'w') as stub:
+        stub.write(STUB_SOURCE % {'python': sys.executable})
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return LilyPondSettings(lilypond_path=path, lilypond_version='2.18.2')
+
+
+def stub_calls(directory):
+    """
+    Return the command-line arguments of every run of the stub in ``directory``.
+    """
+    log_path = os.path.join(directory, 'calls.log')
+    if not os.path.exists(log_path):
+        return []
+    with open(log_path) as log:
+        return [line.split() for line in log]
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: test_aio.py
+# Purpose: Tests for the asyncio functions in outputlilypond.aio
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+
+# Don't worry about missing docstrings
+# pylint: disable=C0111
+# Don't worry about "too many public methods"
+# pylint: disable=R0904
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+import pytest
+
+if sys.version_info < (3, 5):
+    pytest.skip('outputlilypond.aio requires Python 3.5', allow_module_level=True)
+
+import asyncio
+from music21 import converter
+from outputlilypond import aio, stats, LilyConverter
+from outputlilypond.__main__ import process_score
+from outputlilypond.settings import LilyPondSettings
+from outputlilypond.cache import PDFCache
+from lilypond_stub import make_stub, stub_calls
+
+
+class AsyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.directory = tempfile.mkdtemp()
+        self.setts = make_stub(self.directory)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        shutil.rmtree(self.directory)
+
+    def make_ly(self, name, contents=u'{ c4 }'):
+        pathname = os.path.join(self.directory, name)
+        with open(pathname, 'w') as ly_file:
+            ly_file.write(contents)
+        return pathname
+
+
+class TestProcessScore(AsyncTestCase):
+    def test_same_as_sync(self):
+        the_score = converter.parse('test_corpus/bwv77.mxl')
+        expect = process_score(the_score, LilyPondSettings())
+        actual = self.loop.run_until_complete(aio.process_score(the_score, LilyPondSettings()))
+        self.assertEqual(expect, actual)
+
+    def test_with_converter(self):
+        the_score = converter.parse('test_corpus/bwv77.mxl')
+        with LilyConverter(processes=2) as lily_conv:
+            coros = [aio.process_score(the_score, LilyPondSettings(), converter=lily_conv)
+                     for _ in range(3)]
+            results = self.loop.run_until_complete(asyncio.gather(*coros))
+        for each_result in results:
+            self.assertEqual(4, each_result.count(u'\\new Staff ='))
+
+    def test_cancel(self):
+        the_score = converter.parse('test_corpus/bwv77.mxl')
+        task = self.loop.create_task(aio.process_score(the_score, LilyPondSettings()))
+        self.loop.call_soon(task.cancel)
+        with pytest.raises(asyncio.CancelledError):
+            self.loop.run_until_complete(task)
+
+
+class TestRunLilyPond(AsyncTestCase):
+    def test_success(self):
+        pathname = self.make_ly('one.ly')
+        result = self.loop.run_until_complete(aio.run_lilypond(pathname, self.setts))
+        self.assertTrue(result.succeeded)
+        self.assertTrue(os.path.exists(result.pdf_filename))
+
+    def test_failure(self):
+        pathname = self.make_ly('bad.ly', u'fail')
+        result = self.loop.run_until_complete(aio.run_lilypond(pathname, self.setts))
+        self.assertEqual(1, result.returncode)
+        self.assertIn(u'syntax error', result.stderr)
+
+    def test_timeout(self):
+        pathname = self.make_ly('slow.ly', u'sleep')
+        result = self.loop.run_until_complete(aio.run_lilypond(pathname, self.setts, 0.5))
+        self.assertTrue(result.timed_out)
+        self.assertLess(result.elapsed, 5.0)
+
+    def test_cancel(self):
+        # cancelling kills LilyPond
+        pathname = self.make_ly('slow.ly', u'sleep')
+        task = self.loop.create_task(aio.run_lilypond(pathname, self.setts))
+        self.loop.call_later(0.5, task.cancel)
+        start = time.time()
+        with pytest.raises(asyncio.CancelledError):
+            self.loop.run_until_complete(task)
+        self.assertLess(time.time() - start, 5.0)
+
+    def test_many(self):
+        semaphore = asyncio.Semaphore(2)
+        coros = [aio.run_lilypond(self.make_ly('f%i.ly' % i), self.setts, semaphore=semaphore)
+                 for i in range(6)]
+        results = self.loop.run_until_complete(asyncio.gather(*coros))
+        self.assertTrue(all(result.succeeded for result in results))
+
+    def test_cache(self):
+        the_cache = PDFCache(os.path.join(self.directory, 'cache'))
+        pathname = self.make_ly('one.ly')
+        first = self.loop.run_until_complete(aio.run_lilypond(pathname, self.setts,
+                                                              cache=the_cache))
+        second = self.loop.run_until_complete(aio.run_lilypond(pathname, self.setts,
+                                                               cache=the_cache))
+        self.assertFalse(first.cached)
+        self.assertTrue(second.cached)
+        self.assertEqual(1, len(stub_calls(self.directory)))
+
+    def test_stats(self):
+        self.setts.stats = stats.ConversionStats()
+        coros = [aio.run_lilypond(self.make_ly('f%i.ly' % i), self.setts) for i in range(3)]
+        self.loop.run_until_complete(asyncio.gather(*coros))
+        self.assertEqual(3, self.setts.stats.lilypond_launches)
+        self.assertEqual(3, self.setts.stats.stage_calls['lilypond'])
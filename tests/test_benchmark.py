@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: test_benchmark.py
+# Purpose: Tests for the benchmarks in outputlilypond.benchmark
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+
+
+# Don't worry about missing docstrings
+# pylint: disable=C0111
+# Don't worry about "too many public methods"
+# pylint: disable=R0904
+
+import shutil
+import sys
+import tempfile
+import unittest
+from music21 import expressions, stream
+from outputlilypond import benchmark, functions, settings, LilyConverter
+if sys.version_info[0] > 2:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+
+class TestAnnotations(unittest.TestCase):
+    def test_measure(self):
+        meas = benchmark.make_annotated_measure(8)
+        self.assertEqual(8, len(meas.getElementsByClass(expressions.TextExpression)))
+        # every annotation is output
+        self.assertEqual(8, functions.measure_to_lily(meas).count(u'^\\markup{ "I" }'))
+
+    def test_bench(self):
+        results = benchmark.bench_annotations(sizes=(2, 4))
+        self.assertEqual([2, 4], [size for size, _, _ in results])
+        self.assertTrue(all(direct > 0.0 and extract > 0.0 for _, direct, extract in results))
+
+
+class TestMeasures(unittest.TestCase):
+    def test_part(self):
+        part = benchmark.make_long_part(3)
+        self.assertEqual(3, len(part.getElementsByClass('Measure')))
+        self.assertEqual([4.0, 4.0, 4.0], [bar_ql for _, bar_ql in functions.iterate_part(part)])
+
+    def test_bench(self):
+        results = benchmark.bench_measures(sizes=(2, 4))
+        self.assertEqual([2, 4], [size for size, _, _ in results])
+
+
+class TestScores(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        stub = benchmark.make_stub_lilypond(self.directory)
+        self.make_settings = lambda: settings.LilyPondSettings(
+            lilypond_path=stub, lilypond_version=benchmark.STUB_VERSION)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_synthetic_score(self):
+        the_score = benchmark.make_synthetic_score(3, 4, 5)
+        self.assertEqual(3, len(the_score.parts))
+        self.assertEqual(4, len(the_score.parts[0].getElementsByClass(stream.Measure)))
+        self.assertEqual(60, benchmark.count_notes(the_score))
+        self.assertEqual(5.0, the_score.parts[0].getElementsByClass(stream.Measure)[3]
+                         .barDuration.quarterLength)
+
+    def test_bench_score(self):
+        the_score = benchmark.make_synthetic_score(2, 2, 4)
+        converters = {'serial': benchmark.InProcessConverter()}
+        with LilyConverter(processes=1) as lily_conv:
+            converters['pooled'] = lily_conv
+            results = benchmark.bench_score(the_score, self.make_settings, converters, repeat=1)
+        self.assertEqual(16, results['notes'])
+        self.assertIsInstance(results['serial'], float)
+        self.assertIsInstance(results['pooled'], float)
+        self.assertEqual(2, len(results['parts']))
+        self.assertIn(u'\\version "2.18.2"', results['lily'])
+        if benchmark.tracemalloc is not None:
+            self.assertGreater(results['peak memory'], 0)
+
+    def test_bench_many(self):
+        results = benchmark.bench_many(u'test_corpus/bwv77.mxl', 2, processes=1, repeat=1)
+        self.assertEqual(['process_score', 'corpus, part mode', 'corpus, score mode'],
+                         list(results))
+
+    def test_bench_render(self):
+        self.assertGreater(benchmark.bench_render(u'{ c4 }', self.make_settings, repeat=1), 0.0)
+
+    def test_main(self):
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            benchmark.main(['synthetic', '--parts', '1', '--measures', '2', '--notes', '2',
+                            '--processes', '1', '--repeat', '1'])
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertIn('1 parts x 2 measures x 2 notes', output)
+        self.assertIn('notes/s', output)
+        self.assertIn('run_lilypond (stub)', output)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: test_cache.py
+# Purpose: Tests for the PDF cache in outputlilypond.cache
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+
+
+# Don't worry about missing docstrings
+# pylint: disable=C0111
+# Don't worry about "too many public methods"
+# pylint: disable=R0904
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import pytest
+from multiprocessing.pool import ThreadPool
+from music21 import converter, note, stream
+from outputlilypond import run_lilypond, run_lilypond_batch, process_score, LilyConverter, ir
+from outputlilypond.cache import PDFCache, PartCache
+from outputlilypond.settings import LilyPondSettings
+from lilypond_stub import stub_calls
+from test_render import RenderTestCase
+
+
+def with_analysis(the_score, annotation):
+    "Add a lily_analysis_voice part, with ``annotation`` on every note, to a copy of the score."
+    the_score = the_score.__deepcopy__()
+    analysis = stream.Part()
+    analysis.lily_analysis_voice = True
+    for _ in range(4):
+        the_note = note.Note('C4', quarterLength=4.0)
+        the_note.lily_markup = u'^"%s"' % annotation
+        analysis.append(the_note)
+    the_score.insert(0, analysis)
+    return the_score
+
+
+class TestPDFCache(RenderTestCase):
+    def setUp(self):
+        super(TestPDFCache, self).setUp()
+        self.cache = PDFCache(os.path.join(self.directory, 'cache'))
+
+    def runs(self):
+        "How many times LilyPond ran."
+        return len(stub_calls(self.directory))
+
+    def test_hit_skips_lilypond(self):
+        first = run_lilypond(self.make_ly('one.ly'), self.setts, cache=self.cache)
+        self.assertFalse(first.cached)
+        os.remove(first.pdf_filename)
+        # same source in another file
+        second = run_lilypond(self.make_ly('two.ly'), self.setts, cache=self.cache)
+        self.assertTrue(second.cached)
+        self.assertTrue(second.succeeded)
+        self.assertEqual(1, self.runs())
+        with open(second.pdf_filename) as pdf:
+            self.assertEqual(u'%PDF-stub\n{ c4 }', pdf.read())
+
+    def test_changes_miss(self):
+        run_lilypond(self.make_ly('one.ly'), self.setts, cache=self.cache)
+        # different source
+        run_lilypond(self.make_ly('one.ly', u'{ d4 }'), self.setts, cache=self.cache)
+        self.assertEqual(2, self.runs())
+        # different LilyPond version
+        newer = LilyPondSettings(lilypond_path=self.setts.get_property('lilypond_path'),
+                                 lilypond_version='2.19.0')
+        result = run_lilypond(self.make_ly('one.ly'), newer, cache=self.cache)
+        self.assertFalse(result.cached)
+        self.assertEqual(3, self.runs())
+
+    def test_failure_not_cached(self):
+        run_lilypond(self.make_ly('bad.ly', u'fail'), self.setts, cache=self.cache)
+        result = run_lilypond(self.make_ly('bad.ly', u'fail'), self.setts, cache=self.cache)
+        self.assertFalse(result.succeeded)
+        self.assertEqual(2, self.runs())
+
+    def test_batch(self):
+        filenames = [self.make_ly('f%i.ly' % i, u'{ c%i }' % i) for i in range(4)]
+        list(run_lilypond_batch(filenames, self.setts, max_jobs=2, cache=self.cache))
+        results = list(run_lilypond_batch(filenames, self.setts, max_jobs=2, cache=self.cache))
+        self.assertTrue(all(result.cached for result in results))
+        self.assertEqual(4, self.runs())
+
+    def test_lru_eviction(self):
+        pdf_size = len(u'%PDF-stub\n{ c1 }')
+        the_cache = PDFCache(os.path.join(self.directory, 'small'), max_size=2 * pdf_size)
+        first, second, third = [self.make_ly('f%i.ly' % i, u'{ c%i }' % i) for i in range(3)]
+        run_lilypond(first, self.setts, cache=the_cache)
+        run_lilypond(second, self.setts, cache=the_cache)
+        # make "first" the most recently used, so "second" is evicted
+        past = time.time() - 100
+        for each_name in os.listdir(the_cache.directory):
+            os.utime(os.path.join(the_cache.directory, each_name), (past, past))
+        self.assertTrue(run_lilypond(first, self.setts, cache=the_cache).cached)
+        run_lilypond(third, self.setts, cache=the_cache)
+        self.assertEqual(2, len(os.listdir(the_cache.directory)))
+        self.assertTrue(run_lilypond(first, self.setts, cache=the_cache).cached)
+        self.assertTrue(run_lilypond(third, self.setts, cache=the_cache).cached)
+        self.assertFalse(run_lilypond(second, self.setts, cache=the_cache).cached)
+
+    def test_concurrent_writers(self):
+        # many threads storing the same PDF leave one complete file and no temporary files
+        pdf = self.make_ly('one.pdf', u'%PDF-stub\n' + u'x' * 100000)
+        pool = ThreadPool(8)
+        pool.map(lambda _: self.cache.put('abc', pdf), range(32))
+        pool.close()
+        pool.join()
+        self.assertEqual(['abc.pdf'], os.listdir(self.cache.directory))
+        self.assertTrue(self.cache.get('abc', os.path.join(self.directory, 'out.pdf')))
+        self.assertEqual(os.path.getsize(pdf), os.path.getsize(os.path.join(self.directory,
+                                                                            'out.pdf')))
+
+    def test_miss(self):
+        self.assertFalse(self.cache.get('nothing', os.path.join(self.directory, 'out.pdf')))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'out.pdf')))
+
+    def test_bad_max_size(self):
+        with pytest.raises(ValueError):
+            PDFCache(self.directory, max_size=-1)
+
+
+class TestPartCache(unittest.TestCase):
+    def setUp(self):
+        self.bach = converter.parse('test_corpus/bwv77.mxl')
+
+    def test_unchanged_parts_reused(self):
+        the_cache = PartCache()
+        first_score = with_analysis(self.bach, u'I')
+        first = process_score(first_score, LilyPondSettings(), part_cache=the_cache)
+        self.assertEqual((0, 5), (the_cache.hits, the_cache.misses))
+        self.assertEqual(process_score(first_score, LilyPondSettings()), first)
+
+        # only the analysis part changed
+        second_score = with_analysis(self.bach, u'V')
+        second = process_score(second_score, LilyPondSettings(), part_cache=the_cache)
+        self.assertEqual((4, 6), (the_cache.hits, the_cache.misses))
+        self.assertEqual(process_score(second_score, LilyPondSettings()), second)
+        self.assertIn(u'\\new VisAnnotation', second)
+        self.assertIn(u'^"V"', second)
+        self.assertEqual(4, second.count(u'\\new Staff ='))
+
+    def test_part_names_unique(self):
+        # the same part twice in a score gets two names
+        the_score = stream.Score()
+        the_score.insert(0, self.bach.parts[0])
+        the_score.insert(0, self.bach.parts[0].__deepcopy__())
+        actual = process_score(the_score, LilyPondSettings(), part_cache=PartCache())
+        names = set(line[:-2] for line in actual.split(u'\n') if line.endswith(u' ='))
+        self.assertEqual(2, len(names))
+
+    def test_settings_in_key(self):
+        part_ir = ir.extract_part(self.bach.parts[0])
+        setts = LilyPondSettings()
+        plain = PartCache.make_key(part_ir, setts)
+        setts.set_property('bar numbers', u'#all-visible')
+        self.assertNotEqual(plain, PartCache.make_key(part_ir, setts))
+
+    def test_converter_and_chunks(self):
+        the_cache = PartCache()
+        with LilyConverter(processes=2, measures_per_chunk=3, part_cache=the_cache) as lily_conv:
+            first = lily_conv.process_score(self.bach, LilyPondSettings())
+            second = lily_conv.process_score(self.bach, LilyPondSettings())
+        self.assertEqual((4, 4), (the_cache.hits, the_cache.misses))
+        self.assertEqual(first, second)
+
+    def test_disk_tier(self):
+        directory = tempfile.mkdtemp()
+        try:
+            process_score(self.bach, LilyPondSettings(), part_cache=PartCache(directory=directory))
+            the_cache = PartCache(directory=directory)
+            process_score(self.bach, LilyPondSettings(), part_cache=the_cache)
+            self.assertEqual((4, 0), (the_cache.hits, the_cache.misses))
+            self.assertFalse([name for name in os.listdir(directory) if name.endswith('.tmp')])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_lru(self):
+        the_cache = PartCache(max_entries=2)
+        the_cache.put('a', u'A')
+        the_cache.put('b', u'B')
+        the_cache.get('a')
+        the_cache.put('c', u'C')
+        self.assertEqual(2, len(the_cache))
+        self.assertIsNone(the_cache.get('b'))
+        self.assertEqual(u'A', the_cache.get('a'))
+        self.assertEqual(u'C', the_cache.get('c'))
+
+    def test_bad_max_entries(self):
+        with pytest.raises(ValueError):
+            PartCache(max_entries=0)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: test_cli.py
+# Purpose: Tests for the command-line interface in outputlilypond.cli
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+
+
+# Don't worry about missing docstrings
+# pylint: disable=C0111
+# Don't worry about "too many public methods"
+# pylint: disable=R0904
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from outputlilypond import cli, process_score
+from outputlilypond.settings import LilyPondSettings
+from music21 import converter
+from lilypond_stub import make_stub, stub_calls
+if sys.version_info[0] > 2:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+
+CORPUS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test_corpus')
+
+
+class CLITestCase(unittest.TestCase):
+    "Make a temporary directory with some scores, and the LilyPond stub."
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.inputs = os.path.join(self.directory, 'in')
+        self.outputs = os.path.join(self.directory, 'out')
+        os.makedirs(os.path.join(self.inputs, 'sub'))
+        shutil.copy(os.path.join(CORPUS, 'bwv77.mxl'), self.inputs)
+        shutil.copy(os.path.join(CORPUS, 'bwv77.mxl'), os.path.join(self.inputs, 'sub', 'chorale.mxl'))
+        with open(os.path.join(self.inputs, 'notes.txt'), 'w') as other_file:
+            other_file.write('not a score')
+        self.stub_dir = os.path.join(self.directory, 'stub')
+        os.makedirs(self.stub_dir)
+        self.stub = make_stub(self.stub_dir).get_property('lilypond_path')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_cli(self, *args):
+        "Run the CLI with the stub LilyPond, and return the exit status and the output."
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            status = cli.main(['--lilypond', self.stub] + list(args))
+            return status, sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+
+class TestFindInputs(CLITestCase):
+    def test_directory(self):
+        jobs = cli.find_inputs([self.inputs], self.outputs)
+        self.assertEqual([cli.Job(os.path.join(self.inputs, 'bwv77.mxl'),
+                                  os.path.join(self.outputs, 'bwv77.ly')),
+                          cli.Job(os.path.join(self.inputs, 'sub', 'chorale.mxl'),
+                                  os.path.join(self.outputs, 'sub', 'chorale.ly'))],
+                         jobs)
+
+    def test_beside(self):
+        source = os.path.join(self.inputs, 'bwv77.mxl')
+        self.assertEqual([cli.Job(source, os.path.join(self.inputs, 'bwv77.ly'))],
+                         cli.find_inputs([source]))
+
+    def test_glob(self):
+        # and no duplicates
+        jobs = cli.find_inputs([os.path.join(self.inputs, '*', '*.mxl'),
+                                os.path.join(self.inputs, 'sub')],
+                               self.outputs)
+        self.assertEqual([cli.Job(os.path.join(self.inputs, 'sub', 'chorale.mxl'),
+                                  os.path.join(self.outputs, 'chorale.ly'))],
+                         jobs)
+
+    def test_missing(self):
+        self.assertRaises(ValueError, cli.find_inputs, [os.path.join(self.inputs, '*.mei')])
+
+    def test_same_output(self):
+        # two scores with the same name in different directories
+        other = os.path.join(self.inputs, 'sub', 'bwv77.mxl')
+        shutil.copy(os.path.join(self.inputs, 'bwv77.mxl'), other)
+        self.assertRaises(ValueError, cli.find_inputs,
+                          [os.path.join(self.inputs, 'bwv77.mxl'), other], self.outputs)
+        # they're fine beside their scores, or below an input directory
+        self.assertEqual(2, len(cli.find_inputs([os.path.join(self.inputs, 'bwv77.mxl'), other])))
+        self.assertEqual(3, len(cli.find_inputs([self.inputs], self.outputs)))
+
+
+class TestMain(CLITestCase):
+    def test_convert(self):
+        status, output = self.run_cli('--jobs', '2', '-o', self.outputs, self.inputs)
+        self.assertEqual(0, status)
+        self.assertIn(u'2 converted, 0 skipped, 0 failed', output)
+        with io.open(os.path.join(self.outputs, 'bwv77.ly'), encoding='utf-8') as ly_file:
+            actual = ly_file.read()
+        expect = process_score(converter.parse(os.path.join(self.inputs, 'bwv77.mxl')),
+                               LilyPondSettings(self.stub, '2.18.2'))
+        self.assertTrue(actual.startswith(expect))
+        # the hash is only for --skip-existing hash
+        self.assertNotIn(cli.HASH_COMMENT, actual)
+        self.assertTrue(os.path.exists(os.path.join(self.outputs, 'sub', 'chorale.ly')))
+        # LilyPond only ran to find its version
+        self.assertEqual([['--version']], stub_calls(self.stub_dir))
+
+    def test_pdf(self):
+        status, output = self.run_cli('--jobs', '1', '--pdf', '-o', self.outputs, self.inputs)
+        self.assertEqual(0, status)
+        self.assertIn(u'2 PDFs made, 0 failed', output)
+        self.assertTrue(os.path.exists(os.path.join(self.outputs, 'bwv77.pdf')))
+        self.assertTrue(os.path.exists(os.path.join(self.outputs, 'sub', 'chorale.pdf')))
+
+    def test_failure(self):
+        with open(os.path.join(self.inputs, 'bad.krn'), 'w') as bad_file:
+            bad_file.write('not kern\n')
+        status, output = self.run_cli('-q', '-o', self.outputs, self.inputs)
+        self.assertEqual(1, status)
+        self.assertIn(u'2 converted, 0 skipped, 1 failed', output)
+        self.assertIn(u'bad.krn: ', output)
+        self.assertNotIn(u'converted  ', output)  # it's quiet
+
+    def test_missing_input(self):
+        status, _ = self.run_cli(os.path.join(self.inputs, 'nothing.mxl'))
+        self.assertEqual(2, status)
+
+    def test_skip_mtime(self):
+        source = os.path.join(self.inputs, 'bwv77.mxl')
+        self.run_cli('-o', self.outputs, source)
+        _, output = self.run_cli('--skip-existing', 'mtime', '-o', self.outputs, source)
+        self.assertIn(u'0 converted, 1 skipped', output)
+        # the score is newer than its LilyPond file
+        later = time.time() + 10
+        os.utime(source, (later, later))
+        _, output = self.run_cli('--skip-existing', 'mtime', '-o', self.outputs, source)
+        self.assertIn(u'1 converted, 0 skipped', output)
+
+    def test_skip_missing_pdf(self):
+        source = os.path.join(self.inputs, 'bwv77.mxl')
+        self.run_cli('-o', self.outputs, source)
+        # the LilyPond file is up to date, but there's no PDF yet
+        _, output = self.run_cli('--skip-existing', 'mtime', '--pdf', '-o', self.outputs, source)
+        self.assertIn(u'1 converted, 0 skipped', output)
+        self.assertTrue(os.path.exists(os.path.join(self.outputs, 'bwv77.pdf')))
+        _, output = self.run_cli('--skip-existing', 'mtime', '--pdf', '-o', self.outputs, source)
+        self.assertIn(u'0 converted, 1 skipped', output)
+
+    def test_skip_hash(self):
+        source = os.path.join(self.inputs, 'sub', 'chorale.mxl')
+        self.run_cli('--skip-existing', 'hash', '-o', self.outputs, source)
+        with io.open(os.path.join(self.outputs, 'chorale.ly'), encoding='utf-8') as ly_file:
+            self.assertIn(cli.HASH_COMMENT, ly_file.read())
+        # the score is newer, but the same
+        later = time.time() + 10
+        os.utime(source, (later, later))
+        _, output = self.run_cli('--skip-existing', 'hash', '-o', self.outputs, source)
+        self.assertIn(u'0 converted, 1 skipped', output)
+        with open(source, 'a') as source_file:
+            source_file.write('\0')
+        _, output = self.run_cli('--skip-existing', 'hash', '-o', self.outputs, source)
+        self.assertIn(u'1 converted, 0 skipped', output)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: test_context.py
+# Purpose: Tests for the conversion context in outputlilypond.context
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+
+# Ignore warnings about missing docstrings
+# pylint: disable=C0111
+# Don't worry about "too many public methods"
+# pylint: disable=R0904
+
+import pickle
+import unittest
+from multiprocessing.pool import ThreadPool
+from music21 import converter, instrument, note, stream
+from outputlilypond import process_score, LilyConverter
+from outputlilypond.cache import PartCache
+from outputlilypond.context import ConversionContext
+from outputlilypond.core import LilyMultiprocessor, InlinePool
+from outputlilypond.settings import LilyPondSettings
+from test_cache import with_analysis
+
+
+BWV77 = converter.parse('test_corpus/bwv77.mxl')
+
+
+class TestConversionContext(unittest.TestCase):
+    def test_merge(self):
+        context = ConversionContext()
+        context.part_names.update([u'partaaaa', u'partaaab'])
+        context.analysis_notation_parts.append(u'partaaab')
+        other = ConversionContext()
+        other.part_names.add(u'partaaac')
+        other.parts_in_this_score.append(u'partaaac')
+        other.analysis_notation_parts.extend([u'partaaab', u'partaaac'])
+        context.merge(other)
+        self.assertEqual({u'partaaaa', u'partaaab', u'partaaac'}, context.part_names)
+        self.assertEqual([u'partaaab', u'partaaac'], context.analysis_notation_parts)
+        # the caller puts the parts in order
+        self.assertEqual([], context.parts_in_this_score)
+
+
+class TestSharedSettings(unittest.TestCase):
+    def setUp(self):
+        self.setts = LilyPondSettings()
+        # find LilyPond now, so that it doesn't look like the conversion changed the settings
+        self.setts.get_property('lilypond_version')
+
+    def test_unchanged(self):
+        before = pickle.dumps(self.setts)
+        with LilyConverter(processes=2) as lily_conv:
+            lily_conv.process_score(with_analysis(BWV77, u'I'), self.setts)
+        self.assertEqual(before, pickle.dumps(self.setts))
+
+    def test_analysis_parts_forgotten(self):
+        # the analysis part of one score doesn't change how the next score is written
+        with LilyConverter(processes=2) as lily_conv:
+            first = lily_conv.process_score(with_analysis(BWV77, u'I'), self.setts)
+            second = lily_conv.process_score(BWV77, self.setts)
+        self.assertEqual(1, first.count(u'\\new VisAnnotation'))
+        self.assertEqual(process_score(BWV77, LilyPondSettings()), second)
+
+    def test_cached_analysis_part(self):
+        the_cache = PartCache()
+        the_score = with_analysis(BWV77, u'I')
+        expect = process_score(the_score, self.setts, part_cache=the_cache)
+        actual = process_score(the_score, self.setts, part_cache=the_cache)
+        self.assertEqual(5, the_cache.hits)
+        self.assertEqual(expect, actual)
+        self.assertEqual(1, actual.count(u'\\new VisAnnotation'))
+
+    def test_cached_named_analysis_part(self):
+        # an analysis part with an instrument name is a normal staff, with or without the cache
+        the_cache = PartCache()
+        the_score = BWV77.__deepcopy__()
+        analysis = stream.Part()
+        analysis.lily_analysis_voice = True
+        analysis.insert(0, instrument.Instrument())
+        analysis.getInstrument().partName = u'Analysis'
+        analysis.append(note.Note('C4', quarterLength=4.0))
+        the_score.insert(0, analysis)
+        expect = process_score(the_score, self.setts, part_cache=the_cache)
+        actual = process_score(the_score, self.setts, part_cache=the_cache)
+        self.assertEqual(5, the_cache.hits)
+        self.assertEqual(expect, actual)
+        self.assertEqual(0, actual.count(u'\\new VisAnnotation'))
+
+    def test_threads(self):
+        # music21 objects aren't thread-safe, so every thread has its own score
+        scores = [BWV77.__deepcopy__() for _ in range(4)]
+        convert = lambda the_score: LilyMultiprocessor(the_score, self.setts, InlinePool()).run()
+        pool = ThreadPool(4)
+        try:
+            actual = pool.map(convert, scores)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual([process_score(BWV77, LilyPondSettings())] * 4, actual)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: test_ir.py
+# Purpose: Tests for the compact intermediate representation in outputlilypond.ir
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+
+# Don't worry about missing docstrings
+# pylint: disable=C0111
+# Don't worry about "too many public methods"
+# pylint: disable=R0904
+
+import pickle
+import unittest
+from music21 import (chord, clef, converter, duration, expressions, instrument, meter, note,
+                     stream, tie)
+from outputlilypond import functions, ir, problems
+from outputlilypond.context import ConversionContext
+from outputlilypond.settings import LilyPondSettings
+
+
+class TestPartIR(unittest.TestCase):
+    # NOTE: part names are random, so we compare everything after the first 8 characters
+    def check_score(self, pathname):
+        for each_part in converter.parse(pathname).parts:
+            expect = functions.part_to_lily(each_part, LilyPondSettings())
+            the_ir = pickle.loads(pickle.dumps(ir.extract_part(each_part), -1))
+            actual = ir.part_ir_to_lily(the_ir, LilyPondSettings())
+            self.assertEqual(expect[8:], actual[8:])
+
+    def test_bach(self):
+        self.check_score('test_corpus/bwv77.mxl')
+
+    def test_josquin(self):
+        self.check_score('test_corpus/Jos2308.krn')
+
+    def test_kyrie(self):
+        self.check_score('test_corpus/Kyrie.krn')
+
+    def test_analysis_with_instrument(self):
+        # an analysis part with an instrument name is output like a part without its contents
+        part = stream.Part()
+        part.lily_analysis_voice = True
+        part.insert(0, instrument.Instrument())
+        part.getInstrument().partName = u'Analysis'
+        part.append(note.Note('C4', quarterLength=4.0))
+        expect = functions.part_to_lily(part, LilyPondSettings())
+        actual = ir.part_ir_to_lily(ir.extract_part(part), LilyPondSettings())
+        self.assertEqual(expect[8:], actual[8:])
+        self.assertEqual([], ir.extract_part(part).items)
+
+    def test_analysis_part(self):
+        # only notes, rests, and chords are output in an analysis part
+        part = stream.Part()
+        part.lily_analysis_voice = True
+        part.append(clef.TrebleClef())
+        part.append(note.Note('C4', quarterLength=4.0))
+        part.append(chord.Chord(['C4', 'E4']))
+        the_ir = ir.extract_part(part)
+        self.assertEqual([ir.NOTE, ir.CHORD], [item.kind for item in the_ir.items])
+        self.assertIn(u'vis annotated analysis', ir.part_ir_to_lily(the_ir, LilyPondSettings()))
+
+    def test_the_index(self):
+        part = converter.parse('test_corpus/bwv77.mxl').parts[0]
+        context = ConversionContext()
+        actual = ir.part_ir_to_lily(ir.extract_part(part), LilyPondSettings(), 4, context=context)
+        self.assertEqual(4, actual[0])
+        self.assertEqual(actual[2], actual[1][:8])
+        self.assertEqual([actual[2]], context.parts_in_this_score)
+
+    def test_only_builtins(self):
+        # the IR must not hold any music21 objects, or we'd be pickling them again
+        def check(thing):
+            if isinstance(thing, (tuple, list)):
+                for each in thing:
+                    check(each)
+            else:
+                self.assertFalse(type(thing).__module__.startswith('music21'), repr(thing))
+        check(ir.extract_part(converter.parse('test_corpus/Jos2308.krn').parts[0]))
+
+
+class TestMeasureIR(unittest.TestCase):
+    def test_tuplets_and_partial(self):
+        measure_contents = [
+            note.Note('C4', quarterLength=0.25),
+            note.Note('D4', quarterLength=0.25),
+            note.Note('E4', quarterLength=0.25),
+        ]
+        for each_note in measure_contents:
+            each_note.duration.tuplets = (duration.Tuplet(3, 2, '16th'),)
+        meas = stream.Measure()
+        meas.timeSignature = meter.TimeSignature('4/4')
+        for thing in measure_contents:
+            meas.append(thing)
+        expect = functions.measure_to_lily(meas, True)
+        actual = ir.measure_ir_to_lily(ir.extract_measure(meas, True))
+        self.assertEqual(expect, actual)
+
+    def test_full_measure_rest(self):
+        meas = stream.Measure()
+        meas.append(meter.TimeSignature('3/4'))
+        meas.append(note.Rest(quarterLength=3.0))
+        self.assertEqual(u'\t\\time 3/4\n\tR2. |\n',
+                         ir.measure_ir_to_lily(ir.extract_measure(meas)))
+
+    def test_markup_before_first_note(self):
+        # a \markup{} that comes before any Note/Rest is attached to the next one
+        meas = stream.Measure()
+        meas.insert(0.0, note.Note('G4', quarterLength=4.0))
+        meas.insert(0.0, expressions.TextExpression(u'dolce'))
+        actual = ir.measure_ir_to_lily(ir.extract_measure(meas))
+        self.assertEqual(u'\tg\'1 ^\\markup{ "dolce" } |\n', actual)
+        self.assertEqual(actual, functions.measure_to_lily(meas))
+
+    def test_markup_follows_note(self):
+        # attaching markup without a search gives the same result as getElementBeforeOffset()
+        meas = stream.Measure()
+        meas.insert(0.0, expressions.TextExpression(u'a'))
+        meas.insert(0.0, note.Note('C4', quarterLength=1.0))
+        meas.insert(0.0, expressions.TextExpression(u'b'))
+        meas.insert(1.0, clef.TrebleClef())
+        meas.insert(1.0, note.Note('D4', quarterLength=1.0))
+        meas.insert(2.0, expressions.TextExpression(u'c'))
+        meas.insert(2.0, chord.Chord(['E4', 'G4'], quarterLength=1.0))
+        meas.insert(3.0, expressions.TextExpression(u'd'))
+        meas.insert(3.0, note.Rest(quarterLength=1.0))
+        meas.insert(3.0, expressions.TextExpression(u'e'))
+        expect = []
+        for obj in meas:
+            if isinstance(obj, expressions.TextExpression):
+                before = meas.getElementBeforeOffset(obj.offset)
+                expect.append(isinstance(before, (note.Note, note.Rest)))
+        self.assertEqual([False, False, True, False, False], expect)
+        the_ir = ir.extract_measure(meas)
+        actual = [event.follows_note for event in the_ir.events if ir.MARKUP == event.kind]
+        self.assertEqual(expect, actual)
+        self.assertEqual(ir.measure_ir_to_lily(the_ir), functions.measure_to_lily(meas))
+
+
+class TestNoteIR(unittest.TestCase):
+    def test_simple_notes(self):
+        # the notes found in the tables directly are the same as those converted the long way
+        tied = note.Note('F#5', quarterLength=1.5)
+        tied.tie = tie.Tie('start')
+        tied.lily_markup = u'^"x"'
+        hidden = note.Note('C4', quarterLength=0.5)
+        hidden.lily_invisible = True
+        for the_note in (tied, hidden, note.Rest(quarterLength=2.0), note.Note('B-2')):
+            self.assertEqual(functions.note_to_lily(the_note),
+                             ir.note_ir_to_lily(ir._extract_note(the_note)))
+
+    def test_not_in_tables(self):
+        # anything not in the tables takes the long way, which raises the usual exceptions
+        event = ir._extract_note(note.Note('C4'))
+        self.assertRaises(problems.UnidentifiedObjectError, ir.note_ir_to_lily,
+                          event._replace(head=(u'C', 20)))
+        self.assertRaises(problems.ImpossibleToProcessError, ir.note_ir_to_lily,
+                          event._replace(components=((5.0, 0, None),)))
+
+    def test_records(self):
+        event = ir._extract_note(note.Note('C4', quarterLength=0.5))
+        self.assertIsInstance(event, ir.NoteIR)
+        self.assertEqual((u'C', 4), event.head)
+        self.assertEqual(0.5, event.ql)
+        self.assertFalse(hasattr(event, '__dict__'))
+        self.assertEqual(event, pickle.loads(pickle.dumps(event, -1)))
+
+    def test_shared(self):
+        # equal pitches and durations are stored only once
+        first = ir._extract_note(note.Note('C4', quarterLength=0.5))
+        second = ir._extract_note(note.Note('C4', quarterLength=0.5))
+        self.assertIs(first.head, second.head)
+        self.assertIs(first.components, second.components)
+        the_chord = ir._extract_note(chord.Chord(['C4', 'E4'], quarterLength=0.5))
+        self.assertIs(first.head, the_chord.head[0])
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: test_main.py
+# Purpose: Tests for the score-level functions and classes in outputlilypond.__main__
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+
+# Don't worry about missing docstrings
+# pylint: disable=C0111
+# Don't worry about "too many public methods"
+# pylint: disable=R0904
+
+import io
+import re
+import time
+import unittest
+from multiprocessing.pool import ThreadPool
+import pytest
+import mock
+from music21 import bar, converter, note, stream
+from outputlilypond import benchmark, core, problems, stats, LilyConverter, process_corpus
+from outputlilypond.core import LilyMultiprocessor, InlinePool
+from outputlilypond.__main__ import process_score, process_score_iter, process_score_to
+from outputlilypond.settings import LilyPondSettings
+
+
+BACH_FILE = u'test_corpus/bwv77.mxl'
+BWV77 = converter.parse(BACH_FILE)
+JOSQUIN = converter.parse('test_corpus/Jos2308.krn')
+
+
+def with_bad_barline():
+    "Make a two-part Score where the second part has a barline style we can't convert."
+    the_score = stream.Score()
+    for i in range(2):
+        the_part = stream.Part()
+        the_measure = stream.Measure(number=1)
+        the_measure.append(note.Note('C4', quarterLength=4.0))
+        if 1 == i:
+            the_measure.rightBarline = bar.Barline('regular')
+            the_measure.rightBarline._style = 'bogus'  # music21 won't set this style itself
+        the_part.append(the_measure)
+        the_score.insert(0, the_part)
+    return the_score
+
+
+class TestLilyConverter(unittest.TestCase):
+    def test_pool_is_reused(self):
+        # the same worker pool serves two scores, and the output has all four parts
+        with LilyConverter(processes=2) as lily_conv:
+            first = lily_conv.process_score(BWV77, LilyPondSettings())
+            the_pool = lily_conv._pool
+            second = lily_conv.process_score(BWV77, LilyPondSettings())
+            self.assertIs(the_pool, lily_conv._pool)
+        self.assertEqual(4, first.count(u'\\new Staff ='))
+        self.assertEqual(4, second.count(u'\\new Staff ='))
+        self.assertIn(u"g'4 a'4 b'4 a'4 |", first)
+
+    def test_close(self):
+        # the pool starts only when required, and can start again after close()
+        lily_conv = LilyConverter(processes=1)
+        self.assertFalse(lily_conv.is_running)
+        lily_conv.process_score(BWV77, LilyPondSettings())
+        self.assertTrue(lily_conv.is_running)
+        lily_conv.close()
+        self.assertFalse(lily_conv.is_running)
+        lily_conv.process_score(BWV77, LilyPondSettings())
+        self.assertTrue(lily_conv.is_running)
+        lily_conv.terminate()
+        self.assertFalse(lily_conv.is_running)
+
+    def test_threads_start_one_pool(self):
+        # many threads may ask for the pool at once, as in aio, but only one pool is started
+        def slow_pool(processes):
+            time.sleep(0.05)
+            return mock.MagicMock()
+        lily_conv = LilyConverter(processes=1)
+        with mock.patch('outputlilypond.core.Pool', side_effect=slow_pool) as pool_class:
+            threads = ThreadPool(4)
+            try:
+                pools = threads.map(lambda _: lily_conv._get_pool(), range(4))
+            finally:
+                threads.close()
+                threads.join()
+            lily_conv.close()
+        self.assertEqual(1, pool_class.call_count)
+        self.assertEqual(1, len(set(id(each_pool) for each_pool in pools)))
+
+    def test_exception_terminates(self):
+        lily_conv = LilyConverter(processes=1)
+        with pytest.raises(RuntimeError):
+            with lily_conv:
+                lily_conv.process_score(BWV77, LilyPondSettings())
+                raise RuntimeError('boom')
+        self.assertFalse(lily_conv.is_running)
+
+    def test_bad_processes(self):
+        with pytest.raises(ValueError):
+            LilyConverter(processes=0)
+
+    def test_same_as_process_score(self):
+        with LilyConverter(processes=2) as lily_conv:
+            pooled = lily_conv.process_score(BWV77, LilyPondSettings())
+        unpooled = process_score(BWV77, LilyPondSettings())
+        self.assertEqual(unpooled, pooled)
+        self.assertIn(u'partaaaa =\n', pooled)
+
+    def test_inline_pool(self):
+        # a LilyMultiprocessor with an InlinePool makes the same file without worker processes
+        expect = process_score(BWV77, LilyPondSettings())
+        actual = LilyMultiprocessor(BWV77, LilyPondSettings(), InlinePool()).run()
+        self.assertEqual(expect, actual)
+
+    def test_worker_exception(self):
+        # a part that can't be converted raises, instead of disappearing from the file
+        with pytest.raises(problems.UnidentifiedObjectError):
+            process_score(with_bad_barline(), LilyPondSettings())
+        with LilyConverter(processes=2) as lily_conv:
+            with pytest.raises(problems.UnidentifiedObjectError):
+                lily_conv.process_score(with_bad_barline(), LilyPondSettings())
+
+    def test_same_every_time(self):
+        # the part names don't change, so the same score makes the same file
+        with LilyConverter(processes=2) as lily_conv:
+            first = lily_conv.process_score(BWV77, LilyPondSettings())
+            second = lily_conv.process_score(BWV77, LilyPondSettings())
+        self.assertEqual(first, second)
+        self.assertEqual([u'partaaaa', u'partaaab', u'partaaac', u'partaaad'],
+                         re.findall(r'^([a-z]{8}) =$', first, re.MULTILINE))
+
+
+class TestMeasureChunks(unittest.TestCase):
+    def test_josquin(self):
+        # long parts, where later chunks have full-measure rests but no time signature
+        expect = process_score(JOSQUIN, LilyPondSettings())
+        with LilyConverter(processes=2, measures_per_chunk=7) as lily_conv:
+            actual = lily_conv.process_score(JOSQUIN, LilyPondSettings())
+        self.assertEqual(expect, actual)
+        self.assertIn(u'R\\breve', actual)
+
+    def test_bach(self):
+        # the first chunk has a \partial measure
+        expect = process_score(BWV77, LilyPondSettings())
+        actual = process_score(BWV77, LilyPondSettings(), measures_per_chunk=1)
+        self.assertEqual(expect, actual)
+        self.assertIn(u'\\partial 4', actual)
+
+    def test_bad_chunk_size(self):
+        with pytest.raises(ValueError):
+            process_score(BWV77, LilyPondSettings(), measures_per_chunk=0)
+
+
+class TestStreaming(unittest.TestCase):
+    def test_iter(self):
+        expect = process_score(BWV77, LilyPondSettings())
+        pieces = list(process_score_iter(BWV77, LilyPondSettings()))
+        # header, metadata, four parts, then the \score block
+        self.assertEqual(7, len(pieces))
+        self.assertTrue(pieces[0].startswith(u'% LilyPond output'))
+        self.assertTrue(pieces[1].startswith(u'\\header'))
+        self.assertTrue(pieces[-1].startswith(u'\\score'))
+        self.assertEqual(expect, u''.join(pieces))
+
+    def test_to_file(self):
+        expect = process_score(BWV77, LilyPondSettings())
+        fileobj = io.StringIO()
+        process_score_to(BWV77, fileobj, LilyPondSettings(), measures_per_chunk=4)
+        self.assertEqual(expect, fileobj.getvalue())
+
+    def test_converter_stop_early(self):
+        # the converter's pool survives if we don't finish a generator
+        with LilyConverter(processes=2) as lily_conv:
+            pieces = lily_conv.process_score_iter(BWV77, LilyPondSettings())
+            next(pieces)
+            pieces.close()
+            fileobj = io.StringIO()
+            lily_conv.process_score_to(BWV77, fileobj, LilyPondSettings())
+        self.assertEqual(4, fileobj.getvalue().count(u'\\new Staff ='))
+
+
+class TestCorpus(unittest.TestCase):
+    def test_same_as_process_score(self):
+        # files and Score objects, in the order given
+        bach = process_score(BWV77, LilyPondSettings())
+        josquin = process_score(JOSQUIN, LilyPondSettings())
+        corpus = [BACH_FILE, JOSQUIN, BACH_FILE, BWV77]
+        actual = list(process_corpus(corpus, LilyPondSettings(), processes=2))
+        self.assertEqual([bach, josquin, bach, bach], actual)
+
+    def test_modes(self):
+        expect = process_score(BWV77, LilyPondSettings())
+        with LilyConverter(processes=2) as lily_conv:
+            for mode in (core.PART_MODE, core.SCORE_MODE):
+                actual = list(lily_conv.process_corpus([BACH_FILE, BWV77], mode=mode))
+                self.assertEqual([expect, expect], actual)
+
+    def test_scores_to_workers(self):
+        # in score mode, a Score is converted by a worker too
+        expect = process_score(JOSQUIN, LilyPondSettings())
+        with LilyConverter(processes=2) as lily_conv:
+            pool = lily_conv._get_pool()
+            with mock.patch.object(pool, 'apply_async', wraps=pool.apply_async) as apply_async:
+                actual = list(lily_conv.process_corpus([JOSQUIN, BWV77], mode=core.SCORE_MODE))
+        self.assertEqual([expect, process_score(BWV77, LilyPondSettings())], actual)
+        self.assertEqual(2, apply_async.call_count)
+        for each_call in apply_async.call_args_list:
+            self.assertIs(core._convert_score_ir, each_call[0][0])
+
+    def test_bad_mode(self):
+        with pytest.raises(ValueError):
+            LilyConverter().process_corpus([BACH_FILE], mode=u'measures')
+
+    def test_choose_mode(self):
+        lily_conv = LilyConverter()
+        large = benchmark.make_synthetic_score(2, core.LARGE_SCORE_MEASURES // 2, 1)
+        self.assertEqual(core.SCORE_MODE, lily_conv._choose_mode(BWV77, None))
+        self.assertEqual(core.PART_MODE, lily_conv._choose_mode(large, None))
+        self.assertEqual(core.SCORE_MODE, lily_conv._choose_mode(large, core.SCORE_MODE))
+        # there's nothing to share among the workers in a score with one part
+        self.assertEqual(core.SCORE_MODE, lily_conv._choose_mode(large.parts[0], None))
+
+    def test_stats(self):
+        # the stats of the files and scores converted by the workers are sent back
+        the_settings = LilyPondSettings()
+        the_settings.stats = stats.ConversionStats()
+        list(process_corpus([BACH_FILE, BWV77], the_settings, processes=2))
+        self.assertEqual(8, the_settings.stats.stage_calls['convert'])
+        self.assertEqual(8, the_settings.stats.stage_calls['extract'])
+        self.assertEqual(2, the_settings.stats.stage_calls['score block'])
+
+    def test_failure(self):
+        with pytest.raises(converter.ConverterException):
+            list(process_corpus([BACH_FILE, u'test_corpus/nothing.mxl'], processes=2))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: test_registry.py
+# Purpose: Tests for type dispatch in outputlilypond.registry, and register_element()
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+
+
+# Don't worry about missing docstrings
+# pylint: disable=C0111
+# Don't worry about "too many public methods"
+# pylint: disable=R0904
+
+import unittest
+import pytest
+from music21 import dynamics, note, stream
+from outputlilypond import functions, ir, process_score
+from outputlilypond.registry import TypeRegistry
+from outputlilypond.settings import LilyPondSettings
+
+
+class Base(object):
+    pass
+
+
+class Middle(Base):
+    pass
+
+
+class Leaf(Middle):
+    pass
+
+
+class TestTypeRegistry(unittest.TestCase):
+    def test_mro(self):
+        handlers = TypeRegistry(default='default')
+        handlers.register(Base, 'base')
+        self.assertEqual('base', handlers.lookup(Leaf))
+        self.assertEqual('default', handlers.lookup(int))
+        # registering a closer class replaces the cached lookup
+        handlers.register(Middle, 'middle')
+        self.assertEqual('middle', handlers.lookup(Leaf))
+        self.assertEqual('base', handlers.lookup(Base))
+        handlers.unregister(Middle)
+        self.assertEqual('base', handlers.lookup(Leaf))
+        self.assertIn(Base, handlers)
+        self.assertNotIn(Middle, handlers)
+
+    def test_decorator(self):
+        handlers = TypeRegistry()
+
+        @handlers.register(Middle)
+        def handle_middle(obj):
+            return 'handled'
+
+        self.assertIs(handle_middle, handlers.lookup(Leaf))
+        self.assertIsNone(handlers.lookup(Base))
+
+    def test_unregister_missing(self):
+        with pytest.raises(KeyError):
+            TypeRegistry().unregister(Base)
+
+
+class TestRegisterElement(unittest.TestCase):
+    def setUp(self):
+        functions.register_element(dynamics.Dynamic, lambda dyn: u'\\' + dyn.value + u' ')
+
+    def tearDown(self):
+        functions.ELEMENT_CONVERTERS.unregister(dynamics.Dynamic)
+        functions._MEASURE_HANDLERS.unregister(dynamics.Dynamic)
+
+    def make_measure(self):
+        meas = stream.Measure()
+        meas.append(note.Note('C4', quarterLength=2.0))
+        meas.append(dynamics.Dynamic('p'))
+        meas.append(note.Note('D4', quarterLength=2.0))
+        return meas
+
+    def test_measure_to_lily(self):
+        self.assertEqual(u"\tc'2 \\p d'2 |\n", functions.measure_to_lily(self.make_measure()))
+
+    def test_ir(self):
+        actual = ir.measure_ir_to_lily(ir.extract_measure(self.make_measure()))
+        self.assertEqual(u"\tc'2 \\p d'2 |\n", actual)
+
+    def test_process_score(self):
+        part = stream.Part()
+        part.append(self.make_measure())
+        the_score = stream.Score()
+        the_score.insert(0, part)
+        self.assertIn(u"c'2 \\p d'2 |", process_score(the_score, LilyPondSettings()))
+
+    def test_nothing(self):
+        # the converter may output nothing
+        functions.register_element(dynamics.Dynamic, lambda dyn: None)
+        self.assertEqual(u"\tc'2 d'2 |\n", functions.measure_to_lily(self.make_measure()))
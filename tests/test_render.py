@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: test_render.py
+# Purpose: Tests for running LilyPond, in outputlilypond.render
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+
+# Don't worry about missing docstrings
+# pylint: disable=C0111
+# Don't worry about "too many public methods"
+# pylint: disable=R0904
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import mock
+import pytest
+from outputlilypond import problems, render, run_lilypond
+from outputlilypond.cache import PDFCache
+from outputlilypond.settings import LilyPondSettings
+from lilypond_stub import make_stub, stub_calls
+
+
+class RenderTestCase(unittest.TestCase):
+    "Make a temporary directory with the LilyPond stub."
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.setts = make_stub(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_ly(self, name, contents=u'{ c4 }'):
+        pathname = os.path.join(self.directory, name)
+        with open(pathname, 'w') as ly_file:
+            ly_file.write(contents)
+        return pathname
+
+
+class TestRunLilyPond(RenderTestCase):
+    def test_success(self):
+        result = run_lilypond(self.make_ly('one.ly'), self.setts)
+        self.assertTrue(result.succeeded)
+        self.assertEqual(os.path.join(self.directory, 'one.pdf'), result.pdf_filename)
+        self.assertTrue(os.path.exists(result.pdf_filename))
+        self.assertIn(u'Processing', result.stderr)
+
+    def test_command(self):
+        pathname = self.make_ly('two.ly')
+        run_lilypond(pathname, self.setts)
+        expect = ['-dno-point-and-click', '-dsafe=#t', '--pdf',
+                  '-o', pathname[:-3], pathname]
+        self.assertEqual([expect], stub_calls(self.directory))
+
+    def test_failure(self):
+        result = run_lilypond(self.make_ly('bad.ly', u'fail'), self.setts)
+        self.assertFalse(result.succeeded)
+        self.assertEqual(1, result.returncode)
+        self.assertIn(u'error: syntax error', result.stderr)
+
+    def test_no_lilypond(self):
+        # if LilyPond can't be started, we try os.system()
+        setts = LilyPondSettings(lilypond_path=os.path.join(self.directory, 'nothing'),
+                                 lilypond_version='2.18.2')
+        with mock.patch('os.system') as mock_system:
+            self.assertIsNone(run_lilypond(self.make_ly('one.ly'), setts))
+        self.assertEqual(1, mock_system.call_count)
+
+    def test_missing_file(self):
+        # a file we can't read for the cache isn't given to os.system()
+        the_cache = PDFCache(tempfile.mkdtemp(dir=self.directory))
+        with mock.patch('os.system') as mock_system:
+            with pytest.raises(IOError):
+                run_lilypond(os.path.join(self.directory, 'missing.ly'), self.setts,
+                             cache=the_cache)
+        self.assertEqual(0, mock_system.call_count)
+
+
+class TestRunLilyPondBatch(RenderTestCase):
+    def test_batch(self):
+        good = [self.make_ly('good%i.ly' % i) for i in range(5)]
+        bad = self.make_ly('bad.ly', u'fail')
+        results = list(render.run_lilypond_batch(good + [bad], self.setts, max_jobs=3))
+        self.assertEqual(6, len(results))
+        by_name = dict((result.filename, result) for result in results)
+        for pathname in good:
+            self.assertTrue(by_name[pathname].succeeded)
+        self.assertFalse(by_name[bad].succeeded)
+        self.assertIn(u'error', by_name[bad].stderr)
+
+    def test_timeout(self):
+        slow = self.make_ly('slow.ly', u'sleep')
+        fast = self.make_ly('fast.ly')
+        results = list(render.run_lilypond_batch([slow, fast], self.setts, max_jobs=2,
+                                                 timeout=0.5))
+        # the fast one finishes first
+        self.assertEqual([fast, slow], [result.filename for result in results])
+        self.assertTrue(results[1].timed_out)
+        self.assertFalse(results[1].succeeded)
+        self.assertLess(results[1].elapsed, 5.0)
+
+    def test_no_lilypond(self):
+        setts = LilyPondSettings(lilypond_path=os.path.join(self.directory, 'nothing'),
+                                 lilypond_version='2.18.2')
+        results = list(render.run_lilypond_batch([self.make_ly('one.ly')], setts))
+        self.assertIsNone(results[0].returncode)
+        self.assertIn(u'Could not start LilyPond', results[0].stderr)
+
+    def test_bad_max_jobs(self):
+        with pytest.raises(ValueError):
+            render.run_lilypond_batch([], self.setts, max_jobs=0)
+
+
+class TestBatches(RenderTestCase):
+    def test_batches(self):
+        good = [self.make_ly('good%i.ly' % i) for i in range(5)]
+        results = list(render.run_lilypond_batch(good, self.setts, max_jobs=1, batch_size=3))
+        self.assertEqual(sorted(good), sorted(result.filename for result in results))
+        for result in results:
+            self.assertTrue(result.succeeded)
+            with open(result.pdf_filename) as pdf:
+                self.assertEqual(u'%PDF-stub\n{ c4 }', pdf.read())
+            # every file has its own output
+            self.assertIn(u'Processing `%s\'' % result.filename, result.stderr)
+            self.assertEqual(1, result.stderr.count(u'Processing'))
+        calls = stub_calls(self.directory)
+        self.assertEqual([3, 2], [len(call) - 5 for call in calls])
+        self.assertEqual(['-o', self.directory], calls[0][3:5])
+
+    def test_retry_failure(self):
+        good = [self.make_ly('good%i.ly' % i) for i in range(3)]
+        bad = self.make_ly('bad.ly', u'fail')
+        results = list(render.run_lilypond_batch(good[:2] + [bad] + good[2:], self.setts,
+                                                 batch_size=4))
+        by_name = dict((result.filename, result) for result in results)
+        self.assertEqual(4, len(by_name))
+        for pathname in good:
+            self.assertTrue(by_name[pathname].succeeded)
+        self.assertEqual(1, by_name[bad].returncode)
+        self.assertIn(u'error: syntax error', by_name[bad].stderr)
+        # the failed file was engraved again by itself
+        self.assertEqual([bad], stub_calls(self.directory)[1][5:])
+
+    def test_same_as_without_batches(self):
+        names = [self.make_ly('one.ly'), self.make_ly('two.txt'), self.make_ly('bad.ly', u'fail')]
+        os.mkdir(os.path.join(self.directory, 'sub'))
+        names.append(self.make_ly(os.path.join('sub', 'three.ly')))
+        expect = sorted((result.filename, result.pdf_filename, result.returncode)
+                        for result in render.run_lilypond_batch(names, self.setts))
+        actual = sorted((result.filename, result.pdf_filename, result.returncode)
+                        for result in render.run_lilypond_batch(names, self.setts, batch_size=10))
+        self.assertEqual(expect, actual)
+
+    def test_window(self):
+        def slowly():
+            for i in range(3):
+                yield self.make_ly('slow%i.ly' % i)
+                time.sleep(0.5 if 1 == i else 0.0)
+        results = list(render.run_lilypond_batch(slowly(), self.setts, batch_size=10,
+                                                 window=0.2))
+        self.assertEqual(3, len(results))
+        self.assertEqual([2, 1], [len(call) - 5 for call in stub_calls(self.directory)])
+
+    def test_cache(self):
+        the_cache = PDFCache(tempfile.mkdtemp(dir=self.directory))
+        names = [self.make_ly('one.ly'), self.make_ly('two.ly', u'{ d4 }')]
+        list(render.run_lilypond_batch(names[:1], self.setts, cache=the_cache))
+        results = list(render.run_lilypond_batch(names, self.setts, cache=the_cache,
+                                                 batch_size=2))
+        self.assertEqual([True, False], [result.cached for result in sorted(results)])
+        list(render.run_lilypond_batch(names, self.setts, cache=the_cache, batch_size=2))
+        self.assertEqual(2, len(stub_calls(self.directory)))
+
+    def test_bad_arguments(self):
+        with pytest.raises(ValueError):
+            render.run_lilypond_batch([], self.setts, batch_size=0)
+        with pytest.raises(ValueError):
+            render.run_lilypond_batch([], self.setts, batch_size=2, window=0)
+
+
+class TestRenderSource(RenderTestCase):
+    def leftovers(self):
+        "Everything in the directory but the stub and its log."
+        return sorted(set(os.listdir(self.directory)) - set(['lilypond', 'calls.log']))
+
+    def test_success(self):
+        pdf = render.render_source(u'{ c4 }', self.setts, directory=self.directory)
+        self.assertEqual(b'%PDF-stub\n{ c4 }', pdf)
+        calls = stub_calls(self.directory)
+        self.assertEqual(1, len(calls))
+        self.assertEqual(['-dno-point-and-click', '-dsafe=#t', '--pdf', '-o'], calls[0][:4])
+        self.assertEqual('-', calls[0][-1])
+        self.assertEqual([], self.leftovers())
+
+    def test_failure(self):
+        with pytest.raises(problems.LilyPondError) as err:
+            render.render_source(u'fail', self.setts, directory=self.directory)
+        self.assertEqual(1, err.value.result.returncode)
+        self.assertIn(u'error: syntax error', err.value.result.stderr)
+        self.assertEqual([], self.leftovers())
+
+    def test_timeout(self):
+        with pytest.raises(problems.LilyPondError) as err:
+            render.render_source(u'sleep', self.setts, timeout=0.5, directory=self.directory)
+        self.assertTrue(err.value.result.timed_out)
+        self.assertEqual([], self.leftovers())
+
+    def test_cache(self):
+        the_cache = PDFCache(tempfile.mkdtemp(dir=self.directory))
+        first = render.render_source(u'{ c4 }', self.setts, cache=the_cache)
+        second = render.render_source(u'{ c4 }', self.setts, cache=the_cache)
+        self.assertEqual(first, second)
+        self.assertEqual(1, len(stub_calls(self.directory)))
+        # a file with the same source is found in the cache too
+        result = run_lilypond(self.make_ly('same.ly', u'{ c4 }'), self.setts, cache=the_cache)
+        self.assertTrue(result.cached)
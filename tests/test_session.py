@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: test_session.py
+# Purpose: Tests for the incremental conversions in outputlilypond.session
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+
+# Ignore warnings about missing docstrings
+# pylint: disable=C0111
+# Don't worry about "too many public methods"
+# pylint: disable=R0904
+
+import unittest
+import mock
+from music21 import converter, meter, note, stream
+from outputlilypond import ir, process_score, IncrementalSession
+from outputlilypond.settings import LilyPondSettings
+from test_cache import with_analysis
+
+
+BWV77 = converter.parse('test_corpus/bwv77.mxl')
+
+
+def measure(the_score, part, number):
+    "Return a Measure of the score."
+    return the_score.parts[part].getElementsByClass(stream.Measure)[number]
+
+
+class TestIncrementalSession(unittest.TestCase):
+    def setUp(self):
+        self.setts = LilyPondSettings()
+        self.score = BWV77.__deepcopy__()
+        self.session = IncrementalSession(self.setts)
+        self.first = self.session.convert(self.score)
+        self.measures = self.session.misses
+
+    def test_first(self):
+        self.assertEqual(process_score(self.score, self.setts), self.first)
+        # the repeated measures are converted only once
+        number = sum(len(part.getElementsByClass(stream.Measure)) for part in self.score.parts)
+        self.assertEqual(number, self.session.hits + self.session.misses)
+        self.assertTrue(self.session.hits > 0)
+
+    def test_unchanged(self):
+        self.assertEqual(self.first, self.session.convert(self.score))
+        self.assertEqual(self.measures, self.session.misses)
+
+    def test_edit(self):
+        measure(self.score, 1, 3).notes[0].pitch.name = u'D'
+        actual = self.session.convert(self.score)
+        self.assertNotEqual(self.first, actual)
+        self.assertEqual(process_score(self.score, self.setts), actual)
+        self.assertEqual(self.measures + 1, self.session.misses)
+
+    def test_new_score(self):
+        # the same music in another Score object is found by the fingerprints
+        self.assertEqual(self.first, self.session.convert(BWV77.__deepcopy__()))
+        self.assertEqual(self.measures, self.session.misses)
+
+    def test_changed(self):
+        the_measure = measure(self.score, 2, 5)
+        the_measure.notes[0].pitch.octave -= 1
+        with mock.patch('outputlilypond.ir.extract_measure', wraps=ir.extract_measure) as m:
+            actual = self.session.convert(self.score, changed=[the_measure])
+        self.assertEqual(1, m.call_count)
+        self.assertEqual(process_score(self.score, self.setts), actual)
+        self.assertEqual(self.measures + 1, self.session.misses)
+
+    def test_changed_time_signature(self):
+        # a new TimeSignature changes the full-measure rests in the measures after it
+        later = measure(self.score, 0, 4)
+        for each_note in list(later.notesAndRests):
+            later.remove(each_note)
+        later.insert(0, note.Rest(quarterLength=4.0))
+        self.assertIn(u'R1', self.session.convert(self.score, changed=[later]))
+        the_measure = measure(self.score, 0, 2)
+        the_measure.insert(0, meter.TimeSignature('3/4'))
+        actual = self.session.convert(self.score, changed=[the_measure])
+        self.assertNotIn(u'R1', actual)
+        self.assertEqual(process_score(self.score, self.setts), actual)
+
+    def test_analysis_part(self):
+        the_score = with_analysis(self.score, u'I')
+        self.assertEqual(process_score(the_score, self.setts), self.session.convert(the_score))
+        the_score = with_analysis(self.score, u'V')
+        self.assertEqual(process_score(the_score, self.setts), self.session.convert(the_score))
+
+    def test_not_a_score(self):
+        the_part = self.score.parts[0]
+        self.assertEqual(process_score(the_part, self.setts), self.session.convert(the_part))
@@ -20,7 +20,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #--------------------------------------------------------------------------------------------------
 
+import os
 import unittest
+import mock
+from outputlilypond import settings
 from outputlilypond.settings import LilyPondSettings
 
 
@@ -30,11 +33,6 @@ class TestSettings(unittest.TestCase):
 
     def test_default_init(self):
         # Ensure all the settings are initialized to the proper default value.
-        # These must be removed in a later version, once the new class structure
-        # is implemented.
-        self.assertEqual(self.s._parts_in_this_score, [])
-        self.assertEqual(self.s._analysis_notation_parts, [])
-        # These will probably remain
         self.assertEqual(self.s._secret_settings['bar numbers'], None)
         self.assertEqual(self.s._secret_settings['tagline'], '')
         self.assertEqual(self.s._secret_settings['indent'], None)
@@ -155,3 +153,51 @@ class TestDetectLilyPond(unittest.TestCase):
 
     def test_make_lily_version_numbers_6(self):
         self.assertRaises(ValueError, LilyPondSettings.make_lily_version_numbers, '..')
+
+
+@mock.patch('outputlilypond.settings.subprocess.check_output')
+class TestLazyDetection(unittest.TestCase):
+    def setUp(self):
+        settings._detected_lilyponds.clear()
+
+    def tearDown(self):
+        settings._detected_lilyponds.clear()
+
+    def test_lazy(self, mock_check):
+        # detection happens only when it's required, and only once
+        mock_check.side_effect = [b'/opt/lilypond\n', b'GNU LilyPond 2.18.2\n\nCopyright']
+        setts = LilyPondSettings()
+        self.assertEqual(0, mock_check.call_count)
+        self.assertEqual(u'2.18.2', setts.get_property('lilypond_version'))
+        self.assertEqual(u'/opt/lilypond', setts.get_property('lilypond_path'))
+        self.assertEqual((2, 18, 2), setts.get_property('lilypond_version_numbers'))
+        self.assertEqual(u'/opt/lilypond', LilyPondSettings().get_property('lilypond_path'))
+        self.assertEqual(2, mock_check.call_count)
+
+    def test_constructor(self, mock_check):
+        setts = LilyPondSettings(lilypond_path='/opt/lilypond', lilypond_version='2.19.4')
+        self.assertEqual('/opt/lilypond', setts.get_property('lilypond_path'))
+        self.assertEqual('2.19.4', setts.get_property('lilypond_version'))
+        self.assertEqual((2, 19, 4), setts.get_property('lilypond_version_numbers'))
+        self.assertEqual(0, mock_check.call_count)
+
+    def test_environment(self, mock_check):
+        new_env = {settings.PATH_VARIABLE: '/opt/lilypond', settings.VERSION_VARIABLE: '2.19.4'}
+        with mock.patch.dict(os.environ, new_env):
+            setts = LilyPondSettings()
+        self.assertEqual('/opt/lilypond', setts.get_property('lilypond_path'))
+        self.assertEqual('2.19.4', setts.get_property('lilypond_version'))
+        self.assertEqual(0, mock_check.call_count)
+
+    def test_path_only(self, mock_check):
+        # with a known path, we don't need "which"
+        mock_check.return_value = b'GNU LilyPond 2.18.2\n'
+        setts = LilyPondSettings(lilypond_path='/opt/lilypond')
+        self.assertEqual(u'2.18.2', setts.get_property('lilypond_version'))
+        mock_check.assert_called_once_with(['/opt/lilypond', '--version'])
+
+    def test_not_installed(self, mock_check):
+        mock_check.side_effect = OSError
+        setts = LilyPondSettings()
+        self.assertEqual('lilypond', setts.get_property('lilypond_path'))
+        self.assertEqual('2.16.0', setts.get_property('lilypond_version'))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#--------------------------------------------------------------------------------------------------
+# Filename: test_stats.py
+# Purpose: Tests for the times and counters in outputlilypond.stats
+#
+# Copyright (C) 2016 Christopher Antila
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#--------------------------------------------------------------------------------------------------
+
+
+# Don't worry about missing docstrings
+# pylint: disable=C0111
+# Don't worry about "too many public methods"
+# pylint: disable=R0904
+
+import os
+import pickle
+import unittest
+from music21 import converter
+from outputlilypond import functions, process_score, run_lilypond, run_lilypond_batch, stats
+from outputlilypond.cache import PDFCache
+from outputlilypond.settings import LilyPondSettings
+from test_render import RenderTestCase
+
+
+BWV77 = converter.parse('test_corpus/bwv77.mxl')
+
+
+def settings_with_stats():
+    setts = LilyPondSettings()
+    setts.stats = stats.ConversionStats()
+    return setts
+
+
+class TestConversionStats(unittest.TestCase):
+    def test_add(self):
+        the_stats = stats.ConversionStats()
+        the_stats.add_time('extract', 1.5)
+        the_stats.add_time('extract', 0.5)
+        the_stats.add_part_time(u'partaaaa', 0.25)
+        the_stats.count_lilypond_launch()
+        self.assertEqual(2.0, the_stats.stage_times['extract'])
+        self.assertEqual(2, the_stats.stage_calls['extract'])
+        self.assertEqual(0.25, the_stats.part_times[u'partaaaa'])
+        self.assertEqual(1, the_stats.lilypond_launches)
+
+    def test_count_elements(self):
+        the_stats = stats.ConversionStats()
+        the_stats.count_elements(BWV77.parts[0])
+        self.assertEqual(len(BWV77.parts[0].flat.notes), the_stats.elements['Note'])
+        self.assertEqual(19, the_stats.elements['Measure'])
+        self.assertEqual(0, the_stats.elements['Part'])
+
+    def test_merge(self):
+        first = stats.ConversionStats()
+        first.add_time('convert', 1.0)
+        first.elements['Note'] = 3
+        second = stats.ConversionStats()
+        second.add_time('convert', 2.0)
+        second.add_part_time(u'partaaab', 2.0)
+        second.elements['Note'] = 4
+        second.count_lilypond_launch()
+        first.merge(second)
+        self.assertEqual(3.0, first.stage_times['convert'])
+        self.assertEqual(2, first.stage_calls['convert'])
+        self.assertEqual(2.0, first.part_times[u'partaaab'])
+        self.assertEqual(7, first.elements['Note'])
+        self.assertEqual(1, first.lilypond_launches)
+
+    def test_pickle(self):
+        # the worker processes get a copy of the settings
+        the_stats = stats.ConversionStats()
+        the_stats.add_time('extract', 1.0)
+        copied = pickle.loads(pickle.dumps(the_stats))
+        self.assertEqual(1.0, copied.stage_times['extract'])
+        copied.add_time('extract', 1.0)
+        self.assertEqual(2.0, copied.stage_times['extract'])
+
+    def test_timer(self):
+        the_stats = stats.ConversionStats()
+        with stats.timer(the_stats, 'wait'):
+            pass
+        self.assertEqual(1, the_stats.stage_calls['wait'])
+        with stats.timer(None, 'wait'):
+            pass  # nothing to record it in
+
+    def test_report(self):
+        the_stats = stats.ConversionStats()
+        the_stats.add_time('extract', 1.0)
+        the_stats.add_part_time(u'partaaaa', 0.5)
+        the_stats.elements['Note'] = 12
+        report = the_stats.report()
+        self.assertIn(u'extract              1.000        1', report)
+        self.assertIn(u'partaaaa             0.500', report)
+        self.assertIn(u'Note                    12', report)
+        self.assertIn(u'LilyPond launches: 0', report)
+
+
+class TestConversion(unittest.TestCase):
+    def check_bach(self, setts):
+        the_stats = setts.stats
+        for stage in ('extract', 'convert', 'wait', 'score block'):
+            self.assertIn(stage, the_stats.stage_times)
+        # "convert" comes from the workers, once per part
+        self.assertEqual(4, the_stats.stage_calls['convert'])
+        self.assertEqual(set(functions.part_name_for_number(i) for i in range(4)),
+                         set(the_stats.part_times))
+        self.assertEqual(len(BWV77.flat.notes), the_stats.elements['Note'])
+
+    def test_pooled(self):
+        setts = settings_with_stats()
+        actual = process_score(BWV77, setts)
+        self.check_bach(setts)
+        # the output doesn't change
+        self.assertEqual(process_score(BWV77, LilyPondSettings()), actual)
+
+    def test_chunks(self):
+        setts = settings_with_stats()
+        process_score(BWV77, setts, measures_per_chunk=5)
+        self.check_bach(setts)
+
+    def test_serial(self):
+        setts = settings_with_stats()
+        functions.stream_to_lily(BWV77.parts[1], setts)
+        self.assertEqual(1, setts.stats.stage_calls['convert'])
+        self.assertEqual([u'partaaaa'], list(setts.stats.part_times))
+        self.assertEqual(len(BWV77.parts[1].flat.notes), setts.stats.elements['Note'])
+
+
+class TestLilyPondLaunches(RenderTestCase):
+    def setUp(self):
+        super(TestLilyPondLaunches, self).setUp()
+        self.setts.stats = stats.ConversionStats()
+
+    def test_run_lilypond(self):
+        the_cache = PDFCache(os.path.join(self.directory, 'cache'))
+        run_lilypond(self.make_ly('one.ly'), self.setts, cache=the_cache)
+        run_lilypond(self.make_ly('one.ly'), self.setts, cache=the_cache)
+        # the second time, the PDF was in the cache
+        self.assertEqual(1, self.setts.stats.lilypond_launches)
+        self.assertEqual(2, self.setts.stats.stage_calls['lilypond'])
+
+    def test_batch(self):
+        names = [self.make_ly('{}.ly'.format(i)) for i in range(3)]
+        list(run_lilypond_batch(names, self.setts, max_jobs=2))
+        self.assertEqual(3, self.setts.stats.lilypond_launches)
+        self.assertEqual(3, self.setts.stats.stage_calls['lilypond'])
@@ -24,10 +24,12 @@ Unit tests for the "outputlilypond" module.
 """
 
 import unittest
+from fractions import Fraction
 import mock
 import pytest
-from music21 import clef, bar, duration, note, pitch, tie, chord, metadata
+from music21 import clef, bar, duration, meter, note, pitch, tie, chord, metadata, stream
 from outputlilypond import functions, problems, settings
+from outputlilypond.context import ConversionContext
 
 # Don't worry about missing docstrings
 # pylint: disable=C0111
@@ -85,6 +87,27 @@ class TestPitchToLily(unittest.TestCase):
         # Pitch without octave
         self.assertEqual(functions.pitch_to_lily(pitch.Pitch('F--11'), False), "feses")
 
+    def test_pitch_to_lily_6(self):
+        # quarter-tone accidentals
+        self.assertEqual(functions.pitch_to_lily(pitch.Pitch('C~4')), "cih'")
+        self.assertEqual(functions.pitch_to_lily(pitch.Pitch('D#~4')), "disih'")
+        self.assertEqual(functions.pitch_to_lily(pitch.Pitch('E`2')), "eeh,")
+        self.assertEqual(functions.pitch_to_lily(pitch.Pitch('B-`5')), "beseh''")
+
+    def test_pitch_to_lily_7(self):
+        # triple accidentals, without an octave
+        self.assertEqual(functions.pitch_to_lily(pitch.Pitch('G###')), "gisisis'")
+        self.assertEqual(functions.pitch_to_lily(pitch.Pitch('A---'), False), "aeseses")
+
+    def test_pitch_name_to_lily(self):
+        self.assertEqual(functions.pitch_name_to_lily(u'F#', 3), u'fis')
+        self.assertEqual(functions.pitch_name_to_lily(u'b-'), u'bes')
+        with pytest.raises(problems.UnidentifiedObjectError):
+            functions.pitch_name_to_lily(u'C4', 4)
+        with pytest.raises(problems.UnidentifiedObjectError) as exc:
+            functions.pitch_name_to_lily(u'C#', 13)
+        self.assertIn('Octave out of range', str(exc.value))
+
 
 class TestDurationToLily(unittest.TestCase):
     def test_duration_to_lily_1(self):
@@ -182,6 +205,33 @@ class TestDurationToLily(unittest.TestCase):
         actual = functions.duration_to_lily(duration.DurationTuple('whole', 0, 4.0))
         self.assertEqual(actual, expected)
 
+    def test_duration_to_lily_26(self):
+        # dotted tuplet component keeps its dot
+        dur = duration.Duration('eighth', dots=1)
+        dur.tuplets = (duration.Tuplet(3, 2, 'eighth'),)
+        self.assertEqual(u'8.', functions.duration_to_lily(dur, True))
+
+    def test_duration_to_lily_27(self):
+        # Fraction quarterLength
+        self.assertEqual(u'4..', functions.duration_to_lily(duration.Duration(Fraction(7, 4))))
+
+    def test_duration_table(self):
+        # the tables agree with music21 for every (type, dots) pair
+        for note_type in functions.TYPE_DICT:
+            for dots in range(functions.MAX_DOTS + 1):
+                dur = duration.Duration(note_type, dots=dots)
+                self.assertEqual(functions.note_type_to_lily(note_type, dots),
+                                 functions.quarter_length_to_lily(dur.quarterLength))
+
+    def test_quarter_length_to_lily_breaks(self):
+        with pytest.raises(problems.ImpossibleToProcessError) as exc:
+            functions.quarter_length_to_lily(1.25)
+        self.assertIn('1.25', str(exc.value))
+        with pytest.raises(problems.ImpossibleToProcessError):
+            functions.note_type_to_lily('quarter', 5)
+        with pytest.raises(problems.ImpossibleToProcessError):
+            functions.note_type_to_lily('2048th')
+
 
 class TestNoteToLily(unittest.TestCase):
     def test_note_to_lily_1(self):
@@ -632,3 +682,70 @@ class TestMetadataToLily(unittest.TestCase):
         self.assertEqual(1, mock_title.call_count)
         self.assertEqual(0, mock_alt_title.call_count)
         self.assertEqual(expected, actual)
+
+
+class TestIteratePart(unittest.TestCase):
+    @staticmethod
+    def make_part(signatures):
+        "Make a Part with a Measure for every member of ``signatures``, which are a TimeSignature "
+        "string (at the start of the Measure), a 2-tuple of offset and string, or None."
+        part = stream.Part()
+        for i, signature in enumerate(signatures):
+            meas = stream.Measure(number=i + 1)
+            meas.append(note.Rest(quarterLength=2.0))
+            if isinstance(signature, tuple):
+                meas.insert(signature[0], meter.TimeSignature(signature[1]))
+            elif signature is not None:
+                meas.insert(0.0, meter.TimeSignature(signature))
+            part.append(meas)
+        return part
+
+    def test_iterate_1(self):
+        # the TimeSignature is carried until it changes
+        part = self.make_part(['4/4', None, '3/4', None, None])
+        actual = list(functions.iterate_part(part))
+        self.assertEqual(list(part), [thing for thing, _ in actual])
+        self.assertEqual([4.0, 4.0, 3.0, 3.0, 3.0], [bar_ql for _, bar_ql in actual])
+
+    def test_iterate_2(self):
+        # same as Measure.barDuration, even for a TimeSignature that isn't at the start
+        part = self.make_part(['2/4', None, (1.0, '6/8'), None, '5/4'])
+        actual = [bar_ql for _, bar_ql in functions.iterate_part(part)]
+        self.assertEqual([meas.barDuration.quarterLength for meas in part], actual)
+
+    def test_iterate_3(self):
+        # before any TimeSignature, we don't know
+        part = self.make_part([None, None])
+        self.assertEqual([None, None], [bar_ql for _, bar_ql in functions.iterate_part(part)])
+
+    def test_full_measure_rests(self):
+        # the rests in 2/4 are full-measure rests; the rest in 4/4 isn't
+        part = self.make_part(['2/4', None, '4/4'])
+        expected = u'\t\\time 2/4\n\tR2 |\n\tR2 |\n\t\\time 4/4\n\tr2 |\n'
+        self.assertEqual(expected, u''.join(functions.measure_to_lily(meas, False, bar_ql)
+                                            for meas, bar_ql in functions.iterate_part(part)))
+        self.assertEqual(expected, u''.join(functions.measure_to_lily(meas) for meas in part))
+
+
+class TestPartNames(unittest.TestCase):
+    def test_part_name_for_number_1(self):
+        self.assertEqual(u'partaaaa', functions.part_name_for_number(0))
+        self.assertEqual(u'partaaab', functions.part_name_for_number(1))
+        self.assertEqual(u'partaaba', functions.part_name_for_number(26))
+        self.assertEqual(u'partzzzz', functions.part_name_for_number(26 ** 4 - 1))
+        self.assertEqual(u'paruaaaa', functions.part_name_for_number(26 ** 4))
+        self.assertEqual(u'zzzzzzzz', functions.part_name_for_number(26 ** 8 - 1 -
+                                                                     functions._FIRST_PART_NUMBER))
+
+    def test_part_name_for_number_2(self):
+        self.assertRaises(ValueError, functions.part_name_for_number, -1)
+        self.assertRaises(ValueError, functions.part_name_for_number,
+                          26 ** 8 - functions._FIRST_PART_NUMBER)
+
+    def test_new_part_name(self):
+        context = ConversionContext()
+        self.assertEqual(u'partaaaa', functions.new_part_name(context))
+        self.assertEqual(u'partaaab', functions.new_part_name(context, remember=False))
+        self.assertEqual(u'partaaac', functions.new_part_name(context))
+        self.assertEqual([u'partaaaa', u'partaaac'], context.parts_in_this_score)
+        self.assertEqual({u'partaaaa', u'partaaab', u'partaaac'}, context.part_names)